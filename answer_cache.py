@@ -0,0 +1,148 @@
+"""
+このファイルは、ユーザー間で共有する回答キャッシュをまとめたファイルです。
+質問文を正規化して埋め込んだベクトルの類似度で、ほぼ同じ質問への回答（と参照元の情報）を再利用します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+import streamlit as st
+from langchain_core.documents import Document
+import constants as ct
+
+
+############################################################
+# 関数定義
+############################################################
+
+def normalize_query(text):
+    """
+    表記揺れで別の質問と扱われないよう、質問文を正規化
+
+    Args:
+        text: ユーザー入力値
+
+    Returns:
+        正規化した質問文
+    """
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split()).lower()
+
+
+@st.cache_resource(show_spinner=False)
+def get_answer_cache():
+    """
+    プロセス全体で共有する回答キャッシュを取得
+
+    Returns:
+        AnswerCacheのインスタンス
+    """
+    return AnswerCache(
+        ct.ANSWER_CACHE_MAX_ENTRIES,
+        ct.ANSWER_CACHE_TTL_SECONDS,
+        ct.ANSWER_CACHE_SIMILARITY_THRESHOLD
+    )
+
+
+############################################################
+# クラス定義
+############################################################
+
+class AnswerCache:
+    """
+    質問ベクトルの類似度で引く回答キャッシュ
+    - 件数の上限（LRU）と有効期限（TTL）で古いものから破棄
+    - インデックスのバージョンが変わった場合、それ以前の回答は使わない
+    """
+
+    def __init__(self, max_entries, ttl_seconds, threshold):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        # 複数セッション（スレッド）から同時に使われるため、ロックで排他制御する
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._next_id = 0
+
+    def lookup(self, mode, index_version, vector):
+        """
+        類似度がしきい値以上の質問に対する回答を検索
+
+        Args:
+            mode: 回答モード
+            index_version: 現在のインデックスのバージョン
+            vector: 正規化した質問文の埋め込みベクトル
+
+        Returns:
+            LLMからの回答と同じ形式の辞書（「answer」「context」）。該当なしの場合はNone
+        """
+        query = self._normalize_vector(vector)
+        now = time.time()
+        with self._lock:
+            self._evict(index_version, now)
+
+            best_id, best_score = None, self.threshold
+            for entry_id, entry in self._entries.items():
+                if entry["mode"] != mode:
+                    continue
+                score = float(np.dot(entry["vector"], query))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                return None
+
+            # 最近使われた回答ほど残りやすくする
+            self._entries.move_to_end(best_id)
+            entry = self._entries[best_id]
+
+        return {
+            "answer": entry["answer"],
+            "context": [Document(page_content="", metadata=dict(metadata)) for metadata in entry["sources"]],
+        }
+
+    def store(self, mode, index_version, vector, llm_response):
+        """
+        回答と参照元の情報を保存
+
+        Args:
+            mode: 回答モード
+            index_version: 回答生成時のインデックスのバージョン
+            vector: 正規化した質問文の埋め込みベクトル
+            llm_response: LLMからの回答（「answer」「context」を含む辞書）
+        """
+        entry = {
+            "mode": mode,
+            "index_version": index_version,
+            "vector": self._normalize_vector(vector),
+            "answer": llm_response["answer"],
+            # 画面表示には参照元のありかだけを使うため、本文は保存しない
+            "sources": [dict(document.metadata) for document in llm_response["context"]],
+            "created_at": time.time(),
+        }
+        with self._lock:
+            self._entries[self._next_id] = entry
+            self._next_id += 1
+            self._evict(index_version, entry["created_at"])
+
+    def _evict(self, index_version, now):
+        # 有効期限切れ・インデックス更新前の回答を削除し、上限を超えた分は古いものから削除
+        stale_ids = [
+            entry_id for entry_id, entry in self._entries.items()
+            if entry["index_version"] != index_version or now - entry["created_at"] > self.ttl_seconds
+        ]
+        for entry_id in stale_ids:
+            del self._entries[entry_id]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def _normalize_vector(vector):
+        # 内積がそのままコサイン類似度になるよう、長さ1に正規化
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
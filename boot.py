@@ -0,0 +1,163 @@
+"""
+このファイルは、アプリ起動時の初期化処理を、依存関係の順に1回ずつ実行する仕組みをまとめたファイルです。
+各処理（ステージ）は実行単位を持ち、プロセスまたはセッションごとに完了済みであれば再実行時にスキップします。
+ステージごとの所要時間を記録するため、コールドスタートが遅くなった原因を確認できます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import logging
+import threading
+import time
+import constants as ct
+
+
+############################################################
+# 変数定義
+############################################################
+# プロセス内で完了済みのステージ名
+_completed_process_stages = set()
+# ステージごとの直近の所要時間・実行回数
+_timings = {}
+# 複数セッション（スレッド）から同時に起動された場合も、プロセス単位のステージを1回だけ実行するためのロック
+_lock = threading.RLock()
+
+
+############################################################
+# クラス定義
+############################################################
+
+class BootStage:
+    """
+    初期化処理の1ステージ
+    """
+
+    # 実行単位（「process」: プロセスごとに1回、「session」: セッションごとに1回、「run」: 画面読み込みのたび）
+    SCOPES = ("process", "session", "run")
+
+    def __init__(self, name, func, scope, requires=()):
+        """
+        Args:
+            name: ステージ名
+            func: 初期化処理を行う関数（引数なし）
+            scope: 実行単位
+            requires: 先に完了している必要があるステージ名のリスト
+        """
+        if scope not in self.SCOPES:
+            raise ValueError(f"未対応の実行単位です: {scope}")
+        self.name = name
+        self.func = func
+        self.scope = scope
+        self.requires = tuple(requires)
+
+
+############################################################
+# 関数定義
+############################################################
+
+def order_stages(stages):
+    """
+    ステージを、依存先が先になる順に並べ替え（依存関係がないステージ同士は元の順を保つ）
+
+    Args:
+        stages: BootStageのリスト
+
+    Returns:
+        並べ替えたBootStageのリスト
+    """
+    by_name = {stage.name: stage for stage in stages}
+    ordered = []
+    state = {}
+
+    def visit(stage, path):
+        if state.get(stage.name) == "done":
+            return
+        if state.get(stage.name) == "visiting":
+            raise ValueError(f"初期化処理の依存関係が循環しています: {' -> '.join(path + [stage.name])}")
+        state[stage.name] = "visiting"
+        for name in stage.requires:
+            if name not in by_name:
+                raise ValueError(f"初期化処理「{stage.name}」の依存先が見つかりません: {name}")
+            visit(by_name[name], path + [stage.name])
+        state[stage.name] = "done"
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage, [])
+    return ordered
+
+
+def record_timing(name, seconds):
+    # ステージの所要時間と実行回数を記録
+    entry = _timings.setdefault(name, {"seconds": 0.0, "runs": 0})
+    entry["seconds"] = round(seconds, 3)
+    entry["runs"] += 1
+
+
+def run_stage(stage, completed_session_stages):
+    """
+    実行単位に応じて、未完了の場合のみステージを実行
+
+    Args:
+        stage: BootStage
+        completed_session_stages: セッション内で完了済みのステージ名の集合
+
+    Returns:
+        実行した場合は所要時間（秒）、スキップした場合はNone
+    """
+    if stage.scope == "session" and stage.name in completed_session_stages:
+        return None
+    if stage.scope == "process":
+        # 他のセッションが実行中の場合は完了を待ち、完了済みであればスキップ
+        with _lock:
+            if stage.name in _completed_process_stages:
+                return None
+            start = time.perf_counter()
+            stage.func()
+            _completed_process_stages.add(stage.name)
+    else:
+        start = time.perf_counter()
+        stage.func()
+        if stage.scope == "session":
+            completed_session_stages.add(stage.name)
+    seconds = time.perf_counter() - start
+    with _lock:
+        record_timing(stage.name, seconds)
+    return seconds
+
+
+def run_stages(stages, completed_session_stages):
+    """
+    ステージを依存関係の順に実行（完了済みのステージはスキップ）
+    ステージで例外が発生した場合は完了扱いにせず、次回の画面読み込み時に再実行する
+
+    Args:
+        stages: BootStageのリスト
+        completed_session_stages: セッション内で完了済みのステージ名の集合（セッション側で保持する）
+
+    Returns:
+        今回実行したステージの {ステージ名: 所要時間（秒）}
+    """
+    executed = {}
+    for stage in order_stages(stages):
+        seconds = run_stage(stage, completed_session_stages)
+        if seconds is not None:
+            executed[stage.name] = round(seconds, 3)
+
+    # 画面読み込みのたびに実行するステージしか動いていない場合は、ログを出さない
+    scopes = {stage.name: stage.scope for stage in stages}
+    if any(scopes[name] != "run" for name in executed):
+        logging.getLogger(ct.LOGGER_NAME).info({"boot_stages": executed})
+    return executed
+
+
+def get_boot_timings():
+    """
+    各ステージの直近の所要時間と実行回数を取得
+
+    Returns:
+        {ステージ名: {"seconds": 直近の所要時間, "runs": 実行回数}}
+    """
+    with _lock:
+        return {name: dict(entry) for name, entry in _timings.items()}
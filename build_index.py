@@ -0,0 +1,261 @@
+"""
+このファイルは、RAGのインデックスをアプリとは別にオフラインで作成・更新・検証・整理するコマンドです。
+作成したインデックスは「ct.INDEX_ARTIFACT_ROOT」配下にバージョンごとのフォルダ（成果物）として保存し、
+検証に通ったものだけを公開中のバージョンに切り替えます。アプリは起動時に公開中の成果物を開くだけになります。
+
+使い方:
+    python build_index.py build    # データソースを全件読み込み、新しい成果物を作成して公開
+    python build_index.py update   # 公開中の成果物をコピーし、変更のあったデータソースのみを反映して公開
+    python build_index.py verify   # 公開中の成果物の整合性と、データソースとの差分を確認
+    python build_index.py compact  # 古いバージョン・作成途中で中断した成果物を削除
+
+オプション:
+    --workers N  データソース読み込みの並列数
+    --dry-run    読み込み・書き込みを行わず、実行内容のみを表示
+    --stats      実行後に、成果物のチャンク数・データソース数・ディスク使用量を表示
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import sys
+import json
+import logging
+import argparse
+from collections import Counter
+import constants as ct
+import retriever
+import ingestion
+import index_artifacts
+from sparse_index import load_sparse_index
+
+
+############################################################
+# 関数定義
+############################################################
+
+def setup_logger():
+    """
+    ログの出力先を標準エラー出力に設定（標準出力には実行結果のJSONのみを出す）
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+    if logger.hasHandlers():
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("[%(levelname)s] %(asctime)s: %(message)s"))
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+
+def print_result(result):
+    # 実行結果をJSONで標準出力に表示
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+def verify_index(index_dir, data_path, web_urls):
+    """
+    成果物の整合性（マニフェスト・ベクターストア・キーワード検索用インデックスの食い違い）と、
+    データソースとの差分を確認
+
+    Args:
+        index_dir: 成果物のフォルダ
+        data_path: データフォルダのパス
+        web_urls: 読み込み対象のWebページURL一覧
+
+    Returns:
+        {"index_dir", "problems"（整合性の問題のリスト）, "stale"（反映されていない差分）} の辞書
+    """
+    retriever.set_index_dir(index_dir)
+    problems = []
+    manifest = retriever.load_metadata()
+    if not manifest.get("sources"):
+        problems.append("マニフェストがないか、データソースが1件も記録されていません。")
+    elif not retriever.is_manifest_compatible(manifest, retriever.build_manifest({}, {})):
+        problems.append("埋め込みモデル・チャンク分割条件が現在の設定と異なります。作り直しが必要です。")
+
+    # マニフェストに記録したチャンクIDと、ベクターストア・キーワード検索用インデックスの中身を突き合わせる
+    manifest_ids = {chunk_id for entry in manifest.get("sources", {}).values() for chunk_id in entry["chunk_ids"]}
+    if manifest.get("chunk_count", 0) != len(manifest_ids):
+        problems.append(f"マニフェストのチャンク数が一致しません: chunk_count={manifest.get('chunk_count')}, チャンクID={len(manifest_ids)}")
+    if manifest_ids:
+        db = retriever.open_vector_store()
+        stored_ids = set(db._collection.get(include=[])["ids"])
+        if stored_ids != manifest_ids:
+            problems.append(
+                f"ベクターストアのチャンクがマニフェストと一致しません: "
+                f"不足={len(manifest_ids - stored_ids)}, 余分={len(stored_ids - manifest_ids)}"
+            )
+        sparse_index = load_sparse_index(retriever.get_sparse_index_path())
+        missing = sum(1 for chunk_id in manifest_ids if chunk_id not in sparse_index)
+        if missing or len(sparse_index) != len(manifest_ids):
+            problems.append(
+                f"キーワード検索用インデックスがマニフェストと一致しません: "
+                f"不足={missing}, 件数={len(sparse_index)}"
+            )
+
+    # データソースの変更が成果物に反映済みかを確認（問題ではなく、updateが必要かの目安）
+    plan = ingestion.get_sync_plan(index_dir, data_path, web_urls)
+    stale = {key: plan[key] for key in ["added", "modified", "deleted"] if plan[key]}
+    return {"index_dir": index_dir, "problems": problems, "stale": stale}
+
+
+def collect_stats(index_dir):
+    """
+    成果物の統計情報を取得
+
+    Args:
+        index_dir: 成果物のフォルダ
+
+    Returns:
+        {"version", "built_at", "chunks", "sources", "sources_by_category", "sources_by_file_type", "disk_bytes"} の辞書
+    """
+    retriever.set_index_dir(index_dir)
+    manifest = retriever.load_metadata()
+    sources = manifest.get("sources", {})
+    source_metadata = [retriever.build_source_metadata(source) for source in sources]
+    return {
+        "version": os.path.basename(os.path.normpath(index_dir)),
+        "built_at": manifest.get("built_at"),
+        "chunks": manifest.get("chunk_count", 0),
+        "sources": len(sources),
+        "sources_by_category": dict(Counter(metadata["category"] for metadata in source_metadata)),
+        "sources_by_file_type": dict(Counter(metadata["file_type"] for metadata in source_metadata)),
+        "disk_bytes": index_artifacts.get_dir_size(index_dir),
+    }
+
+
+def sync_and_publish(args, base_dir):
+    """
+    新しいバージョンの成果物を作成して同期し、検証に通った場合のみ公開
+
+    Args:
+        args: コマンドライン引数
+        base_dir: 差分更新の元にする成果物のフォルダ（Noneの場合は全件を新規に作成）
+
+    Returns:
+        終了コード
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+    web_urls = ct.WEB_URL_LOAD_TARGETS
+
+    if args.dry_run:
+        plan = ingestion.get_sync_plan(base_dir, args.data, web_urls)
+        print_result({"dry_run": True, "base_dir": base_dir, "plan": plan})
+        return 0
+
+    # 公開中の成果物は書き換えず、新しいフォルダで同期する
+    version_dir = retriever.create_index_version(args.root, base_dir=base_dir)
+    logger.info(f"インデックスの成果物を作成します: {version_dir}（元: {base_dir}）")
+    try:
+        retriever.set_index_dir(version_dir)
+        _, _, summary = ingestion.sync_index(args.data, web_urls, max_workers=args.workers)
+        report = verify_index(version_dir, args.data, web_urls)
+    finally:
+        # 成功・失敗にかかわらず作成中の目印を外す（失敗した成果物はcompactで削除される）
+        index_artifacts.finish_version_dir(version_dir)
+    if report["problems"]:
+        # 検証に通らない成果物は公開しない（compactで削除される）
+        logger.error(f"成果物の検証に失敗したため、公開しません: {report['problems']}")
+        print_result({"version_dir": version_dir, "summary": summary, "verify": report})
+        return 1
+
+    index_artifacts.publish_version(version_dir, args.root)
+    logger.info(f"インデックスの成果物を公開しました: {version_dir}")
+    result = {"version_dir": version_dir, "summary": summary}
+    if args.stats:
+        result["stats"] = collect_stats(version_dir)
+    print_result(result)
+    return 0
+
+
+def command_build(args):
+    # データソースを全件読み込み、新しい成果物を作成
+    return sync_and_publish(args, base_dir=None)
+
+
+def command_update(args):
+    # 公開中の成果物をもとに、変更のあったデータソースのみを反映（公開中のものがなければ全件作成）
+    base_dir = index_artifacts.get_current_dir(args.root)
+    if base_dir is None:
+        logging.getLogger(ct.LOGGER_NAME).info("公開中の成果物がないため、全件を作成します。")
+    return sync_and_publish(args, base_dir=base_dir)
+
+
+def command_verify(args):
+    # 公開中の成果物を検証（問題がある場合は終了コード1）
+    index_dir = index_artifacts.get_current_dir(args.root)
+    if index_dir is None:
+        print_result({"problems": ["公開中の成果物がありません。"]})
+        return 1
+    report = verify_index(index_dir, args.data, ct.WEB_URL_LOAD_TARGETS)
+    if args.stats:
+        report["stats"] = collect_stats(index_dir)
+    print_result(report)
+    return 1 if report["problems"] else 0
+
+
+def command_compact(args):
+    """
+    公開中のものを含む新しい順に ct.INDEX_ARTIFACT_KEEP 件を残し、古いバージョンを削除
+    作成に失敗した成果物と、書き込み途中の一時ファイルも削除する（作成中の成果物は削除しない）
+    """
+    result = index_artifacts.prune_versions(args.root, ct.INDEX_ARTIFACT_KEEP, dry_run=args.dry_run)
+    if not args.dry_run:
+        logging.getLogger(ct.LOGGER_NAME).info(f"古い成果物を削除しました: {result['removed']}")
+    result = dict(result, dry_run=args.dry_run)
+    if args.stats and result["current"] is not None:
+        result["stats"] = collect_stats(os.path.join(args.root, result["current"]))
+    print_result(result)
+    return 0
+
+
+def parse_args(argv=None):
+    """
+    コマンドライン引数の解析
+
+    Args:
+        argv: 引数のリスト（Noneの場合はsys.argv）
+
+    Returns:
+        解析結果
+    """
+    parser = argparse.ArgumentParser(description="RAGのインデックスをオフラインで作成・更新・検証・整理します。")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--workers", type=int, default=None, help="データソース読み込みの並列数（省略時はCPUコア数）")
+    common.add_argument("--dry-run", action="store_true", help="読み込み・書き込みを行わず、実行内容のみを表示")
+    common.add_argument("--stats", action="store_true", help="成果物のチャンク数・データソース数・ディスク使用量を表示")
+    common.add_argument("--data", default=ct.RAG_TOP_FOLDER_PATH, help="データフォルダのパス")
+    common.add_argument("--root", default=ct.INDEX_ARTIFACT_ROOT, help="成果物の格納先フォルダ")
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("build", parents=[common], help="全件を読み込み、新しい成果物を作成して公開")
+    subparsers.add_parser("update", parents=[common], help="変更のあったデータソースのみを反映した成果物を作成して公開")
+    subparsers.add_parser("verify", parents=[common], help="公開中の成果物の整合性とデータソースとの差分を確認")
+    subparsers.add_parser("compact", parents=[common], help="古いバージョン・作成途中の成果物を削除")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    コマンドの実行
+
+    Args:
+        argv: 引数のリスト（Noneの場合はsys.argv）
+
+    Returns:
+        終了コード
+    """
+    args = parse_args(argv)
+    setup_logger()
+    commands = {
+        "build": command_build,
+        "update": command_update,
+        "verify": command_verify,
+        "compact": command_compact,
+    }
+    return commands[args.command](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+このファイルは、「社内文書検索」モードでLLMを使わずに「該当資料なし」を判定する閾値
+（ct.DOC_SEARCH_MIN_SIMILARITY_MARGIN）を、ラベル付きの質問から求めるコマンドです。
+関連する社内文書がある質問・ない質問のそれぞれを作成済みのインデックスで検索し、
+類似度の「最上位 − 候補の中央値」が両者を最もよく分ける値を求めます。
+
+使い方:
+    python calibrate_doc_search.py                   # ct.DOC_SEARCH_CALIBRATION_QUERIES_PATH の質問で閾値を求める
+    python calibrate_doc_search.py --queries <path>  # 別のラベル付き質問ファイルを使う
+
+ラベル付き質問ファイルは、1行に1件の {"query": 質問, "relevant": 関連する社内文書があるか} のJSON形式です。
+求めた値は ct.DOC_SEARCH_MIN_SIMILARITY_MARGIN に反映し、実行時の埋め込みモデルと結果を記録してください。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import sys
+import json
+import argparse
+from dotenv import load_dotenv
+import constants as ct
+import embedding
+from doc_search import get_best_scores
+from initialize import open_indexed_retriever
+
+
+############################################################
+# 関数定義
+############################################################
+
+def load_labelled_queries(path):
+    """
+    ラベル付きの質問を読み込む
+
+    Args:
+        path: ラベル付き質問ファイルのパス
+
+    Returns:
+        {"query", "relevant"} の辞書のリスト
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def collect_scores(queries, indexed_retriever):
+    """
+    各質問を検索し、判定に使うスコアを取得
+
+    Args:
+        queries: load_labelled_queriesの戻り値
+        indexed_retriever: 作成済みのインデックスを開いたRetriever
+
+    Returns:
+        {"query", "relevant", "margin"（類似度の差）, "relevance_score"（語の一致率）} の辞書のリスト
+    """
+    samples = []
+    for item in queries:
+        margin, relevance_score = get_best_scores(indexed_retriever.invoke(item["query"]))
+        samples.append({
+            "query": item["query"],
+            "relevant": bool(item["relevant"]),
+            "margin": margin,
+            "relevance_score": relevance_score,
+        })
+    return samples
+
+
+def predict(sample, margin_threshold, term_overlap=ct.DOC_SEARCH_MIN_TERM_OVERLAP):
+    # doc_search.is_document_matchと同じ条件で、閾値を変えた場合の判定を求める
+    if sample["margin"] is not None and sample["margin"] >= margin_threshold:
+        return True
+    return sample["relevance_score"] is not None and sample["relevance_score"] >= term_overlap
+
+
+def evaluate_margin(samples, margin_threshold):
+    """
+    閾値を指定した場合の判定結果を集計
+
+    Args:
+        samples: collect_scoresの戻り値
+        margin_threshold: 類似度の差の閾値
+
+    Returns:
+        {"margin", "balanced_accuracy"（関連あり・なしの正解率の平均）,
+        "true_positive", "false_negative", "true_negative", "false_positive"} の辞書
+    """
+    counts = {"true_positive": 0, "false_negative": 0, "true_negative": 0, "false_positive": 0}
+    for sample in samples:
+        matched = predict(sample, margin_threshold)
+        if sample["relevant"]:
+            counts["true_positive" if matched else "false_negative"] += 1
+        else:
+            counts["false_positive" if matched else "true_negative"] += 1
+    recall = counts["true_positive"] / max(counts["true_positive"] + counts["false_negative"], 1)
+    specificity = counts["true_negative"] / max(counts["true_negative"] + counts["false_positive"], 1)
+    return dict(counts, margin=round(margin_threshold, 6), balanced_accuracy=round((recall + specificity) / 2, 4))
+
+
+def choose_margin(samples):
+    """
+    関連あり・なしの正解率の平均（balanced accuracy）が最も高くなる閾値を求める
+    （同率の場合は、無関係な質問を「該当あり」としにくい大きい方の値を選ぶ）
+
+    Args:
+        samples: collect_scoresの戻り値
+
+    Returns:
+        evaluate_marginの戻り値
+    """
+    margins = sorted({sample["margin"] for sample in samples if sample["margin"] is not None})
+    if not margins:
+        return evaluate_margin(samples, ct.DOC_SEARCH_MIN_SIMILARITY_MARGIN)
+    # 候補は、隣り合う実測値の中間と、最小値・最大値のすぐ外側
+    candidates = [margins[0] - 1e-6]
+    candidates += [(low + high) / 2 for low, high in zip(margins, margins[1:])]
+    candidates.append(margins[-1] + 1e-6)
+
+    best = None
+    for threshold in candidates:
+        result = evaluate_margin(samples, threshold)
+        if best is None or result["balanced_accuracy"] >= best["balanced_accuracy"]:
+            best = result
+    return best
+
+
+def parse_args(argv=None):
+    """
+    コマンドライン引数の解析
+
+    Args:
+        argv: 引数のリスト（Noneの場合はsys.argv）
+
+    Returns:
+        解析結果
+    """
+    parser = argparse.ArgumentParser(description="「社内文書検索」モードの該当資料なしの判定閾値を、ラベル付きの質問から求めます。")
+    parser.add_argument("--queries", default=ct.DOC_SEARCH_CALIBRATION_QUERIES_PATH, help="ラベル付き質問ファイルのパス")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    コマンドの実行
+
+    Args:
+        argv: 引数のリスト（Noneの場合はsys.argv）
+
+    Returns:
+        終了コード
+    """
+    args = parse_args(argv)
+    load_dotenv()
+    queries = load_labelled_queries(args.queries)
+    relevant_count = sum(1 for item in queries if item["relevant"])
+    if min(relevant_count, len(queries) - relevant_count) < ct.DOC_SEARCH_CALIBRATION_MIN_QUERIES:
+        print(json.dumps({"error": f"関連あり・なしの質問が、それぞれ{ct.DOC_SEARCH_CALIBRATION_MIN_QUERIES}件以上必要です。"}, ensure_ascii=False))
+        return 1
+
+    indexed_retriever = open_indexed_retriever()
+    if indexed_retriever is None:
+        print(json.dumps({"error": "使えるインデックスがありません。先にインデックスを作成してください。"}, ensure_ascii=False))
+        return 1
+
+    samples = collect_scores(queries, indexed_retriever)
+    print(json.dumps({
+        "embedding_model": embedding.get_embedding_model_name(),
+        "index_version": indexed_retriever.metadata["index_version"],
+        "current": evaluate_margin(samples, ct.DOC_SEARCH_MIN_SIMILARITY_MARGIN),
+        "suggested": choose_margin(samples),
+        "samples": samples,
+    }, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
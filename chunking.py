@@ -0,0 +1,256 @@
+"""
+このファイルは、インデックス作成時のチャンク分割をまとめたファイルです。
+- 文書の構造（PDFのページ、Word・議事録の見出し、CSVの行）を単位に分割し、単位の途中では区切らない
+- 見出しごとのセクションは、トークン数の上限に収まる範囲でまとめて1チャンクにする
+  （上限を超えるセクションのみ行単位で分割し、前のチャンクの末尾を一部重ねる）
+- サイズは埋め込みモデルのトークン数で測り、上限を超えるチャンク・ほぼ空のチャンクは埋め込みに送らない
+- 各チャンクには元の文書（ページ）内での開始位置を記録し、チャンクIDの作成とプロンプト作成時の結合に使う
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import bisect
+import re
+from langchain_core.documents import Document
+import constants as ct
+from token_counter import count_tokens, get_encoding, truncate_to_tokens
+
+
+############################################################
+# 変数定義
+############################################################
+# 空行を除いた1行分の範囲
+LINE_PATTERN = re.compile(r"[^\n]+")
+# セクションの開始とみなす見出し行
+HEADING_PATTERN = re.compile(ct.CHUNK_HEADING_PATTERN)
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_tokenizer_name(model=ct.EMBEDDING_MODEL):
+    # トークン数の計測方法（マニフェストに記録し、変わった場合はインデックスを作り直す）
+    encoding = get_encoding(model)
+    return encoding.name if encoding is not None else "estimate"
+
+
+def get_line_spans(text, start=0, end=None):
+    """
+    テキストの指定範囲内の、空行を除いた各行の範囲を取得
+
+    Args:
+        text: 対象のテキスト
+        start: 範囲の開始位置
+        end: 範囲の終了位置（省略時は末尾）
+
+    Returns:
+        （開始位置, 終了位置）のタプルのリスト（前後の空白は除く）
+    """
+    spans = []
+    for match in LINE_PATTERN.finditer(text, start, len(text) if end is None else end):
+        line = match.group()
+        stripped = line.strip()
+        if not stripped:
+            continue
+        line_start = match.start() + len(line) - len(line.lstrip())
+        spans.append((line_start, line_start + len(stripped)))
+    return spans
+
+
+def is_heading(line):
+    # 見出し行（「1.」「3.1」「第2章」「【...】」「■」などで始まる短い行）かを判定
+    return len(line) <= ct.CHUNK_HEADING_MAX_CHARS and HEADING_PATTERN.match(line) is not None
+
+
+def find_sections(text):
+    """
+    テキストを見出し行ごとのセクションに分ける
+
+    Args:
+        text: 対象のテキスト
+
+    Returns:
+        セクションの（開始位置, 終了位置）のタプルのリスト
+    """
+    sections = []
+    for start, end in get_line_spans(text):
+        if not sections or is_heading(text[start:end]):
+            sections.append([start, end])
+        else:
+            sections[-1][1] = end
+    return [tuple(section) for section in sections]
+
+
+def split_long_line(text, start, end, max_tokens, model):
+    # 1行だけで上限を超える場合は、トークン数の上限ごとに区切る
+    spans = []
+    while start < end:
+        piece = truncate_to_tokens(text[start:end], max_tokens, model)
+        # 1文字も収まらない場合も、必ず1文字は進める
+        length = max(len(piece), 1)
+        spans.append((start, start + length))
+        start += length
+    return spans
+
+
+def split_section(text, start, end, max_tokens, overlap_tokens, model):
+    """
+    上限を超えるセクションを、行単位で上限以内の範囲に分割
+    （前の範囲の末尾の行を、overlap_tokens以内で次の範囲の先頭に重ねる）
+
+    Args:
+        text: 対象のテキスト
+        start: セクションの開始位置
+        end: セクションの終了位置
+        max_tokens: 1範囲あたりのトークン数の上限
+        overlap_tokens: 重ねるトークン数の上限
+        model: トークン数の計測に使うモデル名
+
+    Returns:
+        （開始位置, 終了位置）のタプルのリスト
+    """
+    lines = []
+    for line_start, line_end in get_line_spans(text, start, end):
+        if count_tokens(text[line_start:line_end], model) > max_tokens:
+            lines.extend(split_long_line(text, line_start, line_end, max_tokens, model))
+        else:
+            lines.append((line_start, line_end))
+
+    spans = []
+    first = 0
+    while first < len(lines):
+        # 上限に収まるところまで行を追加（1行は必ず含める）
+        last = first
+        while last + 1 < len(lines) and count_tokens(text[lines[first][0]:lines[last + 1][1]], model) <= max_tokens:
+            last += 1
+        spans.append((lines[first][0], lines[last][1]))
+        if last + 1 >= len(lines):
+            break
+        # 次の範囲は、末尾の行のうち重ねる上限に収まる分だけ戻った位置から始める（必ず前に進める）
+        next_first = last + 1
+        while next_first - 1 > first and count_tokens(text[lines[next_first - 1][0]:lines[last][1]], model) <= overlap_tokens:
+            next_first -= 1
+        first = next_first
+    return spans
+
+
+def split_text(text, max_tokens, overlap_tokens, model, sections=None):
+    """
+    テキストを、見出しのセクションを崩さずにトークン数の上限以内の範囲に分割
+    上限に収まる隣り合うセクションは1つにまとめ、上限を超えるセクションのみ行単位で分割する
+
+    Args:
+        text: 対象のテキスト
+        max_tokens: 1範囲あたりのトークン数の上限
+        overlap_tokens: 行単位で分割する場合に重ねるトークン数の上限
+        model: トークン数の計測に使うモデル名
+        sections: 分割してよい位置を決めるセクションの（開始位置, 終了位置）のリスト
+            （省略時は見出し行から判定。CSVの場合は1行ずつのセクション）
+
+    Returns:
+        （開始位置, 終了位置）のタプルのリスト
+    """
+    if sections is None:
+        sections = find_sections(text)
+    pieces = []
+    for start, end in sections:
+        if count_tokens(text[start:end], model) <= max_tokens:
+            pieces.append((start, end))
+        else:
+            pieces.extend(split_section(text, start, end, max_tokens, overlap_tokens, model))
+
+    spans = []
+    for start, end in pieces:
+        # 直前の範囲と重ならず、まとめても上限に収まる場合は1つにまとめる
+        if spans and spans[-1][1] <= start and count_tokens(text[spans[-1][0]:end], model) <= max_tokens:
+            spans[-1] = (spans[-1][0], end)
+        else:
+            spans.append((start, end))
+    return spans
+
+
+def group_units(documents):
+    """
+    読み込んだドキュメントを、分割の単位（1ページ・1ファイル、CSVはファイル内の全行）にまとめる
+
+    Args:
+        documents: 1つのデータソースから読み込んだドキュメントのリスト
+
+    Returns:
+        （単位のテキスト, [(開始位置, 元のドキュメント)], セクションのリスト）のタプルのリスト
+        （セクションがNoneの場合は見出し行から判定する）
+    """
+    units = []
+    rows = []
+    for document in documents:
+        # CSVは1行ずつ読み込まれるため、行を区切り文字でつないで1つの単位にする
+        if document.metadata.get("file_type") == "csv" and "row" in document.metadata:
+            rows.append(document)
+        else:
+            units.append((document.page_content, [(0, document)], None))
+    if rows:
+        text = ct.CHUNK_ROW_SEPARATOR.join(document.page_content for document in rows)
+        # 各行の開始位置は、前の行までの長さと区切り文字の長さの累積
+        offsets = []
+        offset = 0
+        for document in rows:
+            offsets.append((offset, document))
+            offset += len(document.page_content) + len(ct.CHUNK_ROW_SEPARATOR)
+        # 1行（1件のレコード）を1セクションとし、行の途中では区切らない（1行だけで上限を超える場合のみ行内で分割）
+        sections = [(offset, offset + len(document.page_content)) for offset, document in offsets]
+        units.append((text, offsets, sections))
+    return units
+
+
+def split_documents(documents, max_tokens=None, overlap_tokens=None, min_tokens=None, model=ct.EMBEDDING_MODEL):
+    """
+    1つのデータソースから読み込んだドキュメントを、構造に沿ってチャンクに分割
+
+    Args:
+        documents: 1つのデータソースから読み込んだドキュメントのリスト
+        max_tokens: 1チャンクあたりのトークン数の上限（省略時は ct.CHUNK_MAX_TOKENS）
+        overlap_tokens: 行単位で分割する場合に重ねるトークン数の上限（省略時は ct.CHUNK_OVERLAP_TOKENS）
+        min_tokens: これ未満のチャンクは捨てる（省略時は ct.CHUNK_MIN_TOKENS）
+        model: トークン数の計測に使うモデル名
+
+    Returns:
+        チャンクのリスト（メタデータの「start_index」に単位内での開始位置を持つ）と、
+        {"units", "chunks", "dropped"} の集計のタプル
+    """
+    max_tokens = ct.CHUNK_MAX_TOKENS if max_tokens is None else max_tokens
+    overlap_tokens = ct.CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    min_tokens = ct.CHUNK_MIN_TOKENS if min_tokens is None else min_tokens
+
+    chunks = []
+    units = group_units(documents)
+    dropped = 0
+    for text, offsets, sections in units:
+        starts = [offset for offset, _ in offsets]
+        for start, end in split_text(text, max_tokens, overlap_tokens, model, sections):
+            content = text[start:end]
+            # ページ番号だけのページなど、ほぼ空のチャンクは埋め込みに送らない
+            if count_tokens(content, model) < min_tokens:
+                dropped += 1
+                continue
+            # チャンクの先頭を含む元のドキュメント（CSVの場合は行）のメタデータを引き継ぐ
+            source_document = offsets[bisect.bisect_right(starts, start) - 1][1]
+            chunks.append(Document(
+                page_content=content,
+                metadata=dict(source_document.metadata, start_index=start),
+            ))
+    return chunks, {"units": len(units), "chunks": len(chunks), "dropped": dropped}
+
+
+def get_chunk_offset(chunk):
+    """
+    チャンクの、データソース内での位置を表す文字列を取得（チャンクIDに使う）
+
+    Args:
+        chunk: split_documentsで作成したチャンク
+
+    Returns:
+        「<ページ番号>-<開始位置>」の形式の文字列（ページがない場合のページ番号は0）
+    """
+    return f"{chunk.metadata.get('page', 0):04d}-{chunk.metadata['start_index']:07d}"
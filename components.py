@@ -50,6 +50,56 @@ def display_select_mode():
         )
 
 
+def display_index_status(manager):
+    """
+    サイドバーに、社内文書のインデックスの作成状況を表示
+    （作成中は一定間隔で進捗表示のみを更新し、完了したら画面全体を再読み込みして新しいインデックスに切り替える）
+
+    Args:
+        manager: IndexBuildManagerのインスタンス
+    """
+    if manager.is_building():
+        st.fragment(display_index_progress, run_every=ct.INDEX_STATUS_REFRESH_SECONDS)(manager)
+    elif manager.status == "failed":
+        st.error(utils.build_error_message(ct.INDEX_BUILD_ERROR_MESSAGE), icon=ct.ERROR_ICON)
+        if st.button("インデックスの作成を再試行"):
+            manager.start(force=True)
+            st.rerun()
+
+
+def display_index_progress(manager):
+    """
+    インデックス作成の進捗（読み込んだファイル数・埋め込んだチャンク数・残り時間の見込み）を表示
+
+    Args:
+        manager: IndexBuildManagerのインスタンス
+    """
+    status = manager.snapshot()
+    # 作成が終わった場合や、作成中に前回のインデックスが使えるようになった場合は、
+    # 画面全体を再読み込みして検索に使うインデックスを切り替える
+    if status["status"] != "building" or (status["ready"] and st.session_state.get("retriever") is None):
+        st.rerun()
+
+    progress = status["progress"]
+    label = ct.INDEX_PHASE_LABELS.get(progress["phase"], progress["phase"])
+    if progress["phase"] == "load" and progress["files_total"]:
+        done, total = progress["files_loaded"], progress["files_total"]
+        text = f"{label}（{done} / {total} ファイル）"
+    elif progress["phase"] == "embed" and progress["chunks_total"]:
+        done, total = progress["chunks_embedded"], progress["chunks_total"]
+        text = f"{label}（{done} / {total} チャンク）"
+    else:
+        done, total = 0, 0
+        text = label
+    if progress["eta_seconds"] is not None:
+        text += f" 残り約{progress['eta_seconds']:.0f}秒"
+
+    st.progress(done / total if total else 0.0, text=text)
+    # 作成中も前回のインデックスで検索できる場合は、その旨を表示
+    if status["ready"]:
+        st.caption("作成が完了するまでは、前回作成したインデックスで検索します。")
+
+
 def display_initial_ai_message():
     """
     AIメッセージの初期表示（右側メイン画面）
@@ -182,8 +232,8 @@ def display_search_llm_response(llm_response):
         # ==========================================
         # メインドキュメント以外で、関連性が高いサブドキュメントを格納する用のリストを用意
         sub_choices = []
-        # 重複チェック用のリストを用意
-        duplicate_check_list = []
+        # 重複チェック用の集合を用意（メインドキュメントのファイルパスは最初から含めておく）
+        seen_file_paths = {main_file_path}
 
         # ドキュメントが2件以上検索できた場合（サブドキュメントが存在する場合）のみ、サブドキュメントのありかを一覧表示
         # 「source_documents」内のリストの2番目以降をスライスで参照（2番目以降がなければfor文内の処理は実行されない）
@@ -191,16 +241,12 @@ def display_search_llm_response(llm_response):
             # ドキュメントのファイルパスを取得
             sub_file_path = document.metadata["source"]
 
-            # メインドキュメントのファイルパスと重複している場合、処理をスキップ（表示しない）
-            if sub_file_path == main_file_path:
-                continue
-            
-            # 同じファイル内の異なる箇所を参照した場合、2件目以降のファイルパスに重複が発生する可能性があるため、重複を除去
-            if sub_file_path in duplicate_check_list:
+            # メインドキュメントと同じファイルや、同じファイル内の異なる箇所を参照した2件目以降は、処理をスキップ（表示しない）
+            if sub_file_path in seen_file_paths:
                 continue
 
-            # 重複チェック用のリストにファイルパスを順次追加
-            duplicate_check_list.append(sub_file_path)
+            # 重複チェック用の集合にファイルパスを順次追加
+            seen_file_paths.add(sub_file_path)
             
             # ページ番号が取得できない場合のための分岐処理
             if "page" in document.metadata:
@@ -285,59 +331,129 @@ def display_contact_llm_response(llm_response):
     st.markdown(llm_response["answer"])
 
     # ユーザーの質問・要望に適切な回答を行うための情報が、社内文書のデータベースに存在しなかった場合
+    message, file_info_list = None, None
     if llm_response["answer"] != ct.INQUIRY_NO_MATCH_ANSWER:
-        # 区切り線を表示
-        st.divider()
-
-        # 補足メッセージを表示
-        message = "情報源"
-        st.markdown(f"##### {message}")
-
-        # 参照元のファイルパスの一覧を格納するためのリストを用意
-        file_path_list = []
-        file_info_list = []
-
-        # LLMが回答生成の参照元として使ったドキュメントの一覧が「context」内のリストの中に入っているため、ループ処理
-        for document in llm_response["context"]:
-            # ファイルパスを取得
-            file_path = document.metadata["source"]
-            # ファイルパスの重複は除去
-            if file_path in file_path_list:
-                continue
+        message, file_info_list = display_contact_sources(llm_response["context"])
 
-            # PDFファイルの場合はページ番号を表示
-            if file_path.lower().endswith(".pdf"):
-                # ページ番号が取得できた場合はその値を使用、取得できない場合は1ページ目と仮定
-                if "page" in document.metadata:
-                    page_number = document.metadata["page"]
-                else:
-                    page_number = 1
-                # 「ファイルパス」と「ページ番号」
-                file_info = f"{file_path} (ページ: {page_number})"
+    return build_contact_content(llm_response["answer"], message, file_info_list)
+
+
+def display_contact_llm_response_stream(response_stream):
+    """
+    「社内問い合わせ」モードにおけるLLMレスポンスを、生成されたそばから順次表示
+
+    Args:
+        response_stream: utils.stream_llm_responseが返すジェネレーター
+
+    Returns:
+        LLMからの回答を画面表示用に整形した辞書データ（一括表示時と同じ形式）
+    """
+    # 回答の下に参照元を表示できるよう、表示エリアを先に確保
+    answer_box = st.empty()
+    sources_box = st.empty()
+
+    answer = ""
+    context = []
+    message, file_info_list = None, None
+    for kind, value in response_stream:
+        # 検索が完了した時点で、回答の生成を待たずに参照元を表示
+        if kind == "context":
+            context = value
+            with sources_box.container():
+                message, file_info_list = display_contact_sources(context)
+        # 回答は生成された分から順次表示（生成中はカーソルを表示）
+        elif kind == "answer":
+            answer += value
+            answer_box.markdown(answer + "▌")
+    answer_box.markdown(answer)
+
+    # 該当情報なしの回答だった場合、一括表示時と同じく参照元は表示しない
+    if answer == ct.INQUIRY_NO_MATCH_ANSWER:
+        sources_box.empty()
+        message, file_info_list = None, None
+    elif file_info_list is None:
+        with sources_box.container():
+            message, file_info_list = display_contact_sources(context)
+
+    return build_contact_content(answer, message, file_info_list)
+
+
+def display_contact_sources(context):
+    """
+    「社内問い合わせ」モードにおける、回答の参照元のありかを一覧表示
+
+    Args:
+        context: LLMが回答生成の参照元として使ったドキュメントのリスト
+
+    Returns:
+        補足メッセージと、参照元のファイル情報のリスト
+    """
+    # 区切り線を表示
+    st.divider()
+
+    # 補足メッセージを表示
+    message = "情報源"
+    st.markdown(f"##### {message}")
+
+    # 参照元のファイルパスの重複チェック用の集合を用意
+    seen_file_paths = set()
+    file_info_list = []
+
+    # LLMが回答生成の参照元として使ったドキュメントの一覧が「context」内のリストの中に入っているため、ループ処理
+    for document in context:
+        # ファイルパスを取得
+        file_path = document.metadata["source"]
+        # ファイルパスの重複は除去
+        if file_path in seen_file_paths:
+            continue
+
+        # PDFファイルの場合はページ番号を表示
+        if file_path.lower().endswith(".pdf"):
+            # ページ番号が取得できた場合はその値を使用、取得できない場合は1ページ目と仮定
+            if "page" in document.metadata:
+                page_number = document.metadata["page"]
             else:
-                # PDF以外の場合は「ファイルパス」のみ
-                file_info = f"{file_path}"
+                page_number = 1
+            # 「ファイルパス」と「ページ番号」
+            file_info = f"{file_path} (ページ: {page_number})"
+        else:
+            # PDF以外の場合は「ファイルパス」のみ
+            file_info = f"{file_path}"
 
-            # 参照元のありかに応じて、適したアイコンを取得
-            icon = utils.get_source_icon(file_path)
-            # ファイル情報を表示
-            st.info(file_info, icon=icon)
+        # 参照元のありかに応じて、適したアイコンを取得
+        icon = utils.get_source_icon(file_path)
+        # ファイル情報を表示
+        st.info(file_info, icon=icon)
+
+        # 重複チェック用に、ファイルパスを集合に順次追加
+        seen_file_paths.add(file_path)
+        # ファイル情報をリストに順次追加
+        file_info_list.append(file_info)
+
+    return message, file_info_list
 
-            # 重複チェック用に、ファイルパスをリストに順次追加
-            file_path_list.append(file_path)
-            # ファイル情報をリストに順次追加
-            file_info_list.append(file_info)
 
-    # 表示用の会話ログに格納するためのデータを用意
+def build_contact_content(answer, message, file_info_list):
+    """
+    「社内問い合わせ」モードの、表示用の会話ログに格納するためのデータを用意
+
+    Args:
+        answer: LLMからの回答
+        message: 参照元の補足メッセージ
+        file_info_list: 参照元のファイル情報のリスト
+
+    Returns:
+        LLMからの回答を画面表示用に整形した辞書データ
+    """
     # - 「mode」: モード（「社内文書検索」or「社内問い合わせ」）
     # - 「answer」: LLMからの回答
     # - 「message」: 補足メッセージ
     # - 「file_path_list」: ファイルパスの一覧リスト
     content = {}
     content["mode"] = ct.ANSWER_MODE_2
-    content["answer"] = llm_response["answer"]
+    content["answer"] = answer
     # 参照元のドキュメントが取得できた場合のみ
-    if llm_response["answer"] != ct.INQUIRY_NO_MATCH_ANSWER:
+    if answer != ct.INQUIRY_NO_MATCH_ANSWER:
         content["message"] = message
         content["file_info_list"] = file_info_list
 
@@ -30,6 +30,16 @@ SPINNER_TEXT = "回答生成中..."
 BOT_ICON = "🤖"  # ロボットアイコンの追加
 DEBUG_ICON = "🐞"  # デバッグ用のアイコン
 ADVICE_ICON = "💡"  # 助言・ヒント用のアイコン
+INDEX_STATUS_REFRESH_SECONDS = 1  # インデックス作成中に、サイドバーの進捗表示を更新する間隔（秒）
+# インデックス作成の工程ごとの表示文言
+INDEX_PHASE_LABELS = {
+    "open": "作成済みのインデックスを読み込み中",
+    "scan": "データソースの変更を確認中",
+    "load": "ファイルを読み込み中",
+    "embed": "チャンクを埋め込み中",
+    "finalize": "インデックスを保存中",
+}
+INDEXING_MESSAGE = "社内文書のインデックスを作成中です。完了すると、チャット欄からメッセージを送信できるようになります。"
 
 
 # ==========================================
@@ -46,14 +56,132 @@ APP_BOOT_MESSAGE = "アプリが起動されました。"
 # ==========================================
 MODEL = "gpt-4o-mini"
 TEMPERATURE = 0.5
+HTTP_MAX_CONNECTIONS = 20  # LLMへのリクエストで同時に使う接続数の上限
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 10  # 再利用のために保持しておく接続数
+HTTP_TIMEOUT = 60.0  # LLMへのリクエストのタイムアウト（秒）
+CHAIN_REGISTRY_MAX_ENTRIES = 16  # 作成済みのChainを保持しておく組み合わせ数の上限
+STREAM_INQUIRY_RESPONSE = True  # 「社内問い合わせ」モードの回答をストリーミング表示するか
 RETRIEVER_TOP_K = 30  # 網羅性を上げるために拡大
 MAX_CONTEXT_LENGTH = 12000  # データ量に余裕を持たせるために拡大
 
+# ==========================================
+# 検索クエリ作成（会話履歴を踏まえた書き換え）設定
+# ==========================================
+QUERY_REWRITE_CACHE_SIZE = 256  # 書き換え結果を保持する件数の上限
+STANDALONE_QUERY_MIN_LENGTH = 8  # これより短い入力は、前の話題を前提にしているとみなす
+# 前の話題を受ける接続表現（入力の先頭にある場合、書き換えが必要とみなす）
+CONTEXT_DEPENDENT_PREFIXES = ["では", "じゃあ", "それでは", "それから", "あと", "また", "他には", "ほかには", "で、", "なら"]
+# 前の発言を参照する表現（入力に含まれる場合、書き換えが必要とみなす）
+CONTEXT_DEPENDENT_WORDS = [
+    "それ", "その", "これ", "この", "あれ", "あの", "そこ", "そちら", "こちら",
+    "上記", "前述", "先ほど", "さっき", "前の", "同じ", "続き", "もっと詳しく", "彼", "彼女"
+]
+
+
+# ==========================================
+# 会話履歴（メモリ）設定
+# ==========================================
+MEMORY_MAX_TURNS = 6  # そのまま保持する直近のやりとりの数（それより前は要約にまとめる）
+MEMORY_MAX_TOKENS = 3000  # LLMに渡す会話履歴（要約文 + 直近のやりとり）のトークン数の上限
+MEMORY_SUMMARY_MAX_TOKENS = 500  # 要約文のトークン数の上限（MEMORY_MAX_TOKENSの内数）
+MEMORY_MESSAGE_OVERHEAD_TOKENS = 4  # メッセージ1件ごとに、本文以外で消費されるトークン数
+MEMORY_SUMMARY_TEMPERATURE = 0  # 会話履歴を要約する際の温度
+MEMORY_SUMMARY_PREFIX = "これまでの会話の要約:"  # 会話履歴の先頭に付ける要約文の見出し
+
+
+# ==========================================
+# 回答キャッシュ設定
+# ==========================================
+ANSWER_CACHE_ENABLED = True  # ほぼ同じ質問への回答を、ユーザー間で再利用するか
+ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.97  # 同じ質問とみなす、質問ベクトルのコサイン類似度の下限
+ANSWER_CACHE_TTL_SECONDS = 60 * 60  # 回答を再利用する期間（秒）
+ANSWER_CACHE_MAX_ENTRIES = 512  # 保持する回答の件数の上限
+
+
 # ==========================================
 # チャンク分割設定
 # ==========================================
-CHUNK_SIZE = 500       # チャンクの最大サイズ（文字数）
-CHUNK_OVERLAP = 50     # チャンク間のオーバーラップ（文字数）
+# チャンクのサイズは埋め込みモデルのトークン数で測る
+CHUNK_MAX_TOKENS = 600  # チャンクの最大サイズ（トークン数）
+CHUNK_OVERLAP_TOKENS = 50  # 長いセクションを行単位で分割する場合に、前のチャンクと重ねるトークン数の上限
+CHUNK_MIN_TOKENS = 16  # これ未満のチャンク（ページ番号だけのページなど）は埋め込みに送らない
+CHUNK_SEPARATOR = "\n"  # チャンク分割時の区切り文字（プロンプト作成時に隣接チャンクを結合する際にも使う）
+CHUNK_ROW_SEPARATOR = "\n\n"  # CSVの行をまとめて1チャンクにする際の区切り文字
+# セクションの開始とみなす見出し行（「1.」「3.1」「第2章」「【...】」「■」などで始まる短い行）
+CHUNK_HEADING_PATTERN = r"^(\d+(\.\d+)*\.?\s*\S|第[0-9０-９一二三四五六七八九十]+[章節条]|[【■◆●])"
+CHUNK_HEADING_MAX_CHARS = 40
+
+
+# ==========================================
+# ベクターストア設定系
+# ==========================================
+VECTOR_STORE_DIR = ".chroma"  # インデックス関連ファイルの格納先フォルダ（公開中の成果物がない場合）
+# chromadbは格納先フォルダ直下を自身のキャッシュ用に予約しているため、サブフォルダに永続化する
+VECTOR_STORE_SUBDIR = "vectors"
+VECTOR_STORE_COLLECTION_NAME = "company_documents"
+VECTOR_STORE_COPY_BATCH_SIZE = 1000  # 新しいバージョンへベクターストアをコピーする際の、1回あたりのチャンク数
+VECTOR_STORE_MANIFEST_FILE = "metadata.json"  # インデックス作成条件を記録するマニフェスト
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_BACKEND = "openai"  # 埋め込みモデル本体（「openai」または、APIを呼ばないローカル検証用の「fake」）
+FAKE_EMBEDDING_SIZE = 1536  # 「fake」使用時のベクトルの次元数
+EMBEDDING_CACHE_PATH = ".chroma/embedding_cache.sqlite3"  # 埋め込みキャッシュの保存先（成果物のバージョン間で共有）
+EMBEDDING_QUERY_CACHE_SIZE = 256  # 検索クエリの埋め込みをメモリ上に保持する件数（ディスクのキャッシュには保存しない）
+# オフライン（build_index.py）で作成したインデックスの成果物の格納先と、公開中のバージョン名を記録するファイル名
+# 公開中の成果物がある場合、アプリは作成・同期を行わずにその成果物を開く
+INDEX_ARTIFACT_ROOT = ".chroma/artifacts"
+INDEX_ARTIFACT_POINTER = "CURRENT"
+INDEX_ARTIFACT_KEEP = 3  # compact時に残す成果物のバージョン数（公開中のものを含む）
+# 作成中の成果物のフォルダに置く目印のファイル名（作成したプロセスのIDと開始日時を記録し、完了時に削除する）
+INDEX_ARTIFACT_BUILDING_MARKER = "BUILDING"
+# 作成したプロセスを確認できない場合も、この秒数以内に作成・更新された未完成の成果物は作成中とみなして削除しない
+INDEX_ARTIFACT_BUILD_GRACE_SECONDS = 6 * 60 * 60
+# アプリ内（公開中の成果物がない場合）で作成したインデックスの格納先
+# 同期のたびに新しいバージョンのフォルダで作成し、完了後に切り替える（検索中のコレクションは書き換えない）
+APP_INDEX_ROOT = ".chroma/app"
+EMBEDDING_BATCH_SIZE = 256  # 1リクエストあたりのテキスト件数
+EMBEDDING_MAX_CONCURRENCY = 4  # 同時に送信するリクエスト数の上限
+EMBEDDING_MAX_RETRIES = 5  # レート制限（429）時の最大リトライ回数
+EMBEDDING_RETRY_BASE_WAIT = 1.0  # リトライ待機時間の初期値（秒）
+EMBEDDING_RETRY_MAX_WAIT = 30.0  # リトライ待機時間の上限（秒）
+RETRIEVER_SEARCH_K = 5  # Retrieverが1回の検索で取得するチャンク数
+SPARSE_INDEX_FILE = "sparse_index.json"  # キーワード検索（BM25）用インデックスのファイル名（インデックスの格納先フォルダ内）
+BM25_K1 = 1.5  # BM25の語の出現回数の飽和度合い
+BM25_B = 0.75  # BM25の文書長による補正の強さ
+HYBRID_FETCH_K = 20  # 統合前に、ベクトル検索・キーワード検索のそれぞれで取得するチャンク数
+HYBRID_RRF_K = 60  # Reciprocal Rank Fusionで、下位の順位の影響を調整する定数
+RERANK_ENABLED = True  # 検索結果を、検索クエリとの関連度を計算し直して並べ替えるか
+RERANK_FETCH_K = 30  # 並べ替えの前に取得する候補チャンク数（並べ替え後に上位RETRIEVER_CANDIDATE_K件を残す）
+RERANK_SCORER = "lexical"  # 並べ替えに使うスコアラー（「lexical」: 語の一致率、「cross_encoder」: ローカルのCross-Encoderモデル）
+RERANK_CROSS_ENCODER_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"  # 「cross_encoder」選択時のモデル（日本語対応）
+RETRIEVER_CANDIDATE_K = 15  # 会話用のRetrieverが取得する候補チャンク数（プロンプトに含める数はトークン数の予算で決まる）
+RERANK_MAX_CHUNKS_PER_SOURCE = 3  # 並べ替え後に残す、1つのデータソースあたりのチャンク数の上限（長いファイルが上位を占めないようにする）
+
+# ==========================================
+# 「社内文書検索」モード設定
+# ==========================================
+# 該当資料の有無をLLMに判定させるか（False: 検索結果のスコアのみで判定し、LLMを呼ばない）
+# DOC_SEARCH_MIN_SIMILARITY_MARGINを実行時の埋め込みモデルで実測するまでは、誤判定を避けるためLLMで判定する
+DOC_SEARCH_LLM_CHECK = True
+# 該当ありとみなす、ベクトル検索でのコサイン類似度の「最上位 − 候補の中央値」の下限
+# text-embedding-ada-002は無関係な文どうしでも類似度が0.7前後になり、絶対値の閾値では判定できないため、
+# 候補の中で最上位のチャンクがどれだけ抜きん出ているかで判定する
+# （0.02は未実測の暫定値。「python calibrate_doc_search.py」でラベル付きの質問から求めた「suggested」の値に置き換え、
+#  その際の埋め込みモデル・balanced_accuracyをここに記録してから、DOC_SEARCH_LLM_CHECKをFalseにする）
+DOC_SEARCH_MIN_SIMILARITY_MARGIN = 0.02
+# 類似度の中央値を求めるのに必要な候補数（これ未満の場合は、語の一致率のみで判定する）
+DOC_SEARCH_MIN_CANDIDATES = 3
+# 該当ありとみなす、検索クエリの語（英数字は単語、日本語は文字2-gram）がチャンクに含まれる割合の下限
+DOC_SEARCH_MIN_TERM_OVERLAP = 0.6
+# 閾値の算出（calibrate_doc_search.py）に使う、ラベル付きの質問ファイルと、関連あり・なしそれぞれに必要な件数
+DOC_SEARCH_CALIBRATION_QUERIES_PATH = "./calibration/doc_search_queries.jsonl"
+DOC_SEARCH_CALIBRATION_MIN_QUERIES = 5
+
+# ==========================================
+# コンテキストのパッキング設定
+# ==========================================
+CONTEXT_TOKEN_BUDGET = 4000  # プロンプトに含める参照チャンクのトークン数の上限
+CONTEXT_DOCUMENT_SEPARATOR = "\n\n"  # プロンプト内でチャンク同士を連結する際の区切り
+DEFAULT_TOKEN_ENCODING = "o200k_base"  # tiktokenがモデル名に対応していない場合に使うエンコーディング
 
 
 # ==========================================
@@ -66,12 +194,76 @@ SUPPORTED_EXTENSIONS = {
     ".csv": lambda path: CSVLoader(path, encoding="utf-8"),
     ".txt": lambda path: TextLoader(path, encoding="utf-8")
 }
+LOADER_MAX_WORKERS = None  # データソース読み込みの並列数（Noneの場合はCPUコア数）
+LOADER_PROCESS_POOL_EXTENSIONS = {".pdf", ".docx"}  # 解析のCPU負荷が高く、プロセスプールで読み込む拡張子
+# 子プロセスの起動（ライブラリの読み込み）には数秒かかるため、対象ファイルの合計サイズがこれ未満の場合は同じプロセス内で読み込む
+LOADER_PROCESS_POOL_MIN_BYTES = 20 * 1024 * 1024
 WEB_URL_LOAD_TARGETS = [
     "https://generative-ai.web-camp.io/"
 ]
+# Webページの取得結果のキャッシュ（ETag・Last-Modifiedでの再確認と、取得失敗時の代替に使う。成果物のバージョン間で共有）
+WEB_CACHE_DIR = ".chroma/web_cache"
+WEB_FETCH_TIMEOUT = (5, 15)  # 1ページあたりの（接続, 読み込み）のタイムアウト秒数
+WEB_FETCH_MAX_CONCURRENCY = 4  # 同時に取得するWebページ数の上限
+WEB_FETCH_USER_AGENT = "Mozilla/5.0 (compatible; CompanyDocumentIndexer/1.0)"  # 環境変数「USER_AGENT」が未設定の場合に使う
+# 読み込み時に各チャンクへ付加するメタデータ（分類・顧客名・文書種別・拡張子・開始位置）の形式
+# 付加する内容を変えた場合は値を変え、インデックスを作り直す
+DOCUMENT_METADATA_VERSION = 4
+CUSTOMER_FOLDER_NAME = "顧客"  # 「MTG議事録/顧客/<既存・見込み>/<会社名>」の形式で顧客ごとの文書を格納するフォルダ
+# 文書種別の判定ルール（ファイル名、次にフォルダ名に含まれる語で判定。いずれにも該当しない場合は「資料」）
+DOC_TYPE_RULES = [
+    ("ルール", "規程"),
+    ("取り決め", "規程"),
+    ("議事録", "議事録"),
+    ("ガイド", "マニュアル"),
+    ("名簿", "名簿"),
+]
+DEFAULT_DOC_TYPE = "資料"
+WEB_DOC_CATEGORY = "Webページ"  # Webページの分類
+# 検索クエリから顧客名を推定する際、省略されることが多い法人格
+CUSTOMER_NAME_SUFFIXES = ["株式会社", "合同会社", "有限会社"]
 
 EMPLOYEE_CSV_PATH = "./data/社員について/社員名簿.csv"
-EMPLOYEE_CONTEXT_TRIGGER_WORDS = ["人事", "従業員", "部署", "社員", "配属"]
+# 社員名簿で転置インデックスを作成する列（True: 「,」区切りで複数の値を持つ列）
+EMPLOYEE_INDEX_COLUMNS = {
+    "所属部署": False,
+    "役職": False,
+    "従業員区分": False,
+    "性別": False,
+    "大学名": False,
+    "スキルセット": True,
+    "保有資格": True,
+}
+# 社員名簿で範囲検索用のインデックスを作成する列（「number」: 数値、「date」: 日付）
+EMPLOYEE_RANGE_COLUMNS = {
+    "年齢": "number",
+    "入社日": "date",
+}
+# 社員に関する質問の解釈で、値の接尾辞を省略した表記も受け付ける列（例: 「人事」→「人事部」）
+EMPLOYEE_QUERY_ALIAS_SUFFIXES = {
+    "所属部署": ["部"],
+}
+# 特定の値ではなく、列に値が入っているかどうかを問う語（例: 「資格を持つ社員」）
+EMPLOYEE_QUERY_PRESENCE_WORDS = {
+    "資格": "保有資格",
+}
+# 同じ種類の条件を、ORではなくANDで組み合わせることを示す語
+EMPLOYEE_QUERY_AND_WORDS = ["かつ", "両方", "どちらも", "いずれも"]
+# 絞り込み条件なしで、社員全員の一覧を求めることを示す語（これがない場合、条件のない質問では名簿を参照しない）
+EMPLOYEE_QUERY_LIST_ALL_WORDS = ["全員", "全社員", "全従業員", "すべての社員", "すべての従業員", "全ての社員", "全ての従業員", "社員一覧", "従業員一覧"]
+EMPLOYEE_TABLE_CACHE_SIZE = 64  # 整形済みの社員名簿の表を、絞り込み条件ごとに保持する件数
+
+
+# ==========================================
+# 入力の振り分け（キーワード判定）設定
+# ==========================================
+# カテゴリごとの判定キーワード（起動時に1つのオートマトンにまとめて、入力を1回の走査で判定する）
+ROUTING_KEYWORDS = {
+    # 社員名簿のデータを参照すべき質問
+    "employee": ["人事", "従業員", "社員", "部署", "役職", "スキルセット", "配属"],
+    # 社員名簿のデータを参照すべき入力例
+    "employee_guidance": ["人事部に所属", "部署に所属", "従業員のスキルセット", "従業員情報", "社員情報", "部署情報"],
+}
 
 
 # ==========================================
@@ -79,6 +271,19 @@ EMPLOYEE_CONTEXT_TRIGGER_WORDS = ["人事", "従業員", "部署", "社員", "
 # ==========================================
 SYSTEM_PROMPT_CREATE_INDEPENDENT_TEXT = "会話履歴と最新の入力をもとに、会話履歴なしでも理解できる独立した入力テキストを生成してください。"
 
+SYSTEM_PROMPT_SUMMARIZE_HISTORY = """
+    あなたは会話の記録係です。
+    これまでの会話の要約と、その後のやりとりをもとに、新しい要約を作成してください。
+
+    【条件】
+    1. 話題になった社内文書・サービス・顧客・社員などの固有名詞と、確認できた事実を優先して残してください。
+    2. ユーザーの関心や、回答で未解決のまま残った点があれば含めてください。
+    3. 要約のみを、{max_tokens}トークン以内の箇条書きで出力してください。
+
+    【これまでの会話の要約】
+    {summary}
+"""
+
 SYSTEM_PROMPT_DOC_SEARCH = """
     あなたは社内の文書検索アシスタントです。
     以下の条件に基づき、ユーザー入力に対して回答してください。
@@ -120,6 +325,8 @@ NO_DOC_MATCH_ANSWER = "該当資料なし"
 # ==========================================
 COMMON_ERROR_MESSAGE = "このエラーが繰り返し発生する場合は、管理者にお問い合わせください。"
 INITIALIZE_ERROR_MESSAGE = "初期化処理に失敗しました。"
+INDEX_BUILD_ERROR_MESSAGE = "社内文書のインデックス作成に失敗しました。"
+INDEX_ARTIFACT_ERROR_MESSAGE = "公開中のインデックスの成果物を開けませんでした。成果物を作り直してください。"
 NO_DOC_MATCH_MESSAGE = """
     入力内容と関連する社内文書が見つかりませんでした。\n
     入力内容を変更してください。
@@ -0,0 +1,154 @@
+"""
+このファイルは、検索で取得したチャンクをプロンプトに詰める処理（コンテキストのパッキング）をまとめたファイルです。
+- 関連度の高い順に、トークン数の予算に収まるチャンクだけを採用
+- 同じファイル・同じページで隣接・重複するチャンクは1つにまとめ、重複部分のトークンを節約
+- 使用したトークン数をログに出力
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import logging
+from langchain_core.documents import Document
+import constants as ct
+from token_counter import count_tokens
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_chunk_span(document):
+    """
+    チャンクの、元の文書（ページ）内での位置を取得
+
+    Args:
+        document: チャンク
+
+    Returns:
+        （開始位置, 終了位置）のタプル。位置が記録されていない場合はNone
+    """
+    start = document.metadata.get("start_index")
+    if start is None or start < 0:
+        return None
+    return start, start + len(document.page_content)
+
+
+def merge_into(packed, document):
+    """
+    同じファイル・同じページで隣接・重複するチャンクがあれば、そのチャンクに結合
+
+    Args:
+        packed: 採用済みのチャンクの情報（{"document", "span", "key"}）のリスト
+        document: 結合を試みるチャンク
+
+    Returns:
+        結合した場合は（結合先の情報, 結合後の本文）のタプル。結合できない場合はNone
+    """
+    span = get_chunk_span(document)
+    if span is None:
+        return None
+    key = (document.metadata.get("source"), document.metadata.get("page"))
+    for entry in packed:
+        if entry["key"] != key or entry["span"] is None:
+            continue
+        (start, end), (new_start, new_end) = entry["span"], span
+        text = entry["document"].page_content
+        # 後ろ側で隣接・重複（間が区切り文字以下）
+        if start <= new_start <= end + len(ct.CHUNK_SEPARATOR):
+            if new_end <= end:
+                return entry, text
+            overlap = end - new_start
+            tail = document.page_content[overlap:] if overlap >= 0 else ct.CHUNK_SEPARATOR + document.page_content
+            return entry, text + tail
+        # 前側で隣接・重複
+        if new_start <= start <= new_end + len(ct.CHUNK_SEPARATOR):
+            if end <= new_end:
+                return entry, document.page_content
+            overlap = new_end - start
+            tail = text[overlap:] if overlap >= 0 else ct.CHUNK_SEPARATOR + text
+            return entry, document.page_content + tail
+    return None
+
+
+def pack_documents(documents, budget=None, model=None):
+    """
+    関連度の高い順に並んだチャンクを、トークン数の予算に収まるよう選択・結合
+
+    Args:
+        documents: 検索で取得したチャンクのリスト（関連度の高い順）
+        budget: コンテキストに使うトークン数の上限（省略時は ct.CONTEXT_TOKEN_BUDGET）
+        model: トークン数の計測に使うモデル名（省略時は ct.MODEL）
+
+    Returns:
+        採用したチャンクのリスト（関連度の高い順）と、
+        {"tokens": 使用トークン数, "budget": 予算, "candidates": 候補数, "packed": 採用数,
+         "merged": 結合した数, "dropped": 予算超過で除外した数} の集計
+    """
+    budget = budget if budget is not None else ct.CONTEXT_TOKEN_BUDGET
+    model = model or ct.MODEL
+    # チャンク同士を連結する際の区切り（create_stuff_documents_chainの既定の区切り）のトークン数
+    separator_tokens = count_tokens(ct.CONTEXT_DOCUMENT_SEPARATOR, model)
+
+    packed = []
+    used = 0
+    merged = 0
+    dropped = 0
+    for document in documents:
+        merge = merge_into(packed, document)
+        if merge is not None:
+            entry, text = merge
+            tokens = count_tokens(text, model)
+            # 結合で増える分だけ予算を消費（完全に含まれるチャンクは増分なし）
+            if used - entry["tokens"] + tokens <= budget:
+                used += tokens - entry["tokens"]
+                start = min(entry["span"][0], get_chunk_span(document)[0])
+                entry["document"] = Document(
+                    page_content=text,
+                    metadata=dict(entry["document"].metadata, start_index=start)
+                )
+                entry["span"] = (start, start + len(text))
+                entry["tokens"] = tokens
+                merged += 1
+            else:
+                dropped += 1
+            continue
+
+        tokens = count_tokens(document.page_content, model)
+        cost = tokens + (separator_tokens if packed else 0)
+        # 予算を超えるチャンクは飛ばし、より短い後続のチャンクで残りの予算を埋める
+        if used + cost > budget:
+            dropped += 1
+            continue
+        packed.append({
+            "document": document,
+            "span": get_chunk_span(document),
+            "key": (document.metadata.get("source"), document.metadata.get("page")),
+            "tokens": tokens,
+        })
+        used += cost
+
+    report = {
+        "tokens": used,
+        "budget": budget,
+        "candidates": len(documents),
+        "packed": len(packed),
+        "merged": merged,
+        "dropped": dropped,
+    }
+    return [entry["document"] for entry in packed], report
+
+
+def pack_context(documents):
+    """
+    Chainの中で、検索結果をトークン数の予算内に詰め、使用トークン数をログに出力
+
+    Args:
+        documents: 検索で取得したチャンクのリスト（関連度の高い順）
+
+    Returns:
+        採用したチャンクのリスト
+    """
+    packed, report = pack_documents(documents)
+    logging.getLogger(ct.LOGGER_NAME).info({"context_packing": report})
+    return packed
@@ -0,0 +1,152 @@
+"""
+このファイルは、LLMに渡す会話履歴（メモリ）の管理をまとめたファイルです。
+- 直近の一定ターン数のやりとりはそのまま保持
+- それより古いやりとりは、LLMで要約して1つの要約文にまとめていく
+- 要約文と直近のやりとりの合計が、トークン数の上限を超えないよう保つ
+会話が長く続いても、LLMに送る会話履歴の大きさ（応答時間・コスト）が一定の範囲に収まります。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import logging
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+import constants as ct
+from token_counter import count_tokens, truncate_to_tokens
+
+
+############################################################
+# 関数定義
+############################################################
+
+def format_turns(turns):
+    """
+    やりとりを、要約に渡すためのテキストに整形
+
+    Args:
+        turns: （質問, 回答）のタプルのリスト
+
+    Returns:
+        整形したテキスト
+    """
+    return "\n".join(f"ユーザー: {question}\nアシスタント: {answer}" for question, answer in turns)
+
+
+############################################################
+# クラス定義
+############################################################
+
+class ConversationMemory:
+    """
+    直近のやりとりと、それより前のやりとりの要約を保持する会話履歴
+    """
+
+    def __init__(self, max_turns=ct.MEMORY_MAX_TURNS, max_tokens=ct.MEMORY_MAX_TOKENS,
+                 summary_max_tokens=ct.MEMORY_SUMMARY_MAX_TOKENS, model=ct.MODEL):
+        """
+        Args:
+            max_turns: そのまま保持する直近のやりとりの数
+            max_tokens: 要約文と直近のやりとりを合わせたトークン数の上限
+            summary_max_tokens: 要約文のトークン数の上限（max_tokensの内数）
+            model: トークン数の計測に使うモデル名
+        """
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.model = model
+        # 直近のやりとり（（質問, 回答, トークン数）のタプルのリスト、古い順）
+        self.turns = []
+        # それより前のやりとりの要約文と、要約済みのやりとりの数
+        self.summary = ""
+        self.summarized_turns = 0
+
+    def __len__(self):
+        # これまでのやりとりの総数（要約済みのものを含む）
+        return self.summarized_turns + len(self.turns)
+
+    def _count_turn(self, question, answer):
+        # 1回のやりとり（メッセージ2件）のトークン数
+        overhead = ct.MEMORY_MESSAGE_OVERHEAD_TOKENS * 2
+        return count_tokens(question, self.model) + count_tokens(answer, self.model) + overhead
+
+    def token_count(self):
+        """
+        LLMに渡す会話履歴全体のトークン数を取得
+
+        Returns:
+            トークン数
+        """
+        total = sum(tokens for _, _, tokens in self.turns)
+        if self.summary:
+            total += count_tokens(self.summary, self.model) + ct.MEMORY_MESSAGE_OVERHEAD_TOKENS
+        return total
+
+    def messages(self):
+        """
+        プロンプトの「chat_history」に渡すメッセージのリストを取得
+
+        Returns:
+            要約文（ある場合）と、直近のやりとりのメッセージのリスト
+        """
+        messages = []
+        if self.summary:
+            messages.append(SystemMessage(content=f"{ct.MEMORY_SUMMARY_PREFIX}\n{self.summary}"))
+        for question, answer, _ in self.turns:
+            messages.extend([HumanMessage(content=question), AIMessage(content=answer)])
+        return messages
+
+    def add_turn(self, question, answer, summarize=None):
+        """
+        やりとりを追加し、上限を超えた古いやりとりを要約文にまとめる
+
+        Args:
+            question: ユーザーの質問（社員情報などを付加する前の元の質問）
+            answer: LLMからの回答
+            summarize: (これまでの要約文, 要約対象のやりとりのテキスト, トークン数の上限) を受け取り、
+                新しい要約文を返す関数（Noneの場合、または失敗した場合はやりとりを切り詰めて残す）
+        """
+        self.turns.append((question, answer, self._count_turn(question, answer)))
+
+        # 要約文の分を除いた予算に収まるまで、古いやりとりから要約対象に回す（直近の1回は必ず残す）
+        budget = self.max_tokens - self.summary_max_tokens
+        overflow = []
+        while len(self.turns) > 1 and (
+            len(self.turns) > self.max_turns or sum(tokens for _, _, tokens in self.turns) > budget
+        ):
+            question_, answer_, _ = self.turns.pop(0)
+            overflow.append((question_, answer_))
+
+        # 直近の1回だけで予算を超える場合は、回答を切り詰める
+        question, answer, tokens = self.turns[-1]
+        if tokens > budget:
+            question = truncate_to_tokens(question, budget // 2, self.model)
+            answer = truncate_to_tokens(answer, budget - self._count_turn(question, ""), self.model)
+            self.turns[-1] = (question, answer, self._count_turn(question, answer))
+
+        if overflow:
+            self._summarize(overflow, summarize)
+
+    def _summarize(self, turns, summarize):
+        # 要約対象のやりとりを、これまでの要約文に畳み込む
+        logger = logging.getLogger(ct.LOGGER_NAME)
+        conversation = format_turns(turns)
+        summary = None
+        if summarize is not None:
+            try:
+                summary = summarize(self.summary, conversation, self.summary_max_tokens)
+            except Exception as e:
+                logger.warning(f"会話履歴の要約に失敗したため、やりとりを切り詰めて残します: {e}")
+        if not summary:
+            # 要約できない場合は、新しいやりとりほど残るよう末尾側を残す
+            summary = "\n".join(text for text in [self.summary, conversation] if text)
+            summary = truncate_to_tokens(summary, self.summary_max_tokens, self.model, keep_end=True)
+        else:
+            summary = truncate_to_tokens(summary, self.summary_max_tokens, self.model)
+
+        self.summary = summary
+        self.summarized_turns += len(turns)
+        logger.info({"conversation_memory": {
+            "summarized_turns": self.summarized_turns,
+            "recent_turns": len(self.turns),
+            "tokens": self.token_count(),
+        }})
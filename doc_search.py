@@ -0,0 +1,79 @@
+"""
+このファイルは、「社内文書検索」モードの回答を、LLMを使わず検索結果のスコアのみで作成する処理をまとめたファイルです。
+検索結果のうち、ベクトル検索での類似度が他の候補より十分に高いチャンク、
+または検索クエリの語の一致率が閾値以上のチャンクがあれば「該当あり」とし、
+なければ「該当資料なし」とします（LLMに判定させる従来の方式も設定で選択できます）。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import logging
+import time
+from statistics import median
+import constants as ct
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_best_scores(documents):
+    """
+    検索結果の、ベクトル検索での類似度の最上位と中央値との差、および語の一致率の最大値を取得
+
+    Args:
+        documents: 検索で取得したチャンクのリスト
+
+    Returns:
+        （類似度の差, 語の一致率）のタプル。値がない場合はNone
+        （類似度の差は、類似度を持つ候補が ct.DOC_SEARCH_MIN_CANDIDATES 件未満の場合もNone）
+    """
+    similarities = [document.metadata["similarity"] for document in documents if "similarity" in document.metadata]
+    relevance_scores = [document.metadata["relevance_score"] for document in documents if "relevance_score" in document.metadata]
+    margin = None
+    if len(similarities) >= ct.DOC_SEARCH_MIN_CANDIDATES:
+        margin = max(similarities) - median(similarities)
+    return margin, max(relevance_scores, default=None)
+
+
+def is_document_match(documents):
+    """
+    検索結果に、入力内容と関連する社内文書が含まれるかを判定
+
+    Args:
+        documents: 検索で取得したチャンクのリスト
+
+    Returns:
+        True: 関連する社内文書あり、False: 該当資料なし
+    """
+    if not documents:
+        return False
+    margin, relevance_score = get_best_scores(documents)
+    if margin is not None and margin >= ct.DOC_SEARCH_MIN_SIMILARITY_MARGIN:
+        return True
+    return relevance_score is not None and relevance_score >= ct.DOC_SEARCH_MIN_TERM_OVERLAP
+
+
+def search_documents(query, retriever):
+    """
+    LLMを使わず、検索結果のスコアのみで「社内文書検索」の回答を作成
+
+    Args:
+        query: ユーザー入力値
+        retriever: ベクターストアを検索するRetriever
+
+    Returns:
+        LLMからの回答と同じ形式の辞書（{"answer": 空文字 または「該当資料なし」, "context": チャンクのリスト}）
+    """
+    start = time.perf_counter()
+    documents = retriever.invoke(query)
+    matched = is_document_match(documents)
+    margin, relevance_score = get_best_scores(documents)
+    logging.getLogger(ct.LOGGER_NAME).info({"doc_search": {
+        "matched": matched,
+        "similarity_margin": margin,
+        "relevance_score": relevance_score,
+        "seconds": round(time.perf_counter() - start, 3),
+    }})
+    return {"answer": "" if matched else ct.NO_DOC_MATCH_ANSWER, "context": documents if matched else []}
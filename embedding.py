@@ -0,0 +1,241 @@
+"""
+このファイルは、チャンクの埋め込み（ベクトル化）処理をまとめたファイルです。
+- 同一テキストの重複排除と、ディスク上の埋め込みキャッシュ（モデル名＋テキストのハッシュ → ベクトル）
+- バッチ単位の並列リクエストと、レート制限（429）・一時的な障害時のリトライ
+- 埋め込みモデル本体は差し替え可能（ローカル検証用の決定的なダミーモデルも選択可）
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import hashlib
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import openai
+from langchain_core.embeddings import Embeddings
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_openai import OpenAIEmbeddings
+import constants as ct
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_embedding_model_name():
+    """
+    現在の設定で使用する埋め込みモデル名を取得
+    （キャッシュのキーやインデックスのマニフェストに記録し、モデルが変わった場合に区別する）
+
+    Returns:
+        埋め込みモデル名
+    """
+    if ct.EMBEDDING_BACKEND == "fake":
+        return f"fake-{ct.FAKE_EMBEDDING_SIZE}"
+    return ct.EMBEDDING_MODEL
+
+
+def create_embedding_backend():
+    """
+    設定に応じた埋め込みモデル本体を作成
+
+    Returns:
+        埋め込みモデル（langchainのEmbeddings）
+    """
+    if ct.EMBEDDING_BACKEND == "fake":
+        # APIを呼ばずに、テキストから決定的にベクトルを生成するダミーモデル（ローカル検証用）
+        return DeterministicFakeEmbedding(size=ct.FAKE_EMBEDDING_SIZE)
+    # リトライは呼び出し側で制御するため、クライアント内部のリトライは無効化
+    return OpenAIEmbeddings(model=ct.EMBEDDING_MODEL, max_retries=0)
+
+
+def create_embeddings():
+    """
+    キャッシュ・並列化付きの埋め込みモデルを作成
+
+    Returns:
+        CachedEmbeddingsのインスタンス
+    """
+    return CachedEmbeddings(create_embedding_backend(), get_embedding_model_name())
+
+
+def is_retryable_error(error):
+    """
+    待機して再試行すべきエラー（レート制限・一時的な通信障害）かどうかを判定
+
+    Args:
+        error: 発生した例外
+
+    Returns:
+        True: 再試行すべきエラー
+    """
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    return getattr(error, "status_code", None) == 429
+
+
+############################################################
+# クラス定義
+############################################################
+
+class EmbeddingCache:
+    """
+    埋め込みベクトルをSQLiteに保存するキャッシュ
+    キーはモデル名とテキストから算出するため、同じ内容のチャンクは二度と埋め込みを行わない
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 複数セッション（スレッド）から使われるため、ロックで排他制御する
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model_name, text):
+        # モデル名とテキストから、キャッシュのキー（ハッシュ値）を作成
+        return hashlib.blake2b(f"{model_name}\0{text}".encode("utf-8"), digest_size=20).hexdigest()
+
+    def get_many(self, keys):
+        # 指定したキーのうち、キャッシュに存在するものを {キー: ベクトル} で返す
+        found = {}
+        with self._lock:
+            # SQLiteの変数上限を超えないよう、一定件数ずつ問い合わせる
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+                for key, blob in rows:
+                    found[key] = array("d", blob).tolist()
+        return found
+
+    def put_many(self, items):
+        # {キー: ベクトル} をまとめて保存
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("d", vector).tobytes()) for key, vector in items.items()]
+            )
+            self._conn.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    埋め込みモデル本体をラップし、重複排除・キャッシュ・並列バッチ処理・リトライを追加するクラス
+    """
+
+    def __init__(self, backend, model_name, cache=None, batch_size=None, max_concurrency=None, max_retries=None):
+        self.backend = backend
+        self.model_name = model_name
+        self.cache = cache if cache is not None else EmbeddingCache(ct.EMBEDDING_CACHE_PATH)
+        self.batch_size = batch_size or ct.EMBEDDING_BATCH_SIZE
+        self.max_concurrency = max_concurrency or ct.EMBEDDING_MAX_CONCURRENCY
+        self.max_retries = max_retries if max_retries is not None else ct.EMBEDDING_MAX_RETRIES
+        # 埋め込みの進捗を (処理済みのテキスト件数, 全件数) で受け取る関数（インデックス作成中のみ設定）
+        self.progress_callback = None
+        # 検索クエリの埋め込み（件数に上限を設け、最近使っていないものから捨てる）
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        """
+        複数テキストの埋め込み
+        キャッシュに無いテキストのみ、重複を除いてバッチ単位で並列に埋め込む
+
+        Args:
+            texts: 埋め込み対象のテキストのリスト
+
+        Returns:
+            テキストと同じ順序のベクトルのリスト
+        """
+        keys = [EmbeddingCache.make_key(self.model_name, text) for text in texts]
+        vectors = self.cache.get_many(list(set(keys)))
+
+        # キャッシュに無いテキストを、重複を除いて抽出
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text
+
+        if self.progress_callback is not None:
+            # 同じテキストが複数回含まれる場合も件数に数えるよう、キーごとの出現回数で進捗を数える
+            key_counts = Counter(keys)
+            done = sum(count for key, count in key_counts.items() if key in vectors)
+            self.progress_callback(done, len(texts))
+
+        if missing:
+            missing_keys = list(missing)
+            batches = [missing_keys[i:i + self.batch_size] for i in range(0, len(missing_keys), self.batch_size)]
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                batch_results = executor.map(lambda batch: self._embed_batch([missing[key] for key in batch]), batches)
+                for batch, batch_vectors in zip(batches, batch_results):
+                    embedded = dict(zip(batch, batch_vectors))
+                    # バッチごとに保存し、途中で失敗しても埋め込み済みの分は次回再利用できるようにする
+                    self.cache.put_many(embedded)
+                    vectors.update(embedded)
+                    if self.progress_callback is not None:
+                        done += sum(key_counts[key] for key in batch)
+                        self.progress_callback(done, len(texts))
+
+            logging.getLogger(ct.LOGGER_NAME).info(
+                f"埋め込みを実行しました。（対象: {len(texts)}件、キャッシュ利用: {len(texts) - len(missing)}件、新規: {len(missing)}件）"
+            )
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text):
+        """
+        検索クエリの埋め込み（同じ質問の繰り返しに備えてキャッシュを利用）
+        クエリは際限なく増えるため、ディスクのキャッシュには保存せず、件数に上限のあるメモリ上のキャッシュに保持する
+        （チャンクと同じテキストの場合は、ディスクのキャッシュも参照する）
+
+        Args:
+            text: 検索クエリ
+
+        Returns:
+            ベクトル
+        """
+        key = EmbeddingCache.make_key(self.model_name, text)
+        with self._query_cache_lock:
+            if key in self._query_cache:
+                self._query_cache.move_to_end(key)
+                return self._query_cache[key]
+
+        vector = self.cache.get_many([key]).get(key)
+        if vector is None:
+            vector = self._embed_batch([text])[0]
+        with self._query_cache_lock:
+            self._query_cache[key] = vector
+            while len(self._query_cache) > ct.EMBEDDING_QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return vector
+
+    def _embed_batch(self, texts):
+        """
+        1バッチ分の埋め込みリクエスト
+        レート制限に達した場合などは、指数バックオフ（ゆらぎ付き）で待機して再試行する
+
+        Args:
+            texts: 埋め込み対象のテキストのリスト
+
+        Returns:
+            ベクトルのリスト
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.backend.embed_documents(texts)
+            except Exception as e:
+                if not is_retryable_error(e) or attempt == self.max_retries:
+                    raise
+                wait = min(ct.EMBEDDING_RETRY_MAX_WAIT, ct.EMBEDDING_RETRY_BASE_WAIT * (2 ** attempt))
+                wait += random.uniform(0, wait / 2)
+                logging.getLogger(ct.LOGGER_NAME).warning(f"埋め込みAPIの呼び出しに失敗したため、{wait:.1f}秒後に再試行します。（{type(e).__name__}）")
+                time.sleep(wait)
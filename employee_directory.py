@@ -0,0 +1,272 @@
+"""
+このファイルは、社員名簿をプロセス全体で共有する社員ディレクトリをまとめたファイルです。
+社員名簿は一度だけ読み込み（ファイルの更新日時が変わった場合のみ再読み込み）、
+部署・役職などの列ごとに「値 → 該当する行番号の集合」の転置インデックスを事前に作成しておくことで、
+質問ごとの絞り込みを列全体の走査ではなく集合演算で行います。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import logging
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import streamlit as st
+import constants as ct
+from retriever import standardize_column_names
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_employee_directory(path=ct.EMPLOYEE_CSV_PATH):
+    """
+    プロセス全体で共有する社員ディレクトリを取得
+    （社員名簿の更新日時がキャッシュのキーに含まれるため、ファイルが更新された場合のみ再読み込みされる）
+
+    Args:
+        path: 社員名簿のCSVファイルのパス
+
+    Returns:
+        EmployeeDirectoryのインスタンス
+    """
+    return load_employee_directory(path, os.stat(path).st_mtime_ns)
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def load_employee_directory(path, mtime_ns):
+    """
+    社員名簿を読み込み、転置インデックス付きの社員ディレクトリを作成
+
+    Args:
+        path: 社員名簿のCSVファイルのパス
+        mtime_ns: 社員名簿の更新日時（キャッシュのキー）
+
+    Returns:
+        EmployeeDirectoryのインスタンス
+    """
+    df = standardize_column_names(pd.read_csv(path, dtype=str, keep_default_na=False))
+    # 結合などで紛れ込んだヘッダー行を除外
+    df = df[df["氏名"] != "氏名"].reset_index(drop=True)
+
+    directory = EmployeeDirectory(df, mtime_ns)
+    logging.getLogger(ct.LOGGER_NAME).info(f"社員名簿を読み込みました。（{len(df)}件）")
+    return directory
+
+
+def split_values(value, multi_valued):
+    """
+    セルの値を、インデックスに登録する値のリストに分割
+
+    Args:
+        value: セルの値
+        multi_valued: 「,」区切りで複数の値を持つ列かどうか
+
+    Returns:
+        値のリスト（空欄の場合は空のリスト）
+    """
+    if not multi_valued:
+        value = value.strip()
+        return [value] if value else []
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def format_markdown_rows(df):
+    """
+    データフレームを、Markdownの表のヘッダーと各行の文字列に変換
+    行ごとのループではなく、列単位で全行のセルをまとめて結合する
+
+    Args:
+        df: 表にするデータフレーム
+
+    Returns:
+        ヘッダー（区切り行を含む）、各行の文字列のリスト、各行の文字数の配列
+    """
+    headers = [str(column) for column in df.columns]
+    header = "| " + " | ".join(headers) + " |\n" + "| " + " | ".join(["---"] * len(headers)) + " |\n"
+
+    # 列ごとにセルの文字列を作成（欠損値は空文字）
+    columns = [series.fillna("").astype(str).tolist() for _, series in df.items()]
+    lines = ["| " + row + " |\n" for row in map(" | ".join, zip(*columns))]
+    lengths = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+    return header, lines, lengths
+
+
+############################################################
+# クラス定義
+############################################################
+
+class EmployeeDirectory:
+    """
+    社員名簿のデータフレームと、列ごとの転置インデックスを保持するクラス
+    複数セッションから共有されるため、作成後はデータとインデックスを変更しない（表の整形結果のキャッシュのみ更新）
+    """
+
+    def __init__(self, df, version):
+        self.df = df
+        # 社員名簿の更新日時（表示結果のキャッシュなどで、データの版の区別に使用）
+        self.version = version
+        self.all_rows = frozenset(range(len(df)))
+        self.indexes = {}
+        for column, multi_valued in ct.EMPLOYEE_INDEX_COLUMNS.items():
+            if column in df.columns:
+                self.indexes[column] = self._build_index(df[column], multi_valued)
+        # 列ごとの範囲検索用インデックス（昇順に並べた値と、対応する行番号）
+        self.range_indexes = {}
+        for column, kind in ct.EMPLOYEE_RANGE_COLUMNS.items():
+            if column in df.columns:
+                self.range_indexes[column] = self._build_range_index(df[column], kind)
+        # Markdownの表の各行は、読み込み時に一度だけ整形しておく
+        self._table_header, self._table_lines, self._line_lengths = format_markdown_rows(df)
+        # 整形済みの表のキャッシュ（LRU）。複数セッション（スレッド）から更新されるため、ロックで排他制御する
+        self._table_cache = OrderedDict()
+        self._table_lock = threading.Lock()
+
+    @staticmethod
+    def _build_index(series, multi_valued):
+        # 値 → 該当する行番号の集合 の辞書を作成
+        index = {}
+        for row, value in enumerate(series):
+            for item in split_values(value, multi_valued):
+                index.setdefault(item, set()).add(row)
+        return {item: frozenset(rows) for item, rows in index.items()}
+
+    @staticmethod
+    def _build_range_index(series, kind):
+        # 数値（日付は1970-01-01からの日数）に変換し、値の昇順に並べる（変換できない行は除外）
+        if kind == "date":
+            values = pd.to_datetime(series, errors="coerce")
+            valid = values.notna().to_numpy()
+            values = values.to_numpy(dtype="datetime64[D]").astype(np.int64)
+        else:
+            values = pd.to_numeric(series, errors="coerce")
+            valid = values.notna().to_numpy()
+            values = values.to_numpy(dtype=np.float64)
+        rows = np.flatnonzero(valid)
+        order = np.argsort(values[rows], kind="stable")
+        return values[rows][order], rows[order]
+
+    def lookup(self, column, value):
+        """
+        列の値が完全一致する行を取得
+
+        Args:
+            column: 列名
+            value: 値
+
+        Returns:
+            行番号の集合
+        """
+        return self.indexes.get(column, {}).get(value, frozenset())
+
+    def lookup_contains(self, column, keyword):
+        """
+        列の値にキーワードを含む行を取得
+        （走査するのは各行ではなく、列の値の種類だけ）
+
+        Args:
+            column: 列名
+            keyword: キーワード
+
+        Returns:
+            行番号の集合
+        """
+        rows = set()
+        for value, value_rows in self.indexes.get(column, {}).items():
+            if keyword in value:
+                rows |= value_rows
+        return frozenset(rows)
+
+    def lookup_range(self, column, low=None, high=None):
+        """
+        列の値が指定した範囲（両端を含む）にある行を取得
+        日付の列では、datetime.dateで範囲を指定する
+
+        Args:
+            column: 列名
+            low: 下限（Noneの場合は下限なし）
+            high: 上限（Noneの場合は上限なし）
+
+        Returns:
+            行番号の集合
+        """
+        if column not in self.range_indexes:
+            return frozenset()
+        values, rows = self.range_indexes[column]
+        start = 0 if low is None else int(np.searchsorted(values, self._to_range_value(low), side="left"))
+        end = len(values) if high is None else int(np.searchsorted(values, self._to_range_value(high), side="right"))
+        return frozenset(rows[start:end].tolist())
+
+    @staticmethod
+    def _to_range_value(value):
+        # 範囲の指定値を、範囲検索用インデックスと同じ数値に変換
+        if hasattr(value, "toordinal"):
+            return np.datetime64(value, "D").astype(np.int64)
+        return value
+
+    def rows_with_any(self, column):
+        """
+        列に何らかの値が入っている行を取得
+
+        Args:
+            column: 列名
+
+        Returns:
+            行番号の集合
+        """
+        rows = set()
+        for value_rows in self.indexes.get(column, {}).values():
+            rows |= value_rows
+        return frozenset(rows)
+
+    def select(self, rows):
+        """
+        行番号の集合に該当する社員を、名簿の並び順で取得
+
+        Args:
+            rows: 行番号の集合
+
+        Returns:
+            絞り込んだデータフレーム
+        """
+        return self.df.iloc[sorted(rows)]
+
+    def render_table(self, rows, max_length=ct.MAX_CONTEXT_LENGTH):
+        """
+        行番号の集合に該当する社員を、Markdownの表として取得
+        上限の文字数を超える場合は、収まる行までで打ち切る
+        同じ絞り込み条件の結果は、データの版ごとにキャッシュしたものを再利用する
+
+        Args:
+            rows: 行番号の集合
+            max_length: 表全体の最大文字数
+
+        Returns:
+            Markdownの表の文字列
+        """
+        cache_key = (self.version, frozenset(rows), max_length)
+        with self._table_lock:
+            if cache_key in self._table_cache:
+                self._table_cache.move_to_end(cache_key)
+                return self._table_cache[cache_key]
+
+        table = self._render_table(rows, max_length)
+        with self._table_lock:
+            self._table_cache[cache_key] = table
+            while len(self._table_cache) > ct.EMPLOYEE_TABLE_CACHE_SIZE:
+                self._table_cache.popitem(last=False)
+        return table
+
+    def _render_table(self, rows, max_length):
+        # 名簿の並び順で各行の文字数を並べ、ヘッダーを含めた累積文字数が上限以下となる行までを
+        # 一度の二分探索で求めて、その範囲の行だけを結合する
+        if not rows:
+            return "該当するデータがありません。"
+        order = np.fromiter(sorted(rows), dtype=np.int64, count=len(rows))
+        cumulative = len(self._table_header) + np.cumsum(self._line_lengths[order])
+        cut = int(np.searchsorted(cumulative, max_length, side="right"))
+        return self._table_header + "".join([self._table_lines[row] for row in order[:cut]])
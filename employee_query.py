@@ -0,0 +1,311 @@
+"""
+このファイルは、社員に関する質問文を社員名簿の絞り込み条件（検索プラン）に変換する処理をまとめたファイルです。
+- 部署・役職・スキル・資格・大学名など、社員名簿に実在する値を語彙としたオートマトンで質問文を1回走査
+- 年齢（「59歳」「30代」「40歳以上」など）と入社日（「2020年以降に入社」など）は範囲条件として解釈
+- 同じ種類の条件はOR、異なる種類の条件はANDで組み合わせる
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import calendar
+import datetime
+import re
+import unicodedata
+import streamlit as st
+import constants as ct
+from keyword_matcher import KeywordMatcher
+
+
+############################################################
+# 変数定義
+############################################################
+# 年齢の範囲指定（例: 「30〜40歳」「30歳から40歳」）
+AGE_RANGE_PATTERN = re.compile(r"(\d{1,3})\s*(?:歳|才)?\s*(?:〜|~|-|から)\s*(\d{1,3})\s*(?:歳|才)")
+# 年代の指定（例: 「30代」）
+AGE_DECADE_PATTERN = re.compile(r"(?<!\d)([1-9])0\s*代")
+# 年齢の指定（例: 「59歳」「40歳以上」「25歳未満」）
+AGE_PATTERN = re.compile(r"(\d{1,3})\s*(?:歳|才)\s*(以上|以下|未満|より上|より下|を超える|超|から|まで)?")
+# 入社年の範囲指定（例: 「2018年から2020年」「2018〜2020年」）
+JOIN_RANGE_PATTERN = re.compile(r"((?:19|20)\d{2})\s*年?\s*(?:〜|~|-|から)\s*((?:19|20)\d{2})\s*年")
+# 入社年（月）の指定（例: 「2020年以降」「2019年4月入社」）
+JOIN_PATTERN = re.compile(r"((?:19|20)\d{2})\s*年\s*(?:(\d{1,2})\s*月)?\s*(以降|以後|から|以前|まで|より前|より後)?")
+
+
+############################################################
+# 関数定義
+############################################################
+
+def normalize_query_text(text):
+    """
+    全角・半角や大文字・小文字の違いを吸収するため、照合用にテキストを正規化
+
+    Args:
+        text: 正規化前のテキスト
+
+    Returns:
+        正規化後のテキスト
+    """
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def get_vocabulary_matcher(directory):
+    """
+    社員ディレクトリの語彙から作成したオートマトンを取得（社員名簿の版ごとに一度だけ作成）
+
+    Args:
+        directory: 社員ディレクトリ
+
+    Returns:
+        KeywordMatcherのインスタンス
+    """
+    return build_vocabulary_matcher(directory.version, directory)
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def build_vocabulary_matcher(version, _directory):
+    """
+    社員名簿に実在する値（と別名・有無を問う語）をキーワードとしたオートマトンを作成
+
+    Args:
+        version: 社員名簿の版（キャッシュのキー）
+        _directory: 社員ディレクトリ
+
+    Returns:
+        KeywordMatcherのインスタンス
+        付加情報は（「value」, 列名, 値）または（「any」, 列名, None）のタプル
+    """
+    keywords = []
+    for column, index in _directory.indexes.items():
+        for value in index:
+            keywords.append((normalize_query_text(value), ("value", column, value)))
+            # 「人事部」を「人事」とだけ書いた場合など、接尾辞を省略した表記も受け付ける
+            for suffix in ct.EMPLOYEE_QUERY_ALIAS_SUFFIXES.get(column, []):
+                alias = value[:-len(suffix)]
+                if value.endswith(suffix) and len(alias) >= 2:
+                    keywords.append((normalize_query_text(alias), ("value", column, value)))
+    for word, column in ct.EMPLOYEE_QUERY_PRESENCE_WORDS.items():
+        keywords.append((normalize_query_text(word), ("any", column, None)))
+    return KeywordMatcher(keywords)
+
+
+def parse_employee_query(chat_message, directory):
+    """
+    質問文を、社員名簿の絞り込み条件（検索プラン）に変換
+
+    Args:
+        chat_message: ユーザー入力値
+        directory: 社員ディレクトリ
+
+    Returns:
+        EmployeeQueryPlanのインスタンス
+    """
+    text = normalize_query_text(chat_message)
+    # 「AかつB」「AとBの両方」のように明示された場合は、同じ種類の条件もANDで組み合わせる
+    require_all = any(word in text for word in ct.EMPLOYEE_QUERY_AND_WORDS)
+
+    plan = EmployeeQueryPlan(list_all=any(word in text for word in ct.EMPLOYEE_QUERY_LIST_ALL_WORDS))
+    for start, end, keyword, payloads in get_vocabulary_matcher(directory).find_longest(text):
+        if not is_word_boundary(text, start, end):
+            continue
+        conditions = [
+            ("value", column, value) if kind == "value" else ("any", column)
+            for kind, column, value in payloads
+        ]
+        # 1つの語が複数の列に該当する場合（例: 「インターン」は役職と従業員区分）は、いずれかに該当すればよい
+        group = tuple(sorted({condition[:2] for condition in conditions}))
+        plan.add(keyword if require_all else group, conditions)
+
+    text = parse_age_conditions(text, plan)
+    if "入社" in text:
+        parse_join_date_conditions(text, plan)
+    return plan
+
+
+def is_word_boundary(text, start, end):
+    """
+    英数字のキーワードが、単語の一部ではなく単独で使われているかを判定
+    （例: 「NoSQL」の中の「SQL」や、「JavaScript」の中の「Java」は一致とみなさない）
+
+    Args:
+        text: 正規化した質問文
+        start: 一致した位置の先頭
+        end: 一致した位置の末尾（この位置の文字は含まない）
+
+    Returns:
+        True: 単独で使われている
+    """
+    def is_ascii_alnum(char):
+        return char.isascii() and char.isalnum()
+
+    if start > 0 and is_ascii_alnum(text[start]) and is_ascii_alnum(text[start - 1]):
+        return False
+    if end < len(text) and is_ascii_alnum(text[end - 1]) and is_ascii_alnum(text[end]):
+        return False
+    return True
+
+
+def parse_age_conditions(text, plan):
+    """
+    年齢の指定を範囲条件として検索プランに追加
+
+    Args:
+        text: 正規化した質問文
+        plan: 検索プラン
+
+    Returns:
+        解釈した部分を除いた質問文（同じ部分を入社年などとして二重に解釈しないため）
+    """
+    def add_range(low, high):
+        plan.add("年齢", [("range", "年齢", low, high)])
+        return " "
+
+    text = AGE_RANGE_PATTERN.sub(lambda m: add_range(*sorted((int(m.group(1)), int(m.group(2))))), text)
+    text = AGE_DECADE_PATTERN.sub(lambda m: add_range(int(m.group(1)) * 10, int(m.group(1)) * 10 + 9), text)
+
+    def add_age(match):
+        age, qualifier = int(match.group(1)), match.group(2)
+        if qualifier in ("以上", "から"):
+            return add_range(age, None)
+        if qualifier in ("以下", "まで"):
+            return add_range(None, age)
+        if qualifier in ("未満", "より下"):
+            return add_range(None, age - 1)
+        if qualifier in ("より上", "を超える", "超"):
+            return add_range(age + 1, None)
+        return add_range(age, age)
+
+    return AGE_PATTERN.sub(add_age, text)
+
+
+def parse_join_date_conditions(text, plan):
+    """
+    入社年（月）の指定を範囲条件として検索プランに追加
+
+    Args:
+        text: 正規化した質問文
+        plan: 検索プラン
+    """
+    def add_range(low, high):
+        plan.add("入社日", [("range", "入社日", low, high)])
+        return " "
+
+    def add_year_range(match):
+        first, last = sorted((int(match.group(1)), int(match.group(2))))
+        return add_range(datetime.date(first, 1, 1), datetime.date(last, 12, 31))
+
+    text = JOIN_RANGE_PATTERN.sub(add_year_range, text)
+
+    def add_join_date(match):
+        year, month, qualifier = int(match.group(1)), match.group(2), match.group(3)
+        if month and 1 <= int(month) <= 12:
+            month = int(month)
+            start = datetime.date(year, month, 1)
+            end = datetime.date(year, month, calendar.monthrange(year, month)[1])
+        else:
+            start, end = datetime.date(year, 1, 1), datetime.date(year, 12, 31)
+        if qualifier in ("以降", "以後", "から"):
+            return add_range(start, None)
+        if qualifier in ("以前", "まで"):
+            return add_range(None, end)
+        if qualifier == "より前":
+            return add_range(None, start - datetime.timedelta(days=1))
+        if qualifier == "より後":
+            return add_range(end + datetime.timedelta(days=1), None)
+        return add_range(start, end)
+
+    JOIN_PATTERN.sub(add_join_date, text)
+
+
+############################################################
+# クラス定義
+############################################################
+
+class EmployeeQueryPlan:
+    """
+    社員名簿の絞り込み条件
+    条件はグループ単位でまとめ、グループ内はOR、グループ間はANDで組み合わせる
+    各条件は以下のいずれかのタプル
+    - （「value」, 列名, 値）: 列の値が一致
+    - （「any」, 列名）: 列に何らかの値が入っている
+    - （「range」, 列名, 下限, 上限）: 列の値が範囲内（Noneは上限・下限なし）
+    """
+
+    def __init__(self, list_all=False):
+        self.groups = {}
+        # 条件がない場合に全行を返すか（質問で社員全員の一覧を明示的に求めた場合のみTrue）
+        self.list_all = list_all
+
+    def __bool__(self):
+        return bool(self.groups)
+
+    def add(self, group, conditions):
+        """
+        条件をグループに追加
+
+        Args:
+            group: グループのキー
+            conditions: 条件のリスト（いずれかに該当すればよい）
+        """
+        group_conditions = self.groups.setdefault(group, [])
+        for condition in conditions:
+            if condition not in group_conditions:
+                group_conditions.append(condition)
+
+    def execute(self, directory):
+        """
+        社員ディレクトリのインデックスを使い、条件に該当する行を取得
+
+        Args:
+            directory: 社員ディレクトリ
+
+        Returns:
+            行番号の集合（条件がない場合は、全員の一覧を求められていれば全行、そうでなければ空）
+        """
+        if not self.groups and not self.list_all:
+            return frozenset()
+        rows = directory.all_rows
+        # 該当件数が少ないグループから順に絞り込み、該当なしになった時点で打ち切る
+        for group_rows in sorted((self._execute_group(directory, conditions) for conditions in self.groups.values()), key=len):
+            rows = rows & group_rows
+            if not rows:
+                break
+        return rows
+
+    @staticmethod
+    def _execute_group(directory, conditions):
+        # グループ内の各条件に該当する行の和集合
+        rows = set()
+        for condition in conditions:
+            kind, column = condition[0], condition[1]
+            if kind == "value":
+                rows |= directory.lookup(column, condition[2])
+            elif kind == "any":
+                rows |= directory.rows_with_any(column)
+            else:
+                rows |= directory.lookup_range(column, condition[2], condition[3])
+        return frozenset(rows)
+
+    def describe(self):
+        """
+        ログ出力用に、条件を文字列で表現
+
+        Returns:
+            条件の文字列（例: 「(所属部署=人事部 OR 所属部署=営業部) AND (性別=女性)」）
+        """
+        def describe_condition(condition):
+            kind, column = condition[0], condition[1]
+            if kind == "value":
+                return f"{column}={condition[2]}"
+            if kind == "any":
+                return f"{column}あり"
+            low = "" if condition[2] is None else condition[2]
+            high = "" if condition[3] is None else condition[3]
+            return f"{column}={low}〜{high}"
+
+        if not self.groups:
+            return "全員" if self.list_all else "条件なし"
+        return " AND ".join(
+            "(" + " OR ".join(describe_condition(condition) for condition in conditions) + ")"
+            for conditions in self.groups.values()
+        )
@@ -0,0 +1,144 @@
+"""
+このファイルは、ベクトル検索とキーワード検索（BM25）を組み合わせたRetrieverをまとめたファイルです。
+それぞれの検索結果の順位をReciprocal Rank Fusion（RRF）で統合するため、
+意味の近い文書と、固有名詞などが完全一致する文書の両方を、取得件数を増やさずに上位に含められます。
+メタデータによるフィルターを指定（または検索クエリから推定）した場合は、該当するチャンクのみを検索します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import logging
+from typing import Any, List, Optional
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+import constants as ct
+from search_filters import build_where_filter, infer_filters
+from reranker import rerank_documents
+
+
+############################################################
+# 関数定義
+############################################################
+
+def reciprocal_rank_fusion(rankings, rrf_k):
+    """
+    複数の検索結果の順位を統合（各結果での順位rに対し、1 / (rrf_k + r) を合計したスコアの降順）
+
+    Args:
+        rankings: チャンクIDのリスト（上位から順）のリスト
+        rrf_k: 下位の順位の影響を調整する定数
+
+    Returns:
+        統合後のチャンクIDのリスト（上位から順）
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores, key=lambda chunk_id: scores[chunk_id], reverse=True)
+
+
+############################################################
+# クラス定義
+############################################################
+
+class HybridRetriever(BaseRetriever):
+    """
+    ベクトル検索とBM25の検索結果を統合して返すRetriever
+    """
+
+    # Chromaのベクターストア（チャンクの本文・メタデータの取得元も兼ねる）
+    vectorstore: Any
+    # キーワード検索用のSparseIndex
+    sparse_index: Any
+    # 最終的に返すチャンク数
+    k: int = ct.RETRIEVER_SEARCH_K
+    # 統合前に、それぞれの検索で取得するチャンク数
+    fetch_k: int = ct.HYBRID_FETCH_K
+    rrf_k: int = ct.HYBRID_RRF_K
+    # 常に適用するフィルター（{"項目": 値 または 値のリスト}。指定時は推定を行わない）
+    filters: Optional[dict] = None
+    # 検索クエリからフィルターを推定するためのオートマトン（Noneの場合は推定しない）
+    filter_matcher: Any = None
+    # 並べ替えに使うスコアラー（指定時は、rerank_fetch_k件を取得して並べ替えた上位k件を返す）
+    scorer: Any = None
+    rerank_fetch_k: int = ct.RERANK_FETCH_K
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        documents = self._search_with_filters(query)
+        if self.scorer is None:
+            return documents
+        return rerank_documents(query, documents, self.k, self.scorer)
+
+    def _search_with_filters(self, query):
+        # 指定された（または検索クエリから推定した）フィルターで検索
+        if self.filters:
+            return self.search(query, self.filters)
+
+        filters = infer_filters(query, self.filter_matcher)
+        if filters:
+            logging.getLogger(ct.LOGGER_NAME).info({"inferred_filters": filters})
+            documents = self.search(query, filters)
+            # 推定が外れて該当するチャンクがない場合は、絞り込まずに検索し直す
+            if documents:
+                return documents
+        return self.search(query)
+
+    def search(self, query, filters=None):
+        """
+        ベクトル検索とキーワード検索の結果を統合して取得
+
+        Args:
+            query: 検索クエリ
+            filters: {"項目": 値 または 値のリスト} のフィルター（Noneの場合は全チャンクが対象）
+
+        Returns:
+            ドキュメントのリスト（上位から順）。ベクトル検索でヒットしたチャンクは、
+            メタデータの「similarity」に検索クエリとのコサイン類似度を持つ
+        """
+        collection = self.vectorstore._collection
+        where = build_where_filter(filters)
+        documents = {}
+
+        # フィルター指定時は、キーワード検索の対象も該当するチャンクに限定
+        allowed_ids = None
+        if where is not None:
+            allowed_ids = set(collection.get(where=where, include=[])["ids"])
+            if not allowed_ids:
+                return []
+
+        # ベクトル検索（本文・メタデータも同時に取得）
+        dense_ids = []
+        fetch_k = min(self.fetch_k, collection.count() if allowed_ids is None else len(allowed_ids))
+        if fetch_k:
+            result = collection.query(
+                query_embeddings=[self.vectorstore.embeddings.embed_query(query)],
+                n_results=fetch_k,
+                where=where,
+                include=["documents", "metadatas", "distances"],
+            )
+            for chunk_id, text, metadata, distance in zip(
+                result["ids"][0], result["documents"][0], result["metadatas"][0], result["distances"][0]
+            ):
+                dense_ids.append(chunk_id)
+                # 埋め込みは長さ1に正規化されているため、（2乗）ユークリッド距離dからコサイン類似度 1 - d / 2 を求める
+                metadata = dict(metadata or {}, similarity=1.0 - distance / 2)
+                documents[chunk_id] = Document(page_content=text, metadata=metadata)
+
+        # キーワード検索
+        sparse_ids = [chunk_id for chunk_id, _ in self.sparse_index.search(query, self.fetch_k, allowed_ids)]
+
+        # 並べ替えを行う場合は、並べ替え前の候補として多めに残す
+        k = self.k if self.scorer is None else max(self.k, self.rerank_fetch_k)
+        ranked_ids = reciprocal_rank_fusion([dense_ids, sparse_ids], self.rrf_k)[:k]
+
+        # キーワード検索でのみヒットしたチャンクの本文・メタデータを取得
+        missing_ids = [chunk_id for chunk_id in ranked_ids if chunk_id not in documents]
+        if missing_ids:
+            result = collection.get(ids=missing_ids, include=["documents", "metadatas"])
+            for chunk_id, text, metadata in zip(result["ids"], result["documents"], result["metadatas"]):
+                documents[chunk_id] = Document(page_content=text, metadata=metadata or {})
+
+        return [documents[chunk_id] for chunk_id in ranked_ids if chunk_id in documents]
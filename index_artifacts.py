@@ -0,0 +1,256 @@
+"""
+このファイルは、オフラインで作成したインデックス（成果物）のバージョン管理をまとめたファイルです。
+成果物は「ct.INDEX_ARTIFACT_ROOT/バージョン名」のフォルダ単位で作成し、一度公開したフォルダは書き換えません。
+公開中のバージョンは「CURRENT」ファイルに記録し、一時ファイルからの置き換えで1回で切り替えます。
+作成中のフォルダには目印のファイルを置き、古いバージョンの削除（prune_versions）の対象から外します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import json
+import time
+import shutil
+from datetime import datetime
+import constants as ct
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_pointer_path(root=ct.INDEX_ARTIFACT_ROOT):
+    # 公開中のバージョン名を記録するファイルのパス
+    return os.path.join(root, ct.INDEX_ARTIFACT_POINTER)
+
+
+def get_current_version(root=ct.INDEX_ARTIFACT_ROOT):
+    """
+    公開中の成果物のバージョン名を取得
+
+    Args:
+        root: 成果物の格納先フォルダ
+
+    Returns:
+        バージョン名。公開中の成果物がない場合はNone
+    """
+    pointer_path = get_pointer_path(root)
+    if not os.path.exists(pointer_path):
+        return None
+    with open(pointer_path, "r", encoding="utf-8") as f:
+        version = f.read().strip()
+    if not version or not os.path.isdir(os.path.join(root, version)):
+        return None
+    return version
+
+
+def get_current_dir(root=ct.INDEX_ARTIFACT_ROOT):
+    """
+    公開中の成果物のフォルダを取得
+
+    Args:
+        root: 成果物の格納先フォルダ
+
+    Returns:
+        フォルダのパス。公開中の成果物がない場合はNone
+    """
+    version = get_current_version(root)
+    return os.path.join(root, version) if version else None
+
+
+def list_versions(root=ct.INDEX_ARTIFACT_ROOT):
+    """
+    成果物のバージョン名の一覧を取得（古い順）
+
+    Args:
+        root: 成果物の格納先フォルダ
+
+    Returns:
+        バージョン名のリスト
+    """
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+
+
+def create_version_dir(root=ct.INDEX_ARTIFACT_ROOT, base_dir=None, exclude=()):
+    """
+    新しいバージョンのフォルダを作成
+
+    Args:
+        root: 成果物の格納先フォルダ
+        base_dir: 差分更新の元にする成果物のフォルダ（指定時は中身をコピーする。Noneの場合は空のフォルダ）
+        exclude: base_dirからコピーしないファイル・フォルダ名（呼び出し側で別の方法でコピーするもの）
+
+    Returns:
+        作成したフォルダのパス
+    """
+    os.makedirs(root, exist_ok=True)
+    # バージョン名は作成日時（同じ秒に作成された場合は連番を付ける）
+    base_name = datetime.now().strftime("%Y%m%d-%H%M%S")
+    version = base_name
+    suffix = 1
+    while os.path.exists(os.path.join(root, version)):
+        version = f"{base_name}-{suffix}"
+        suffix += 1
+    path = os.path.join(root, version)
+    if base_dir is not None:
+        # 元の成果物の作成中の目印・書き込み途中の一時ファイルは引き継がない
+        shutil.copytree(base_dir, path, ignore=shutil.ignore_patterns(ct.INDEX_ARTIFACT_BUILDING_MARKER, "*.tmp", *exclude))
+    else:
+        os.makedirs(path)
+    # 作成中の目印（作成したプロセスIDと開始日時）を置く。finish_version_dirで削除する
+    with open(os.path.join(path, ct.INDEX_ARTIFACT_BUILDING_MARKER), "w", encoding="utf-8") as f:
+        json.dump({"pid": os.getpid(), "started_at": time.time()}, f)
+    return path
+
+
+def finish_version_dir(version_dir):
+    """
+    成果物の作成を終了（作成中の目印を削除する。成功・失敗のどちらでも呼び出す）
+
+    Args:
+        version_dir: 成果物のフォルダ
+    """
+    marker_path = os.path.join(version_dir, ct.INDEX_ARTIFACT_BUILDING_MARKER)
+    if os.path.exists(marker_path):
+        os.remove(marker_path)
+
+
+def is_process_alive(pid):
+    # 同じマシン上で、指定のプロセスが実行中かを判定
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        # 権限がない場合は、プロセス自体は存在する
+        return True
+    return True
+
+
+def get_last_modified(path):
+    # フォルダ内で最も新しいファイル・フォルダの更新日時
+    latest = os.path.getmtime(path)
+    for dir_path, dir_names, files in os.walk(path):
+        for name in dir_names + files:
+            try:
+                latest = max(latest, os.path.getmtime(os.path.join(dir_path, name)))
+            except OSError:
+                continue
+    return latest
+
+
+def is_building(version_dir):
+    """
+    成果物が作成中かを判定
+    - 作成中の目印があり、作成したプロセスが実行中の場合は作成中
+    - 目印がなくマニフェストがある場合は完成済み
+    - それ以外（作成したプロセスを確認できない未完成の成果物）は、猶予時間内に作成・更新されていれば作成中とみなす
+
+    Args:
+        version_dir: 成果物のフォルダ
+
+    Returns:
+        True: 作成中（削除してはいけない）
+    """
+    marker_path = os.path.join(version_dir, ct.INDEX_ARTIFACT_BUILDING_MARKER)
+    has_marker = os.path.exists(marker_path)
+    if has_marker:
+        try:
+            with open(marker_path, "r", encoding="utf-8") as f:
+                if is_process_alive(int(json.load(f)["pid"])):
+                    return True
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+    elif os.path.exists(os.path.join(version_dir, ct.VECTOR_STORE_MANIFEST_FILE)):
+        return False
+    return time.time() - get_last_modified(version_dir) < ct.INDEX_ARTIFACT_BUILD_GRACE_SECONDS
+
+
+def publish_version(version_dir, root=ct.INDEX_ARTIFACT_ROOT):
+    """
+    成果物を公開中のバージョンに切り替える（一時ファイルに書いてから置き換える）
+
+    Args:
+        version_dir: 公開する成果物のフォルダ
+        root: 成果物の格納先フォルダ
+    """
+    pointer_path = get_pointer_path(root)
+    tmp_path = pointer_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(os.path.basename(os.path.normpath(version_dir)))
+    os.replace(tmp_path, pointer_path)
+
+
+def get_dir_size(path):
+    """
+    フォルダ内のファイルサイズの合計を取得
+
+    Args:
+        path: フォルダのパス
+
+    Returns:
+        合計バイト数
+    """
+    total = 0
+    for dir_path, _, files in os.walk(path):
+        for file in files:
+            total += os.path.getsize(os.path.join(dir_path, file))
+    return total
+
+
+def prune_versions(root=ct.INDEX_ARTIFACT_ROOT, keep=ct.INDEX_ARTIFACT_KEEP, dry_run=False, exclude=()):
+    """
+    公開中のものを含む新しい順にkeep件の完成済みの成果物を残し、古いバージョンと作成に失敗した成果物を削除
+    作成中の成果物（is_buildingがTrue）と、その中の一時ファイルは削除しない
+
+    Args:
+        root: 成果物の格納先フォルダ
+        keep: 残す完成済みのバージョン数（公開中のものを含む）
+        dry_run: True: 削除せず、削除対象のみを返す
+        exclude: 削除しないバージョン名（プロセス内で開いている成果物など）
+
+    Returns:
+        {"current", "kept", "building", "removed", "tmp_files", "freed_bytes"} の辞書
+    """
+    current = get_current_version(root)
+    versions = list_versions(root)
+    building = [version for version in versions if is_building(os.path.join(root, version))]
+    complete = [
+        version for version in versions
+        if version not in building and os.path.exists(os.path.join(root, version, ct.VECTOR_STORE_MANIFEST_FILE))
+    ]
+    kept = set(complete[-keep:]) if keep > 0 else set()
+    kept.update(version for version in [current, *exclude] if version is not None)
+    removed = [version for version in versions if version not in kept and version not in building]
+
+    # 書き込み途中で残った一時ファイル（作成中・削除対象の成果物の中は除く）
+    tmp_files = []
+    for dir_path, dir_names, files in os.walk(root):
+        if dir_path == root:
+            dir_names[:] = [name for name in dir_names if name not in building and name not in removed]
+        for file in files:
+            path = os.path.join(dir_path, file)
+            if not file.endswith(".tmp"):
+                continue
+            # 直下の一時ファイルは公開の切り替え中の可能性があるため、新しいものは残す
+            if dir_path == root and time.time() - os.path.getmtime(path) < ct.INDEX_ARTIFACT_BUILD_GRACE_SECONDS:
+                continue
+            tmp_files.append(path)
+
+    freed = sum(get_dir_size(os.path.join(root, version)) for version in removed)
+    if not dry_run:
+        for version in removed:
+            shutil.rmtree(os.path.join(root, version))
+        for tmp_file in tmp_files:
+            os.remove(tmp_file)
+    return {
+        "current": current,
+        "kept": sorted(kept),
+        "building": building,
+        "removed": removed,
+        "tmp_files": tmp_files,
+        "freed_bytes": freed,
+    }
@@ -0,0 +1,211 @@
+"""
+このファイルは、RAGのインデックス（ベクターストア・キーワード検索用インデックス）をバックグラウンドで作成する処理をまとめたファイルです。
+- インデックスの作成は別スレッドで行い、画面の表示や社員情報の参照はその間も利用できる
+- 作成中は、前回作成済みのインデックスで検索に応答する（まだ1つもない場合は「作成中」の状態を返す）
+- 作成は検索中のものとは別のバージョンのフォルダ（ベクターストアのコレクションを含む）で行い、
+  完了したRetrieverに参照を1回で差し替えるため、検索中のセッションに途中の状態は見えない
+- 読み込んだファイル数・埋め込んだチャンク数と、完了までの見込み時間を進捗として記録
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import logging
+import threading
+import time
+import constants as ct
+
+
+############################################################
+# クラス定義
+############################################################
+
+class IndexBuildProgress:
+    """
+    インデックス作成の進捗（複数のスレッドから更新されるため、ロックで排他制御する）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        # 現在の工程（「open」: 作成済みインデックスの読み込み、「scan」: 変更の検出、
+        # 「load」: ファイルの読み込み、「embed」: 埋め込み、「finalize」: 保存・Retrieverの作成）
+        self.phase = "open"
+        self.phase_started_at = self.started_at
+        self.files_loaded = 0
+        self.files_total = 0
+        self.chunks_embedded = 0
+        self.chunks_total = 0
+
+    def set_phase(self, phase):
+        # 工程の切り替え
+        with self._lock:
+            self.phase = phase
+            self.phase_started_at = time.time()
+
+    def start_loading(self, total):
+        # ファイルの読み込みを開始
+        with self._lock:
+            self.phase = "load"
+            self.phase_started_at = time.time()
+            self.files_loaded = 0
+            self.files_total = total
+
+    def file_loaded(self, source=None):
+        # ファイルを1件読み込んだ
+        with self._lock:
+            self.files_loaded += 1
+
+    def chunks_progress(self, done, total):
+        # チャンクの埋め込みの進捗（初回の呼び出しで工程を切り替える）
+        with self._lock:
+            if self.phase != "embed":
+                self.phase = "embed"
+                self.phase_started_at = time.time()
+            self.chunks_embedded = done
+            self.chunks_total = total
+
+    def snapshot(self):
+        """
+        現在の進捗を取得
+
+        Returns:
+            {"phase", "files_loaded", "files_total", "chunks_embedded", "chunks_total",
+             "elapsed_seconds", "eta_seconds"（見込めない場合はNone）} の辞書
+        """
+        with self._lock:
+            now = time.time()
+            done, total = {
+                "load": (self.files_loaded, self.files_total),
+                "embed": (self.chunks_embedded, self.chunks_total),
+            }.get(self.phase, (0, 0))
+            # 現在の工程の処理速度から、工程の残り時間を見込む
+            eta = None
+            elapsed = now - self.phase_started_at
+            if 0 < done < total and elapsed > 0:
+                eta = round((total - done) * elapsed / done, 1)
+            return {
+                "phase": self.phase,
+                "files_loaded": self.files_loaded,
+                "files_total": self.files_total,
+                "chunks_embedded": self.chunks_embedded,
+                "chunks_total": self.chunks_total,
+                "elapsed_seconds": round(now - self.started_at, 1),
+                "eta_seconds": eta,
+            }
+
+
+class IndexBuildManager:
+    """
+    プロセス全体で1つのインデックス作成を管理し、検索に使うRetrieverを保持するクラス
+    """
+
+    def __init__(self, build_func, open_func=None, release_func=None):
+        """
+        Args:
+            build_func: IndexBuildProgressを受け取り、データソースを同期したRetrieverを返す関数
+            open_func: 作成済みのインデックスをそのまま開いたRetrieverを返す関数
+                （使えるインデックスがない場合はNoneを返す。作成中の検索に使う）
+            release_func: 差し替え前と差し替え後のRetrieverを受け取り、使わなくなったインデックスを手放す関数
+        """
+        self._build_func = build_func
+        self._open_func = open_func
+        self._release_func = release_func
+        self._lock = threading.Lock()
+        self._thread = None
+        self._retriever = None
+        # 「idle」: 未実行、「building」: 作成中、「ready」: 完了、「failed」: 失敗
+        self.status = "idle"
+        self.progress = None
+        self.error = None
+        self.finished_at = None
+
+    @property
+    def retriever(self):
+        # 検索に使うRetriever（作成済みのものがない場合はNone）
+        return self._retriever
+
+    def is_building(self):
+        return self.status == "building"
+
+    def start(self, force=False):
+        """
+        バックグラウンドでのインデックス作成を開始
+
+        Args:
+            force: True: 作成済み・失敗済みでも作り直す、False: 未実行の場合のみ開始
+
+        Returns:
+            True: 今回開始した、False: 作成中または作成済みのため開始しなかった
+        """
+        with self._lock:
+            if self.status == "building" or (self.status != "idle" and not force):
+                return False
+            self.status = "building"
+            self.error = None
+            self.progress = IndexBuildProgress()
+            self._thread = threading.Thread(target=self._run, args=(self.progress,), name="index-builder", daemon=True)
+            self._thread.start()
+            return True
+
+    def wait(self, timeout=None):
+        """
+        実行中のインデックス作成の完了を待つ
+
+        Args:
+            timeout: 待機する秒数の上限（Noneの場合は無制限）
+
+        Returns:
+            True: 作成中ではない
+        """
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return not self.is_building()
+
+    def _run(self, progress):
+        # インデックス作成の本体（バックグラウンドのスレッドで実行）
+        logger = logging.getLogger(ct.LOGGER_NAME)
+        start = time.perf_counter()
+        try:
+            # 作成済みのインデックスがあれば、同期が終わるまでそのまま検索に使う
+            if self._retriever is None and self._open_func is not None:
+                try:
+                    self._retriever = self._open_func()
+                except Exception as e:
+                    logger.warning(f"作成済みのインデックスを開けませんでした: {e}")
+
+            retriever = self._build_func(progress)
+            with self._lock:
+                # 参照の差し替えのみで切り替える（以降に画面を読み込んだセッションから新しいRetrieverを使う）
+                replaced = self._retriever
+                self._retriever = retriever
+                self.status = "ready"
+                self.finished_at = time.time()
+            if replaced is not None and self._release_func is not None:
+                try:
+                    self._release_func(replaced, retriever)
+                except Exception as e:
+                    logger.warning(f"差し替え前のインデックスを手放せませんでした: {e}")
+            logger.info({"index_build": "completed", "seconds": round(time.perf_counter() - start, 3)})
+        except Exception as e:
+            with self._lock:
+                self.status = "failed"
+                self.error = str(e)
+                self.finished_at = time.time()
+            logger.error(f"{ct.INDEX_BUILD_ERROR_MESSAGE}\n{e}")
+
+    def snapshot(self):
+        """
+        作成状況を取得
+
+        Returns:
+            {"status", "ready"（検索できるRetrieverがあるか）, "error", "progress"（作成中・作成後の進捗）} の辞書
+        """
+        with self._lock:
+            return {
+                "status": self.status,
+                "ready": self._retriever is not None,
+                "error": self.error,
+                "progress": self.progress.snapshot() if self.progress is not None else None,
+            }
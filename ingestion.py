@@ -0,0 +1,284 @@
+"""
+このファイルは、RAGの参照先となるデータソースを並列に読み込み、インデックスへ同期する処理をまとめたファイルです。
+アプリ（バックグラウンドでの作成）と、オフラインでの作成用のコマンド（build_index.py）の両方から使います。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import sys
+import time
+import logging
+import unicodedata
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import constants as ct
+import retriever
+import embedding
+import web_fetcher
+from sparse_index import load_sparse_index
+
+
+############################################################
+# 関数定義
+############################################################
+
+def load_document(source):
+    """
+    1件分のデータソース（ファイルまたはWebページ）を読み込む
+    プロセスプールからも呼び出されるため、モジュール直下に定義している
+
+    Args:
+        source: ファイルパスまたはWebページのURL
+
+    Returns:
+        読み込んだドキュメントのリスト
+    """
+    if source.startswith("http"):
+        docs = web_fetcher.load_web_page(source)
+        for doc in docs:
+            doc.metadata.update(retriever.build_source_metadata(source))
+        return docs
+    return retriever.load_file(source)
+
+
+def timed_load_document(source):
+    """
+    データソースを読み込み、所要時間と合わせて返す
+    1件の失敗が他のファイルの読み込みに影響しないよう、例外は戻り値として返す
+
+    Args:
+        source: ファイルパスまたはWebページのURL
+
+    Returns:
+        （ドキュメントのリスト、エラーメッセージ、所要秒数）のタプル
+    """
+    start = time.perf_counter()
+    try:
+        docs = load_document(source)
+        error = None
+    except Exception as e:
+        docs = []
+        error = f"{type(e).__name__}: {e}"
+    return docs, error, time.perf_counter() - start
+
+
+def get_loader_kind(source):
+    """
+    データソースの種類（集計・振り分け用のキー）を取得
+
+    Args:
+        source: ファイルパスまたはWebページのURL
+
+    Returns:
+        「web」または拡張子（例: 「.pdf」）
+    """
+    if source.startswith("http"):
+        return "web"
+    return os.path.splitext(source)[1].lower()
+
+
+def load_sources(sources, max_workers=None, on_loaded=None):
+    """
+    複数のデータソースを並列に読み込む
+    - PDF/Word はCPU負荷が高いため、合計サイズが一定以上の場合はプロセスプールで解析
+    - テキスト/CSV/Webページはスレッドプールで読み込み
+    - 戻り値の順序は引数の順序と同じ
+
+    Args:
+        sources: ファイルパスまたはWebページのURLのリスト
+        max_workers: 並列数（省略時は ct.LOADER_MAX_WORKERS）
+        on_loaded: データソースを1件読み込むごとに、そのデータソースを引数に呼び出す関数（進捗表示用）
+
+    Returns:
+        [(データソース, ドキュメントのリスト, エラーメッセージ)] のリストと、
+        {種類: {"files": 件数, "seconds": 合計秒数, "failed": 失敗件数}} の所要時間集計
+    """
+    if max_workers is None:
+        max_workers = ct.LOADER_MAX_WORKERS or os.cpu_count() or 1
+
+    heavy_sources = [source for source in sources if get_loader_kind(source) in ct.LOADER_PROCESS_POOL_EXTENSIONS]
+    light_sources = [source for source in sources if get_loader_kind(source) not in ct.LOADER_PROCESS_POOL_EXTENSIONS]
+
+    loaded = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as thread_pool:
+        light_futures = {source: thread_pool.submit(timed_load_document, source) for source in light_sources}
+        if on_loaded is not None:
+            for source, future in light_futures.items():
+                future.add_done_callback(lambda _, source=source: on_loaded(source))
+
+        # 並列化の効果がない場合は、プロセス起動のコストを避けて同じプロセス内で読み込む
+        heavy_bytes = sum(os.path.getsize(source) for source in heavy_sources if os.path.exists(source))
+        if max_workers > 1 and len(heavy_sources) > 1 and heavy_bytes >= ct.LOADER_PROCESS_POOL_MIN_BYTES:
+            # Streamlitのスレッドを引き継がないよう、forkではなくspawnで子プロセスを起動
+            with ProcessPoolExecutor(
+                max_workers=min(max_workers, len(heavy_sources)),
+                mp_context=multiprocessing.get_context("spawn")
+            ) as process_pool:
+                for source, result in zip(heavy_sources, process_pool.map(timed_load_document, heavy_sources)):
+                    loaded[source] = result
+                    if on_loaded is not None:
+                        on_loaded(source)
+        else:
+            for source in heavy_sources:
+                loaded[source] = timed_load_document(source)
+                if on_loaded is not None:
+                    on_loaded(source)
+
+        for source, future in light_futures.items():
+            loaded[source] = future.result()
+
+    results = []
+    timings = {}
+    for source in sources:
+        docs, error, elapsed = loaded[source]
+        results.append((source, docs, error))
+
+        timing = timings.setdefault(get_loader_kind(source), {"files": 0, "seconds": 0.0, "failed": 0})
+        timing["files"] += 1
+        timing["seconds"] = round(timing["seconds"] + elapsed, 3)
+        if error is not None:
+            timing["failed"] += 1
+
+    return results, timings
+
+
+def adjust_string(s):
+    """
+    Windows環境でRAGが正常動作するよう調整
+    
+    Args:
+        s: 調整を行う文字列
+    
+    Returns:
+        調整を行った文字列
+    """
+    # 調整対象は文字列のみ
+    if type(s) is not str:
+        return s
+
+    # OSがWindowsの場合、Unicode正規化と、cp932（Windows用の文字コード）で表現できない文字を除去
+    if sys.platform.startswith("win"):
+        s = unicodedata.normalize('NFC', s)
+        s = s.encode("cp932", "ignore").decode("cp932")
+        return s
+    
+    # OSがWindows以外の場合はそのまま返す
+    return s
+
+
+def load_sources_for_index(sources, max_workers=None, on_loaded=None):
+    """
+    インデックス作成用に、データソースを並列に読み込み、Windows環境向けの文字列調整を行う
+
+    Args:
+        sources: ファイルパスまたはWebページのURLのリスト
+        max_workers: 並列数（省略時は ct.LOADER_MAX_WORKERS）
+        on_loaded: データソースを1件読み込むごとに呼び出す関数（進捗表示用）
+
+    Returns:
+        [(データソース, ドキュメントのリスト, エラーメッセージ)] のリスト（引数と同じ順序）
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    results, timings = load_sources(sources, max_workers=max_workers, on_loaded=on_loaded)
+    # 読み込み方式ごとの件数・所要時間をログ出力
+    if sources:
+        logger.info(f"データソースを読み込みました。{timings}")
+
+    for source, docs, error in results:
+        # 1ファイルの失敗で全体を止めないよう、失敗したファイルはログに記録して読み飛ばす
+        if error is not None:
+            logger.warning(f"データソースの読み込みに失敗しました: {source}\n{error}")
+            continue
+        # OSがWindowsの場合、Unicode正規化と、cp932（Windows用の文字コード）で表現できない文字を除去
+        for doc in docs:
+            doc.page_content = adjust_string(doc.page_content)
+            for key in doc.metadata:
+                doc.metadata[key] = adjust_string(doc.metadata[key])
+
+    return results
+
+
+def get_sync_plan(base_dir, data_path=ct.RAG_TOP_FOLDER_PATH, web_urls=None):
+    """
+    データソースを読み込まずに、同期で反映される差分を取得（インデックスには書き込まない）
+    Webページは条件付きリクエストで変更を確認する（取得し直した場合はWebページのキャッシュを更新する）
+
+    Args:
+        base_dir: 差分の比較元にするインデックスのフォルダ（Noneの場合は全件を新規に作成する想定）
+        data_path: データフォルダのパス
+        web_urls: 読み込み対象のWebページURL一覧（省略時は ct.WEB_URL_LOAD_TARGETS）
+
+    Returns:
+        {"full_rebuild", "added", "modified", "deleted", "unchanged"} の辞書（各項目はデータソースのリスト）
+    """
+    if web_urls is None:
+        web_urls = ct.WEB_URL_LOAD_TARGETS
+    if base_dir is not None:
+        retriever.set_index_dir(base_dir)
+    file_hashes = retriever.scan_corpus(data_path, update_stats=False)
+    web_hashes = web_fetcher.scan_web_pages(web_urls)
+    manifest = retriever.load_metadata() if base_dir is not None else {}
+
+    full_rebuild = not retriever.is_manifest_compatible(manifest, retriever.build_manifest(file_hashes, web_hashes))
+    indexed_sources = {} if full_rebuild else manifest.get("sources", {})
+    source_hashes = retriever.build_source_hashes(file_hashes, web_hashes)
+    removed, modified, added = retriever.diff_sources(indexed_sources, source_hashes)
+    return {
+        "full_rebuild": full_rebuild,
+        "added": added,
+        "modified": modified,
+        "deleted": removed,
+        "unchanged": [source for source in source_hashes if source not in added + modified],
+    }
+
+
+def sync_index(data_path=ct.RAG_TOP_FOLDER_PATH, web_urls=None, max_workers=None, progress=None):
+    """
+    データソースの変更分を、現在の格納先フォルダのインデックス（ベクターストア・キーワード検索用インデックス）へ同期
+
+    Args:
+        data_path: データフォルダのパス
+        web_urls: 読み込み対象のWebページURL一覧（省略時は ct.WEB_URL_LOAD_TARGETS）
+        max_workers: 読み込みの並列数（省略時は ct.LOADER_MAX_WORKERS）
+        progress: 進捗を記録するIndexBuildProgress（省略可）
+
+    Returns:
+        同期後のベクターストア、キーワード検索用インデックス、差分のサマリー（辞書）のタプル
+    """
+    if web_urls is None:
+        web_urls = ct.WEB_URL_LOAD_TARGETS
+
+    # 埋め込みモデルの用意（埋め込み済みのチャンクはキャッシュから再利用される）
+    embeddings = embedding.create_embeddings()
+
+    def load_func(sources):
+        if progress is None:
+            return load_sources_for_index(sources, max_workers=max_workers)
+        progress.start_loading(len(sources))
+        return load_sources_for_index(sources, max_workers=max_workers, on_loaded=progress.file_loaded)
+
+    # 読み込み・埋め込みの進捗を記録
+    if progress is not None:
+        progress.set_phase("scan")
+        embeddings.progress_callback = progress.chunks_progress
+
+    # 永続化済みのベクターストアを開き、変更のあったデータソースのみを反映
+    # （何も変わっていなければ読み込み・埋め込みは行われない）
+    try:
+        db = retriever.open_vector_store(embeddings)
+        sparse_index = load_sparse_index(retriever.get_sparse_index_path())
+        file_hashes = retriever.scan_corpus(data_path)
+        # Webページは条件付きリクエストで確認し、本文が変わったページのみを更新として扱う
+        web_hashes = web_fetcher.scan_web_pages(web_urls)
+        db, summary = retriever.sync_vector_store(db, file_hashes, web_hashes, load_func, sparse_index)
+    finally:
+        # 作成後は検索クエリの埋め込みにも使うため、進捗の記録を外す
+        embeddings.progress_callback = None
+    logging.getLogger(ct.LOGGER_NAME).info(f"ベクターストアを同期しました。{summary}")
+
+    if progress is not None:
+        progress.set_phase("finalize")
+    return db, sparse_index, summary
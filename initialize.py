@@ -9,17 +9,21 @@ import os
 import logging
 from logging.handlers import TimedRotatingFileHandler
 from uuid import uuid4
-import sys
-import unicodedata
 from dotenv import load_dotenv
 import streamlit as st
-from docx import Document
-from langchain_community.document_loaders import WebBaseLoader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
-import pandas as pd
 import constants as ct
+import retriever
+import ingestion
+import index_artifacts
+import embedding
+from sparse_index import load_sparse_index
+from hybrid_retriever import HybridRetriever
+from search_filters import build_filter_matcher
+from reranker import get_scorer
+from employee_directory import get_employee_directory
+from conversation_memory import ConversationMemory
+from boot import BootStage, run_stages
+from index_builder import IndexBuildManager
 
 
 ############################################################
@@ -36,17 +40,36 @@ load_dotenv()
 def initialize():
     """
     画面読み込み時に実行する初期化処理
+    各処理は依存関係の順に実行し、プロセス・セッション単位で完了済みのものはスキップする
     """
-    # 社員名簿データの読み込み（セッションに保持）
-    initialize_employee_data()
-    # 初期化データの用意
-    initialize_session_state()
-    # ログ出力用にセッションIDを生成
-    initialize_session_id()
-    # ログ出力の設定
-    initialize_logger()
-    # RAGのRetrieverを作成
-    initialize_retriever()
+    if "boot_stages" not in st.session_state:
+        # セッション内で完了済みの初期化処理を記録する集合を用意
+        st.session_state.boot_stages = set()
+    run_stages(get_boot_stages(), st.session_state.boot_stages)
+
+
+def get_boot_stages():
+    """
+    初期化処理のステージ一覧を取得
+
+    Returns:
+        BootStageのリスト
+    """
+    return [
+        # ログフォルダ・ログファイルの用意（プロセスごとに1回）
+        BootStage("environment", setup_environment, "process"),
+        # ログ出力用にセッションIDを生成
+        BootStage("session_id", initialize_session_id, "session"),
+        # ログ出力の設定（プロセスごとに1回）
+        BootStage("logging", initialize_logger, "process", requires=["environment", "session_id"]),
+        # 初期化データの用意
+        BootStage("session_state", initialize_session_state, "session"),
+        # 全セッション共有の社員ディレクトリの読み込み（プロセスごとに1回）
+        BootStage("employee_data", initialize_employee_data, "process", requires=["logging"]),
+        # RAGのRetrieverを用意（インデックスの作成はバックグラウンドで1回のみ開始し、
+        # 作成完了後のRetrieverに切り替わるよう、参照は画面読み込みのたびに取得）
+        BootStage("index", initialize_retriever, "run", requires=["logging", "session_state"]),
+    ]
 
 
 def initialize_logger():
@@ -97,170 +120,167 @@ def initialize_session_id():
 
 def initialize_retriever():
     """
-    画面読み込み時にRAGのRetriever（ベクターストアから検索するオブジェクト）を作成
+    画面読み込み時にRAGのRetriever（ベクターストアから検索するオブジェクト）を用意
     """
-    # ロガーを読み込むことで、後続の処理中に発生したエラーなどがログファイルに記録される
-    logger = logging.getLogger(ct.LOGGER_NAME)
-
-    # すでにRetrieverが作成済みの場合、後続の処理を中断
-    if "retriever" in st.session_state:
-        return
-    
-    # RAGの参照先となるデータソースの読み込み
-    docs_all = load_data_sources()
-
-    # OSがWindowsの場合、Unicode正規化と、cp932（Windows用の文字コード）で表現できない文字を除去
-    for doc in docs_all:
-        doc.page_content = adjust_string(doc.page_content)
-        for key in doc.metadata:
-            doc.metadata[key] = adjust_string(doc.metadata[key])
-    
-    # 埋め込みモデルの用意
-    embeddings = OpenAIEmbeddings()
-    
-    # チャンク分割用のオブジェクトを作成
-    text_splitter = CharacterTextSplitter(
-        chunk_size=800,
-        chunk_overlap=50,
-        separator="\n"
-    )
+    # インデックスはバックグラウンドで作成し、セッション側では検索に使える最新のRetrieverの参照を取得するだけ
+    # （作成中は前回作成済みのRetriever、まだ1つもない場合はNone。作成が完了すると次回の再実行時に切り替わる）
+    manager = get_index_manager()
+    manager.start()
+    st.session_state.retriever = manager.retriever
 
-    # チャンク分割を実施
-    splitted_docs = text_splitter.split_documents(docs_all)
 
-    # ベクターストアの作成
-    db = Chroma.from_documents(splitted_docs, embedding=embeddings)
+@st.cache_resource(show_spinner=False)
+def get_index_manager():
+    """
+    全セッションで共有するインデックス作成の管理オブジェクトを取得（プロセス内で1つのみ作成）
 
-    # kを5に変更して最大検索ドキュメント数を拡大
-    # ベクターストアを検索するRetrieverの作成
-    st.session_state.retriever = db.as_retriever(search_kwargs={"k": 5})
+    Returns:
+        IndexBuildManagerのインスタンス
+    """
+    return IndexBuildManager(build_shared_retriever, open_indexed_retriever, release_replaced_retriever)
 
 
-def initialize_session_state():
+def create_hybrid_retriever(db, sparse_index, manifest, index_dir):
     """
-    初期化データの用意
+    ベクトル検索とキーワード検索の結果を統合するRetrieverを作成
+    （インデックスのバージョンを持たせ、回答キャッシュなどの無効化に使う）
+    （インデックスの格納先フォルダを持たせ、差し替え後に古いバージョンを手放すのに使う）
+    （顧客名など、検索クエリから絞り込み先が明らかな場合は、該当するチャンクのみを検索する）
+
+    Args:
+        db: ベクターストア
+        sparse_index: キーワード検索用インデックス
+        manifest: インデックスのマニフェスト
+        index_dir: インデックスの格納先フォルダ
+
+    Returns:
+        HybridRetrieverのインスタンス
     """
-    if "messages" not in st.session_state:
-        # 「表示用」の会話ログを順次格納するリストを用意
-        st.session_state.messages = []
-        # 「LLMとのやりとり用」の会話ログを順次格納するリストを用意
-        st.session_state.chat_history = []
+    return HybridRetriever(
+        vectorstore=db,
+        sparse_index=sparse_index,
+        k=ct.RETRIEVER_CANDIDATE_K,
+        scorer=get_scorer() if ct.RERANK_ENABLED else None,
+        filter_matcher=build_filter_matcher(manifest.get("sources", {})),
+        metadata={"index_version": retriever.get_index_version(manifest), "index_dir": index_dir},
+    )
 
 
-def load_data_sources():
+def open_indexed_retriever():
     """
-    RAGの参照先となるデータソースの読み込み
+    前回作成済みのインデックスを、データソースとの同期を行わずにそのまま開く
+    （バックグラウンドでの同期が終わるまでの間、検索に使う）
 
     Returns:
-        読み込んだ通常データソース
+        Retriever。現在の設定で使えるインデックスがない場合はNone
     """
-    # データソースを格納する用のリスト
-    docs_all = []
-    # ファイル読み込みの実行（渡した各リストにデータが格納される）
-    recursive_file_check(ct.RAG_TOP_FOLDER_PATH, docs_all)
-
-    web_docs_all = []
-    # ファイルとは別に、指定のWebページ内のデータも読み込み
-    # 読み込み対象のWebページ一覧に対して処理
-    for web_url in ct.WEB_URL_LOAD_TARGETS:
-        # 指定のWebページを読み込み
-        loader = WebBaseLoader(web_url)
-        web_docs = loader.load()
-        # for文の外のリストに読み込んだデータソースを追加
-        web_docs_all.extend(web_docs)
-    # 通常読み込みのデータソースにWebページのデータを追加
-    docs_all.extend(web_docs_all)
-
-    return docs_all
-
-
-def recursive_file_check(path, docs_all):
+    manifest = retriever.load_metadata()
+    # 埋め込みモデル・チャンク分割条件などが変わった場合は、作り直しが終わるまで使えない
+    if not manifest.get("sources") or not retriever.is_manifest_compatible(manifest, retriever.build_manifest({}, {})):
+        return None
+    db = retriever.open_vector_store(embedding.create_embeddings())
+    if db._collection.count() == 0:
+        return None
+    return create_hybrid_retriever(db, load_sparse_index(retriever.get_sparse_index_path()), manifest, retriever.get_index_dir())
+
+
+def build_shared_retriever(progress=None):
     """
-    RAGの参照先となるデータソースの読み込み
+    全セッションで共有するRetrieverを作成（バックグラウンドのスレッドで実行される）
+    前回作成したインデックスから変更のあったデータソースのみを、新しいバージョンのフォルダへ差分同期する
+    （公開済みの成果物がある場合は、同期せずにそのまま開く）
 
     Args:
-        path: 読み込み対象のファイル/フォルダのパス
-        docs_all: データソースを格納する用のリスト
+        progress: 進捗を記録するIndexBuildProgress（省略可）
+
+    Returns:
+        ベクトル検索とキーワード検索を組み合わせたRetriever
     """
-    # パスがフォルダかどうかを確認
-    if os.path.isdir(path):
-        # フォルダの場合、フォルダ内のファイル/フォルダ名の一覧を取得
-        files = os.listdir(path)
-        # 各ファイル/フォルダに対して処理
-        for file in files:
-            # ファイル/フォルダ名だけでなく、フルパスを取得
-            full_path = os.path.join(path, file)
-            # フルパスを渡し、再帰的にファイル読み込みの関数を実行
-            recursive_file_check(full_path, docs_all)
-    else:
-        # パスがファイルの場合、ファイル読み込み
-        file_load(path, docs_all)
-
-
-def file_load(path, docs_all):
+    # オフラインで作成・公開された成果物を使う場合は、読み取り専用で開くだけにする
+    # （データソースとの同期は「build_index.py update」で行い、アプリ側では書き込まない）
+    if retriever.uses_published_artifact():
+        indexed_retriever = open_indexed_retriever()
+        if indexed_retriever is None:
+            raise RuntimeError(f"{ct.INDEX_ARTIFACT_ERROR_MESSAGE}（{retriever.get_index_dir()}）")
+        return indexed_retriever
+
+    # 前回作成したインデックスから変更がなければ、同期せずにそのまま開く
+    base_dir = index_artifacts.get_current_dir(ct.APP_INDEX_ROOT)
+    if base_dir is not None:
+        plan = ingestion.get_sync_plan(base_dir)
+        retriever.set_index_dir(None)
+        if not plan["full_rebuild"] and not any(plan[key] for key in ["added", "modified", "deleted"]):
+            indexed_retriever = open_indexed_retriever()
+            if indexed_retriever is not None:
+                return indexed_retriever
+
+    # 検索中のインデックスは書き換えず、前回のものをコピーした新しいフォルダで変更分のみを同期し、
+    # 完了後に参照先を切り替える（古いバージョンはrelease_replaced_retrieverで手放して整理する）
+    version_dir = retriever.create_index_version(ct.APP_INDEX_ROOT, base_dir=base_dir)
+    try:
+        retriever.set_index_dir(version_dir)
+        db, sparse_index, _ = ingestion.sync_index(progress=progress)
+        manifest = retriever.load_metadata()
+    except Exception:
+        # 公開しないバージョンのクライアントは手放す（フォルダは次回の整理で削除される）
+        retriever.release_index_dir(version_dir)
+        raise
+    finally:
+        retriever.set_index_dir(None)
+        index_artifacts.finish_version_dir(version_dir)
+    index_artifacts.publish_version(version_dir, ct.APP_INDEX_ROOT)
+    return create_hybrid_retriever(db, sparse_index, manifest, version_dir)
+
+
+def release_replaced_retriever(replaced, current):
     """
-    ファイル内のデータ読み込み
+    差し替え前のRetrieverが使っていたインデックスを手放し、アプリで作成した古いバージョンを整理する
+    （検索に使っているバージョンと作成中のバージョン以外は、新しい順に ct.INDEX_ARTIFACT_KEEP 件まで残す）
 
     Args:
-        path: ファイルパス
-        docs_all: データソースを格納する用のリスト
+        replaced: 差し替え前のRetriever
+        current: 差し替え後のRetriever
     """
-    # ファイルの拡張子を取得
-    file_extension = os.path.splitext(path)[1]
-    # ファイル名（拡張子を含む）を取得
-    file_name = os.path.basename(path)
+    current_dir = current.metadata["index_dir"]
+    if replaced.metadata["index_dir"] != current_dir:
+        retriever.release_index_dir(replaced.metadata["index_dir"])
+    # 作成中のバージョンは、作成中の目印によって整理の対象から外れる
+    exclude = [os.path.basename(current_dir)] if os.path.dirname(current_dir) == os.path.normpath(ct.APP_INDEX_ROOT) else []
+    result = index_artifacts.prune_versions(ct.APP_INDEX_ROOT, ct.INDEX_ARTIFACT_KEEP, exclude=exclude)
+    if result["removed"]:
+        logging.getLogger(ct.LOGGER_NAME).info(f"古いインデックスを削除しました: {result['removed']}")
 
-    # 想定していたファイル形式の場合のみ読み込む
-    if file_extension in ct.SUPPORTED_EXTENSIONS:
-        # ファイルの拡張子に合ったdata loaderを使ってデータ読み込み
-        loader = ct.SUPPORTED_EXTENSIONS[file_extension](path)
-        docs = loader.load()
-        docs_all.extend(docs)
 
-
-def adjust_string(s):
+def clear_shared_retriever():
     """
-    Windows環境でRAGが正常動作するよう調整
-    
-    Args:
-        s: 調整を行う文字列
-    
-    Returns:
-        調整を行った文字列
+    共有インデックスを作り直す
+    データソースを更新した場合に呼び出すと、変更分がバックグラウンドでベクターストアへ同期され、
+    完了するまでは現在のインデックスで検索に応答する
     """
-    # 調整対象は文字列のみ
-    if type(s) is not str:
-        return s
-
-    # OSがWindowsの場合、Unicode正規化と、cp932（Windows用の文字コード）で表現できない文字を除去
-    if sys.platform.startswith("win"):
-        s = unicodedata.normalize('NFC', s)
-        s = s.encode("cp932", "ignore").decode("cp932")
-        return s
-    
-    # OSがWindows以外の場合はそのまま返す
-    return s
+    if get_index_manager().start(force=True):
+        logging.getLogger(ct.LOGGER_NAME).info("共有インデックスの再作成を開始しました。")
 
-def initialize_employee_data():
+
+def initialize_session_state():
     """
-    質問に応じて参照できるよう、社員名簿データをセッションに保存
+    初期化データの用意
     """
-    if "employee_data" in st.session_state:
-        return
+    if "messages" not in st.session_state:
+        # 「表示用」の会話ログを順次格納するリストを用意
+        st.session_state.messages = []
+        # 「LLMとのやりとり用」の会話履歴（直近のやりとりと、それより前の要約）を用意
+        st.session_state.conversation_memory = ConversationMemory()
 
-    employee_path = os.path.join("data", "社員について", "社員名簿.csv")
-    if os.path.exists(employee_path):
-        try:
-            df = pd.read_csv(employee_path)
-            # 列名の表記揺れ対策
-            if "所属部署" not in df.columns and "部署" in df.columns:
-                df = df.rename(columns={"部署": "所属部署"})
-            st.session_state.employee_data = df
-        except Exception as e:
-            logging.getLogger(ct.LOGGER_NAME).warning(f"社員名簿の読み込みに失敗しました: {e}")
 
+def initialize_employee_data():
+    """
+    質問に応じて参照できるよう、全セッション共有の社員ディレクトリを事前に読み込む
+    """
+    try:
+        get_employee_directory()
+    except Exception as e:
+        logging.getLogger(ct.LOGGER_NAME).warning(f"社員名簿の読み込みに失敗しました: {e}")
 
-import os
 
 def setup_environment():
     """
@@ -274,5 +294,3 @@ def setup_environment():
     if not os.path.exists(log_path):
         with open(log_path, "w", encoding="utf-8") as f:
             f.write("")
-    import initialize
-    initialize.initialize()
\ No newline at end of file
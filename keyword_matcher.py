@@ -0,0 +1,115 @@
+"""
+このファイルは、複数のキーワードを一度の走査でまとめて検索する処理（Aho–Corasick法）をまとめたファイルです。
+キーワードの数が増えても、入力テキストの走査は1回で済みます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+from collections import deque
+
+
+############################################################
+# クラス定義
+############################################################
+
+class KeywordMatcher:
+    """
+    キーワードのトライ木に失敗遷移を加えたオートマトン
+    作成後は内容を変更しないため、複数セッション（スレッド）から同時に使用できる
+    """
+
+    def __init__(self, keywords):
+        """
+        Args:
+            keywords: （キーワード, 付加情報）のタプルのイテラブル
+                      同じキーワードを複数回指定した場合、付加情報はすべて保持する
+        """
+        # 状態ごとの遷移先・失敗時の遷移先・その状態で一致が確定するキーワード
+        self._goto = [{}]
+        self._fail = [0]
+        self._outputs = [[]]
+        # キーワードごとの付加情報
+        self._payloads = {}
+
+        for keyword, payload in keywords:
+            if not keyword:
+                continue
+            if keyword not in self._payloads:
+                self._payloads[keyword] = []
+                self._add_keyword(keyword)
+            if payload not in self._payloads[keyword]:
+                self._payloads[keyword].append(payload)
+
+        self._build_failure_links()
+
+    def __len__(self):
+        return len(self._payloads)
+
+    def _add_keyword(self, keyword):
+        # トライ木にキーワードを追加
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+        self._outputs[state].append(keyword)
+
+    def _build_failure_links(self):
+        # 幅優先で、各状態の失敗時の遷移先（最長の接尾辞に対応する状態）を設定
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                # 接尾辞として含まれるキーワードも、同じ位置で一致したものとして扱う
+                self._outputs[next_state] = self._outputs[next_state] + self._outputs[self._fail[next_state]]
+
+    def find_all(self, text):
+        """
+        テキストに含まれるキーワードを、重なりも含めてすべて検索
+
+        Args:
+            text: 検索対象のテキスト
+
+        Returns:
+            （開始位置, 終了位置, キーワード, 付加情報のリスト）のタプルのリスト（終了位置の昇順）
+        """
+        matches = []
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for keyword in self._outputs[state]:
+                end = position + 1
+                matches.append((end - len(keyword), end, keyword, self._payloads[keyword]))
+        return matches
+
+    def find_longest(self, text):
+        """
+        テキストに含まれるキーワードを、重ならないように左から最長一致で検索
+        （例: 「NoSQL」を含むテキストでは、「SQL」ではなく「NoSQL」として扱う）
+
+        Args:
+            text: 検索対象のテキスト
+
+        Returns:
+            （開始位置, 終了位置, キーワード, 付加情報のリスト）のタプルのリスト（開始位置の昇順）
+        """
+        selected = []
+        last_end = 0
+        for match in sorted(self.find_all(text), key=lambda match: (match[0], -match[1])):
+            if match[0] >= last_end:
+                selected.append(match)
+                last_end = match[1]
+        return selected
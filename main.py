@@ -15,31 +15,27 @@ import streamlit as st
 import utils
 # （自作）アプリ起動時に実行される初期化処理が記述された関数
 from initialize import initialize
-# （自作）フォルダ構成やログファイルの初期セットアップ
-from initialize import setup_environment
+# （自作）全セッション共有のベクターストアのキャッシュ破棄
+from initialize import clear_shared_retriever
+# （自作）全セッション共有のインデックス作成の管理オブジェクト
+from initialize import get_index_manager
+# （自作）検索クエリ作成時の経路の集計値
+from query_condenser import get_condense_metrics
+# （自作）初期化処理のステージごとの所要時間
+from boot import get_boot_timings
+# （自作）全セッション共有の社員ディレクトリ
+from employee_directory import get_employee_directory
+# （自作）社員に関する質問文の絞り込み条件への変換
+from employee_query import parse_employee_query
+# （自作）LLMを使わない「社内文書検索」モードの回答作成
+from doc_search import search_documents
 # （自作）画面表示系の関数が定義されているモジュール
 import components as cn
 # （自作）変数（定数）がまとめて定義・管理されているモジュール
 import constants as ct
 from constants import MAX_CONTEXT_LENGTH
-import pandas as pd
 import os
 
-def format_row(df):
-    if df.empty:
-        return "該当するデータがありません。"
-
-    headers = df.columns.tolist()
-    header_row = "| " + " | ".join(headers) + " |\n"
-    separator = "| " + " | ".join(["---"] * len(headers)) + " |\n"
-
-    body = ""
-    for _, row in df.iterrows():
-        values = [str(v) if pd.notna(v) else "" for v in row.tolist()]
-        body += "| " + " | ".join(values) + " |\n"
-
-    return header_row + separator + body
-
 ############################################################
 # 2. 設定関連
 ############################################################
@@ -67,13 +63,9 @@ logger = logging.getLogger(ct.LOGGER_NAME)
 ############################################################
 # 3. 初期化処理
 ############################################################
-# ==========================================
-# フォルダ構成やログファイルの初期セットアップ
-# ==========================================
-setup_environment()
-
 try:
     # 初期化処理（「initialize.py」の「initialize」関数を実行）
+    # （フォルダ構成やログファイルの初期セットアップも含め、完了済みの処理はスキップされる）
     initialize()
 except Exception as e:
     # エラーログの出力
@@ -98,6 +90,9 @@ with st.sidebar:
     # 入力例の表示
     cn.display_sample_prompts()
 
+    # 社内文書のインデックスの作成状況の表示
+    cn.display_index_status(get_index_manager())
+
     # 開発者メニュー（左下に表示）
     st.markdown("---")
     dev_col1, dev_col2 = st.columns([0.15, 0.85])
@@ -110,6 +105,13 @@ with st.sidebar:
             key="dev_mode_toggle", 
             help="ログ表示などの開発用メニューの切り替え"
         )
+    # 開発者モード時のみ、共有ベクターストアの再作成ボタンと各種の計測値を表示
+    if st.session_state.show_debug_logs:
+        st.caption(f"検索クエリの作成経路: {get_condense_metrics()}")
+        st.caption(f"初期化処理の所要時間: {get_boot_timings()}")
+        if st.button("ベクターストアを再作成", help="データソース更新後に、全セッション共有のベクターストアを作り直す"):
+            clear_shared_retriever()
+            st.rerun()
 
 # タイトル表示
 cn.display_app_title()
@@ -131,70 +133,32 @@ except Exception as e:
 ############################################################
 # 6. チャット入力の受け付け
 ############################################################
-chat_message = st.chat_input(ct.CHAT_INPUT_HELPER_TEXT)
+# 検索に使えるインデックスがまだない場合は、作成中である旨を表示し、チャット入力を受け付けない
+index_ready = st.session_state.retriever is not None
+if not index_ready and get_index_manager().is_building():
+    st.info(ct.INDEXING_MESSAGE)
+chat_message = st.chat_input(ct.CHAT_INPUT_HELPER_TEXT, disabled=not index_ready)
 
 ############################################################
 # 7. チャット送信時の処理
 ############################################################
 def build_employee_context(chat_message):
     employee_context = ""
-    if any(keyword in chat_message for keyword in ["人事部", "営業部", "資格", "インターン", "マネージャー", "女性", "上智大学", "59歳", "SQL", "Python"]):
-        try:
-            df = pd.read_csv("data/社員について/社員名簿.csv")
-
-            # 列名の整形
-            df.columns = df.columns.str.strip().str.replace("（", "(", regex=False).str.replace("）", ")", regex=False)
-            df = df[df["氏名（フルネーム）"] != "氏名（フルネーム）"]
-            logger.warning(f"社員名簿の列名一覧: {df.columns.tolist()}")
-            # 検索条件の定義
-            keyword_filters = {
-                "人事部": lambda df: df["所属部署"].str.contains("人事", na=False),
-                "営業部": lambda df: df["所属部署"].str.contains("営業", na=False),
-                "資格": lambda df: df["保有資格"].notna() & (df["保有資格"] != ""),
-                "インターン": lambda df: df["従業員区分"].str.contains("インターン", na=False),
-                "マネージャー": lambda df: df["役職"].str.contains("マネージャー", na=False),
-                "女性": lambda df: df["性別"] == "女性",
-                "上智大学": lambda df: df["大学名"].str.contains("上智", na=False),
-                "59歳": lambda df: df["年齢"].astype(str) == "59",  # 年齢カラムが数値である可能性に備えて
-                "SQL": lambda df: df["スキルセット"].str.contains("SQL", na=False),
-                "Python": lambda df: df["スキルセット"].str.contains("Python", na=False),
-            }
-
-            # OR条件でフィルタリングを適用
-            conditions = []
-
-            for keyword, condition in keyword_filters.items():
-                if keyword in chat_message:
-                    conditions.append(condition(df))
-
-            if conditions:
-                combined_condition = conditions[0]
-                for cond in conditions[1:]:
-                    combined_condition |= cond
-                filtered_df = df[combined_condition]
-            else:
-                filtered_df = df.copy()
-
-            formatted = format_row(filtered_df)
-            if len(formatted) <= MAX_CONTEXT_LENGTH:
-                employee_context = formatted
-            else:
-                headers = filtered_df.columns.tolist()
-                header_row = "| " + " | ".join(headers) + " |\n"
-                separator = "| " + " | ".join(["---"] * len(headers)) + " |\n"
-                truncated = header_row + separator
-                current_length = len(truncated)
-
-                for _, row in filtered_df.iterrows():
-                    row_text = "| " + " | ".join(str(v) if pd.notna(v) else "" for v in row.tolist()) + " |\n"
-                    if current_length + len(row_text) > MAX_CONTEXT_LENGTH:
-                        break
-                    truncated += row_text
-                    current_length += len(row_text)
-
-                employee_context = truncated
-        except Exception as e:
-            logger.warning(f"社員名簿の読み込みに失敗しました: {e}")
+    try:
+        # 全セッション共有の社員ディレクトリ（社員名簿が更新された場合のみ再読み込み）
+        directory = get_employee_directory()
+        # 質問文を絞り込み条件に変換し、インデックスを使って該当する社員だけを抽出
+        plan = parse_employee_query(chat_message, directory)
+        # 絞り込み条件がなく、全員の一覧も求められていない場合は、名簿全体を渡さないよう表を付けない
+        if not plan and not plan.list_all:
+            logger.info({"employee_query": plan.describe(), "matched_rows": 0})
+            return employee_context
+        rows = plan.execute(directory)
+        logger.info({"employee_query": plan.describe(), "matched_rows": len(rows)})
+        # 上限の文字数に収まる範囲で、Markdownの表に整形
+        employee_context = directory.render_table(rows, MAX_CONTEXT_LENGTH)
+    except Exception as e:
+        logger.warning(f"社員名簿の読み込みに失敗しました: {e}")
     return employee_context
 
 def handle_chat(chat_message):
@@ -215,13 +179,12 @@ def handle_chat(chat_message):
         employee_context = ""
         if utils.should_use_employee_data(chat_message, st.session_state.mode):
             employee_context = build_employee_context(chat_message)
-        # 「st.spinner」でグルグル回っている間、表示の不具合が発生しないよう空のエリアを表示
-        res_box = st.empty()
-        # LLMによる回答生成（回答生成が完了するまでグルグル回す）
-        with st.spinner(ct.SPINNER_TEXT):
+        # 「社内文書検索」モードでは、LLMを呼ばずに検索結果のスコアのみで該当資料を判定する
+        use_fast_search = st.session_state.mode == ct.ANSWER_MODE_1 and not ct.DOC_SEARCH_LLM_CHECK
+        llm_response = None
+        if use_fast_search:
             try:
-                # 画面読み込み時に作成したRetrieverを使い、Chainを実行
-                llm_response = utils.get_llm_response(chat_message, employee_context=employee_context)
+                llm_response = search_documents(chat_message, st.session_state.retriever)
             except Exception as e:
                 # エラーログの出力
                 logger.error(f"{ct.GET_LLM_RESPONSE_ERROR_MESSAGE}\n{e}")
@@ -229,6 +192,31 @@ def handle_chat(chat_message):
                 st.error(utils.build_error_message(ct.GET_LLM_RESPONSE_ERROR_MESSAGE), icon=ct.ERROR_ICON)
                 # 後続の処理を中断
                 st.stop()
+        else:
+            # ほぼ同じ質問への回答がキャッシュにあれば、LLMを呼ばずにその回答を使う
+            try:
+                llm_response = utils.get_cached_llm_response(chat_message, employee_context=employee_context)
+            except Exception as e:
+                # キャッシュが使えない場合も、通常どおりLLMから回答を取得する
+                logger.warning(f"回答キャッシュの参照に失敗しました: {e}")
+        use_cache = not use_fast_search and llm_response is not None
+        # 「社内問い合わせ」モードでは、回答の完了を待たずに生成されたそばから表示する
+        use_stream = not use_cache and st.session_state.mode == ct.ANSWER_MODE_2 and ct.STREAM_INQUIRY_RESPONSE
+        if llm_response is None and not use_stream:
+            # 「st.spinner」でグルグル回っている間、表示の不具合が発生しないよう空のエリアを表示
+            res_box = st.empty()
+            # LLMによる回答生成（回答生成が完了するまでグルグル回す）
+            with st.spinner(ct.SPINNER_TEXT):
+                try:
+                    # 画面読み込み時に作成したRetrieverを使い、Chainを実行
+                    llm_response = utils.get_llm_response(chat_message, employee_context=employee_context)
+                except Exception as e:
+                    # エラーログの出力
+                    logger.error(f"{ct.GET_LLM_RESPONSE_ERROR_MESSAGE}\n{e}")
+                    # エラーメッセージの画面表示
+                    st.error(utils.build_error_message(ct.GET_LLM_RESPONSE_ERROR_MESSAGE), icon=ct.ERROR_ICON)
+                    # 後続の処理を中断
+                    st.stop()
 
         # ==========================================
         # 7-3. LLMからの回答表示
@@ -246,13 +234,27 @@ def handle_chat(chat_message):
                 # モードが「社内問い合わせ」の場合
                 # ==========================================
                 elif st.session_state.mode == ct.ANSWER_MODE_2:
-                    # 入力に対しての回答と、参照した文書のありかを表示
-                    content = cn.display_contact_llm_response(llm_response)
+                    if use_stream:
+                        try:
+                            # 参照した文書のありかを検索完了時点で表示し、回答は生成されたそばから表示
+                            content = cn.display_contact_llm_response_stream(
+                                utils.stream_llm_response(chat_message, employee_context=employee_context)
+                            )
+                        except Exception as e:
+                            # エラーログの出力
+                            logger.error(f"{ct.GET_LLM_RESPONSE_ERROR_MESSAGE}\n{e}")
+                            # エラーメッセージの画面表示
+                            st.error(utils.build_error_message(ct.GET_LLM_RESPONSE_ERROR_MESSAGE), icon=ct.ERROR_ICON)
+                            # 後続の処理を中断
+                            st.stop()
+                    else:
+                        # 入力に対しての回答と、参照した文書のありかを表示
+                        content = cn.display_contact_llm_response(llm_response)
 
                 # AIメッセージのログ出力
                 logger.info({"message": content, "application_mode": st.session_state.mode})
                 # 出典情報の表示
-                if "file_info_list" in llm_response:
+                if not use_stream and "file_info_list" in llm_response:
                     sources_markdown = "\n".join(
                         f"- [{os.path.basename(path)}]({path})" for path in llm_response["file_info_list"]
                     )
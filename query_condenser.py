@@ -0,0 +1,134 @@
+"""
+このファイルは、会話履歴を踏まえた検索クエリの作成（独立した質問文への書き換え）をまとめたファイルです。
+会話履歴がない場合や、入力だけで意味が通じる場合はLLMによる書き換えを省略し、
+書き換えた結果は（会話履歴, 入力）の組み合わせごとにキャッシュします。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+import constants as ct
+
+
+############################################################
+# 変数定義
+############################################################
+# 書き換え結果のキャッシュ（LRU）
+_rewrite_cache = OrderedDict()
+# 各経路を通った回数の集計
+_metrics = {"no_history": 0, "standalone": 0, "cache_hit": 0, "rewrite": 0}
+# 複数セッション（スレッド）から同時に更新されるため、ロックで排他制御する
+_lock = threading.Lock()
+
+
+############################################################
+# 関数定義
+############################################################
+
+def is_standalone_query(text):
+    """
+    会話履歴がなくても意味が通じる入力かどうかを、簡易的なルールで判定
+
+    Args:
+        text: ユーザー入力値
+
+    Returns:
+        True: 単独で意味が通じる、False: 会話履歴を踏まえた書き換えが必要
+    """
+    text = text.strip()
+    # 短すぎる入力は、前の話題を前提にしている可能性が高い
+    if len(text) < ct.STANDALONE_QUERY_MIN_LENGTH:
+        return False
+    # 前の話題を受ける接続表現で始まる入力
+    if text.startswith(tuple(ct.CONTEXT_DEPENDENT_PREFIXES)):
+        return False
+    # 指示語など、前の発言を参照する表現を含む入力
+    return not any(word in text for word in ct.CONTEXT_DEPENDENT_WORDS)
+
+
+def get_history_digest(chat_history):
+    """
+    会話履歴の内容から、キャッシュのキーに使うダイジェストを作成
+
+    Args:
+        chat_history: 会話履歴（メッセージまたは文字列のリスト）
+
+    Returns:
+        ダイジェスト文字列
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for message in chat_history:
+        content = getattr(message, "content", message)
+        digest.update(f"{type(message).__name__}\0{content}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def record_path(path):
+    # どの経路で検索クエリを決定したかを集計
+    with _lock:
+        _metrics[path] += 1
+
+
+def get_condense_metrics():
+    """
+    検索クエリ作成時に各経路を通った回数を取得
+
+    Returns:
+        {"no_history": 履歴なし, "standalone": 単独で意味が通じる, "cache_hit": キャッシュ利用, "rewrite": LLMで書き換え}
+    """
+    with _lock:
+        return dict(_metrics)
+
+
+def create_condensing_retriever(llm, retriever, prompt):
+    """
+    会話履歴を踏まえて検索クエリを作成し、ベクターストアを検索するRunnableを作成
+    （langchainのcreate_history_aware_retrieverの代わりに使用）
+
+    Args:
+        llm: 書き換えに使うLLM
+        retriever: ベクターストアを検索するRetriever
+        prompt: 独立した質問文に書き換えるためのプロンプトテンプレート
+
+    Returns:
+        {"input", "chat_history"（, "question"）} を受け取り、ドキュメントのリストを返すRunnable
+    """
+    rewrite_chain = prompt | llm | StrOutputParser()
+
+    def condense(inputs, config):
+        chat_history = inputs.get("chat_history") or []
+        # 書き換え要否の判定には、社員情報などを付加する前の元の質問を使う
+        question = inputs.get("question") or inputs["input"]
+
+        # 初回の質問、または単独で意味が通じる質問は、LLMを呼ばずにそのまま検索に使う
+        if not chat_history:
+            record_path("no_history")
+            return inputs["input"]
+        if is_standalone_query(question):
+            record_path("standalone")
+            return inputs["input"]
+
+        # 同じ会話履歴・同じ入力の書き換え結果があれば再利用
+        cache_key = (get_history_digest(chat_history), inputs["input"])
+        with _lock:
+            if cache_key in _rewrite_cache:
+                _rewrite_cache.move_to_end(cache_key)
+                _metrics["cache_hit"] += 1
+                return _rewrite_cache[cache_key]
+
+        record_path("rewrite")
+        rewritten = rewrite_chain.invoke(inputs, config)
+        with _lock:
+            _rewrite_cache[cache_key] = rewritten
+            while len(_rewrite_cache) > ct.QUERY_REWRITE_CACHE_SIZE:
+                _rewrite_cache.popitem(last=False)
+        logging.getLogger(ct.LOGGER_NAME).info({"rewritten_query": rewritten})
+        return rewritten
+
+    return (RunnableLambda(condense) | retriever).with_config(run_name="condensing_retriever")
@@ -0,0 +1,138 @@
+"""
+このファイルは、検索で取得した候補チャンクの並べ替え（リランキング）をまとめたファイルです。
+多めに取得した候補を、検索クエリとの関連度をCPU上で計算し直して並べ替え、
+データソースごとの件数に上限を設けて重複を除いたうえで、上位だけを残します。
+関連度の計算方法（スコアラー）は差し替え可能で、既定は語の一致率、
+ローカルのCross-Encoderモデルが使える環境ではそちらも選択できます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import logging
+from collections import Counter
+from functools import lru_cache
+import constants as ct
+from sparse_index import tokenize
+
+
+############################################################
+# 関数定義
+############################################################
+
+def lexical_overlap_scores(query, documents):
+    """
+    検索クエリの語（英数字は単語、日本語は文字2-gram）のうち、チャンクに含まれる割合をスコアとする
+
+    Args:
+        query: 検索クエリ
+        documents: 候補チャンクのリスト
+
+    Returns:
+        チャンクごとのスコアのリスト（0〜1）
+    """
+    query_terms = set(tokenize(query))
+    if not query_terms:
+        return [0.0] * len(documents)
+    return [len(query_terms & set(tokenize(document.page_content))) / len(query_terms) for document in documents]
+
+
+@lru_cache(maxsize=None)
+def get_cross_encoder(model_name=ct.RERANK_CROSS_ENCODER_MODEL):
+    """
+    Cross-Encoderモデルを取得（プロセス内で1回のみ読み込む）
+
+    Args:
+        model_name: モデル名
+
+    Returns:
+        CrossEncoderのインスタンス。ライブラリ・モデルが利用できない場合はNone
+    """
+    try:
+        from sentence_transformers import CrossEncoder
+        return CrossEncoder(model_name, device="cpu")
+    except Exception as e:
+        logging.getLogger(ct.LOGGER_NAME).warning(f"Cross-Encoderモデルを読み込めないため、語の一致率で並べ替えます。（{type(e).__name__}）")
+        return None
+
+
+def cross_encoder_scores(query, documents):
+    """
+    Cross-Encoderモデルで、検索クエリとチャンクの組ごとの関連度をスコアとする
+
+    Args:
+        query: 検索クエリ
+        documents: 候補チャンクのリスト
+
+    Returns:
+        チャンクごとのスコアのリスト
+    """
+    model = get_cross_encoder()
+    if model is None:
+        return lexical_overlap_scores(query, documents)
+    return [float(score) for score in model.predict([(query, document.page_content) for document in documents])]
+
+
+def get_scorer(name=ct.RERANK_SCORER):
+    """
+    名前に対応するスコアラーを取得
+
+    Args:
+        name: スコアラー名（「lexical」: 語の一致率、「cross_encoder」: Cross-Encoderモデル）
+
+    Returns:
+        (検索クエリ, 候補チャンクのリスト) を受け取り、スコアのリストを返す関数
+    """
+    scorers = {
+        "lexical": lexical_overlap_scores,
+        "cross_encoder": cross_encoder_scores,
+    }
+    if name not in scorers:
+        logging.getLogger(ct.LOGGER_NAME).warning(f"未対応のスコアラーが指定されたため、語の一致率で並べ替えます: {name}")
+        return lexical_overlap_scores
+    return scorers[name]
+
+
+def rerank_documents(query, documents, k, scorer=lexical_overlap_scores, max_per_source=None):
+    """
+    候補チャンクを、スコアラーで計算し直した関連度の順に並べ替えて上位k件を取得
+    （スコアが同じ場合は、元の検索順位が高い方を優先）
+    1つの長いファイルのチャンクで上位が埋まらないよう、データソースごとにmax_per_source件までに絞りながらk件を選ぶ
+
+    Args:
+        query: 検索クエリ
+        documents: 候補チャンクのリスト（元の検索順位の順）
+        k: 残すチャンク数
+        scorer: スコアラー
+        max_per_source: 1つのデータソースから残すチャンク数の上限（省略時は ct.RERANK_MAX_CHUNKS_PER_SOURCE）
+
+    Returns:
+        並べ替えたチャンクのリスト（メタデータの「relevance_score」にスコア、
+        「source_rank」に同じデータソースのチャンクの中での順位（0始まり）を持つ）
+    """
+    if not documents:
+        return documents
+    if max_per_source is None:
+        max_per_source = ct.RERANK_MAX_CHUNKS_PER_SOURCE
+    scores = scorer(query, documents)
+    order = sorted(range(len(documents)), key=lambda i: -scores[i])
+    # 計算し直した関連度は、後続の処理（該当なしの判定など）で使えるようメタデータに記録
+    for document, score in zip(documents, scores):
+        document.metadata["relevance_score"] = score
+
+    # 関連度の高い順に、上限に達したデータソースのチャンクを読み飛ばしながらk件を選ぶ
+    source_counts = Counter()
+    full_sources = set()
+    reranked = []
+    for i in order:
+        if len(reranked) >= k:
+            break
+        source = documents[i].metadata.get("source")
+        if source in full_sources:
+            continue
+        documents[i].metadata["source_rank"] = source_counts[source]
+        source_counts[source] += 1
+        if source_counts[source] >= max_per_source:
+            full_sources.add(source)
+        reranked.append(documents[i])
+    return reranked
@@ -2,105 +2,572 @@
 # ベクトル化処理・検索機能定義ファイル
 # - ドキュメントの再帰的読み込みと更新チェック
 # - Chromaベースのベクトルストア生成と保存
+# - 変更のあったファイルのみを反映する差分同期（キーワード検索用インデックスも同時に更新）
+# - インデックスの格納先フォルダ（公開中の成果物、または「.chroma」）の解決
 # - クエリによる類似検索を提供
 # ==========================================
 
+import atexit
 import hashlib
 import json
 import os
+import threading
+import time
+from datetime import datetime
+import chromadb
+from chromadb.config import Settings
 from langchain_core.documents import Document
-from langchain_community.document_loaders import UnstructuredPDFLoader, TextLoader, CSVLoader, UnstructuredWordDocumentLoader
 from langchain_community.vectorstores import Chroma
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
+import constants as ct
+import embedding
+import index_artifacts
+import chunking
+from sparse_index import load_sparse_index
 
-METADATA_FILE = ".chroma/metadata.json"
+HASH_BLOCK_SIZE = 1024 * 1024  # ハッシュ計算時に1回で読み込むバイト数
+RACY_MTIME_WINDOW_NS = 2 * 1000 ** 3  # 署名を信頼しない、更新直後の期間（ナノ秒）
+
+# インデックス（ベクターストア・マニフェスト・キーワード検索用インデックス）の格納先フォルダの指定
+# スレッドごとに保持するため、バックグラウンドで新しいフォルダに作成している間も、他のスレッドの参照先は変わらない
+_index_dir = threading.local()
+# プロセス内で開いたChromaクライアント（永続化先フォルダごとに1つ。使わなくなったものはrelease_index_dirで手放す）
+_chroma_clients = {}
+_chroma_clients_lock = threading.Lock()
+
+def get_index_dir():
+    """
+    インデックスの格納先フォルダを取得
+    set_index_dirで指定されていない場合、オフラインで公開した成果物があればそのフォルダ、
+    なければアプリで作成した最新のインデックスのフォルダ、どちらもなければ ct.VECTOR_STORE_DIR
+    """
+    path = getattr(_index_dir, "path", None)
+    if path is not None:
+        return path
+    return (
+        index_artifacts.get_current_dir()
+        or index_artifacts.get_current_dir(ct.APP_INDEX_ROOT)
+        or ct.VECTOR_STORE_DIR
+    )
+
+def set_index_dir(path):
+    # 呼び出したスレッドでの、インデックスの格納先フォルダを切り替える（Noneの場合は既定の解決方法に戻す）
+    _index_dir.path = path
+
+def uses_published_artifact():
+    # オフラインで公開した成果物を開いているか（成果物は書き換えないため、アプリからは同期しない）
+    return getattr(_index_dir, "path", None) is None and index_artifacts.get_current_dir() is not None
+
+def get_metadata_path():
+    # マニフェストのファイルパス
+    return os.path.join(get_index_dir(), ct.VECTOR_STORE_MANIFEST_FILE)
+
+def get_vector_store_dir():
+    # ベクターストアの永続化先フォルダ
+    return os.path.join(get_index_dir(), ct.VECTOR_STORE_SUBDIR)
+
+def get_sparse_index_path():
+    # キーワード検索用インデックスのファイルパス
+    return os.path.join(get_index_dir(), ct.SPARSE_INDEX_FILE)
 
 def load_metadata():
-    # ベクトルストアのメタデータ読み込み
-    if not os.path.exists(METADATA_FILE):
+    # ベクトルストアのメタデータ（マニフェスト）読み込み
+    metadata_path = get_metadata_path()
+    if not os.path.exists(metadata_path):
         return {}
-    with open(METADATA_FILE, "r", encoding="utf-8") as f:
+    with open(metadata_path, "r", encoding="utf-8") as f:
         return json.load(f)
 
 def save_metadata(meta):
-    # ベクトルストアのメタデータ保存
-    os.makedirs(os.path.dirname(METADATA_FILE), exist_ok=True)
-    with open(METADATA_FILE, "w", encoding="utf-8") as f:
+    # ベクトルストアのメタデータ（マニフェスト）保存
+    # 書き込み途中で中断しても壊れたファイルが残らないよう、一時ファイルに書いてから置き換える
+    metadata_path = get_metadata_path()
+    os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
+    tmp_path = metadata_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
         json.dump(meta, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, metadata_path)
 
 def calculate_hash(file_path):
-    # 指定ファイルのMD5ハッシュを生成
+    # 指定ファイルのBLAKE2bハッシュを生成
+    # 大きなファイルでもメモリを消費しないよう、固定サイズのブロック単位で読み込む
+    digest = hashlib.blake2b(digest_size=20)
     with open(file_path, "rb") as f:
-        return hashlib.md5(f.read()).hexdigest()
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def get_file_signature(file_path):
+    """
+    ファイル内容を読まずに変更を検知するための署名（サイズ・更新日時・inode）を取得
+
+    Args:
+        file_path: ファイルパス
+
+    Returns:
+        [サイズ, 更新日時（ナノ秒）, inode] のリスト。更新直後で信頼できない場合はNone
+    """
+    stat_result = os.stat(file_path)
+    # 更新日時の分解能内に再度書き換えられると署名が変わらないため、直近に更新されたファイルは署名を使わない
+    if time.time_ns() - stat_result.st_mtime_ns < RACY_MTIME_WINDOW_NS:
+        return None
+    return [stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino]
 
 def get_loader(file_path):
+    # 拡張子に合ったdata loaderを取得（対象外の拡張子の場合はNone）
     ext = os.path.splitext(file_path)[-1].lower()
-    if ext == ".pdf":
-        return UnstructuredPDFLoader(file_path)
-    elif ext == ".txt":
-        return TextLoader(file_path)
-    elif ext == ".csv":
-        return CSVLoader(file_path)
-    elif ext == ".docx":
-        return UnstructuredWordDocumentLoader(file_path)
-    else:
+    if ext not in ct.SUPPORTED_EXTENSIONS:
         return None
+    return ct.SUPPORTED_EXTENSIONS[ext](file_path)
 
-def get_all_documents(data_path: str):
-    documents = []
-    metadata = load_metadata()
-    updated_metadata = {}
+def load_file(file_path):
+    """
+    1ファイル分のドキュメントを読み込む
+
+    Args:
+        file_path: ファイルパス
+
+    Returns:
+        読み込んだドキュメントのリスト（対象外の拡張子の場合は空リスト）
+    """
+    loader = get_loader(file_path)
+    if not loader:
+        return []
+    docs = loader.load()
+    source_metadata = build_source_metadata(file_path)
+    for doc in docs:
+        doc.metadata["source"] = file_path
+        doc.metadata.update(source_metadata)
+    return docs
+
+def build_source_metadata(source):
+    """
+    データソースの格納場所から、検索の絞り込みに使うメタデータを作成
+    （Chromaのメタデータには None を保存できないため、該当しない項目は含めない）
+
+    Args:
+        source: データソース（ファイルパスまたはURL）
+
+    Returns:
+        {"category": 分類, "doc_type": 文書種別, "file_type": 拡張子
+         （, "customer": 顧客名, "customer_status": 既存・見込み）} の辞書
+    """
+    if source.startswith("http"):
+        return {"category": ct.WEB_DOC_CATEGORY, "doc_type": ct.DEFAULT_DOC_TYPE, "file_type": "html"}
+
+    relative_path = os.path.relpath(source, ct.RAG_TOP_FOLDER_PATH)
+    folders = os.path.normpath(relative_path).split(os.sep)[:-1]
+    file_name = os.path.basename(source)
+    metadata = {
+        "category": folders[0] if folders else "",
+        "file_type": os.path.splitext(file_name)[1].lower().lstrip("."),
+    }
+
+    # 「<分類>/顧客/<既存・見込み>/<会社名>/...」の場合は顧客名を付加
+    if ct.CUSTOMER_FOLDER_NAME in folders:
+        position = folders.index(ct.CUSTOMER_FOLDER_NAME)
+        if len(folders) > position + 2:
+            metadata["customer_status"] = folders[position + 1]
+            metadata["customer"] = folders[position + 2]
 
+    # ファイル名、次にフォルダ名に含まれる語で文書種別を判定
+    metadata["doc_type"] = ct.DEFAULT_DOC_TYPE
+    for target in [file_name, "/".join(folders)]:
+        matched = [doc_type for keyword, doc_type in ct.DOC_TYPE_RULES if keyword in target]
+        if matched:
+            metadata["doc_type"] = matched[0]
+            break
+    return metadata
+
+def scan_corpus(data_path: str, update_stats=True):
+    """
+    データフォルダ内の読み込み対象ファイルと、そのハッシュ値の一覧を取得
+    サイズ・更新日時・inodeがマニフェストに記録済みの値と同じファイルは、ハッシュを再計算せずに記録済みの値を使う
+
+    Args:
+        data_path: データフォルダのパス
+        update_stats: True: 署名のキャッシュをマニフェストへ書き戻す、False: 書き込みを行わない（検証・試行用）
+
+    Returns:
+        {ファイルパス: ハッシュ値} の辞書
+    """
+    metadata = load_metadata()
+    cached_stats = metadata.get("file_stats", {})
+    file_stats = {}
+    file_hashes = {}
     for root, _, files in os.walk(data_path):
         for file in files:
             file_path = os.path.join(root, file)
-            if not file_path.lower().endswith((".pdf", ".txt", ".csv", ".docx")):
+            if os.path.splitext(file_path)[1].lower() not in ct.SUPPORTED_EXTENSIONS:
                 continue
 
-            file_hash = calculate_hash(file_path)
-            if metadata.get(file_path) == file_hash:
-                continue  # 変更なし
+            signature = get_file_signature(file_path)
+            cached = cached_stats.get(file_path)
+            if signature is not None and cached and cached["signature"] == signature:
+                file_hash = cached["hash"]
+            else:
+                file_hash = calculate_hash(file_path)
+            file_hashes[file_path] = file_hash
+            if signature is not None:
+                file_stats[file_path] = {"signature": signature, "hash": file_hash}
 
-            loader = get_loader(file_path)
-            if not loader:
-                continue
+    # 署名のキャッシュに変化があった場合のみマニフェストへ書き戻す
+    if update_stats and file_stats != cached_stats:
+        metadata["file_stats"] = file_stats
+        save_metadata(metadata)
+    return file_hashes
+
+def build_source_hashes(file_hashes, web_hashes):
+    """
+    ファイルとWebページをまとめた、同期対象のデータソース一覧を作成
+
+    Args:
+        file_hashes: {ファイルパス: ハッシュ値} の辞書
+        web_hashes: {WebページのURL: 本文のハッシュ値} の辞書（web_fetcher.scan_web_pagesの戻り値）
+
+    Returns:
+        {データソース: ハッシュ値} の辞書
+    """
+    source_hashes = dict(file_hashes)
+    source_hashes.update(web_hashes)
+    return source_hashes
+
+def calculate_corpus_fingerprint(file_hashes, web_hashes):
+    """
+    コーパス全体のフィンガープリントを算出
+    ファイル・Webページのいずれかの追加・削除・更新があれば値が変わる
+
+    Args:
+        file_hashes: {ファイルパス: ハッシュ値} の辞書
+        web_hashes: {WebページのURL: 本文のハッシュ値} の辞書
+
+    Returns:
+        フィンガープリント文字列
+    """
+    digest = hashlib.sha256()
+    for file_path in sorted(file_hashes):
+        digest.update(f"{file_path}\0{file_hashes[file_path]}\n".encode("utf-8"))
+    for web_url in sorted(web_hashes):
+        digest.update(f"{web_url}\0{web_hashes[web_url]}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def build_manifest(file_hashes, web_hashes):
+    """
+    現在の設定とコーパスの状態から、インデックスのマニフェストを作成
+
+    Args:
+        file_hashes: {ファイルパス: ハッシュ値} の辞書
+        web_hashes: {WebページのURL: 本文のハッシュ値} の辞書
+
+    Returns:
+        マニフェスト（辞書）
+    """
+    return {
+        "embedding_model": embedding.get_embedding_model_name(),
+        "collection_name": ct.VECTOR_STORE_COLLECTION_NAME,
+        "chunk_max_tokens": ct.CHUNK_MAX_TOKENS,
+        "chunk_overlap_tokens": ct.CHUNK_OVERLAP_TOKENS,
+        "chunk_min_tokens": ct.CHUNK_MIN_TOKENS,
+        "chunk_tokenizer": chunking.get_tokenizer_name(),
+        "metadata_version": ct.DOCUMENT_METADATA_VERSION,
+        "corpus_fingerprint": calculate_corpus_fingerprint(file_hashes, web_hashes),
+        "web_urls": sorted(web_hashes),
+    }
+
+def is_manifest_compatible(saved_manifest, current_manifest):
+    """
+    保存済みのインデックスが、現在の埋め込みモデル・チャンク分割条件・メタデータの形式のまま使えるかを判定
+    （互換性がない場合、差分同期ではなく全件の作り直しが必要）
+
+    Args:
+        saved_manifest: 前回インデックス作成時に保存したマニフェスト
+        current_manifest: 現在の状態から作成したマニフェスト
+
+    Returns:
+        True: 差分同期が可能、False: 作り直しが必要
+    """
+    keys = [
+        "embedding_model", "collection_name", "chunk_max_tokens", "chunk_overlap_tokens",
+        "chunk_min_tokens", "chunk_tokenizer", "metadata_version",
+    ]
+    return all(saved_manifest.get(key) == current_manifest[key] for key in keys)
+
+def get_index_version(manifest):
+    """
+    インデックスのバージョン（同期で中身が変わるたびに変わる値）を取得
+    回答キャッシュなど、インデックスの内容に依存するデータの無効化に使う
+
+    Args:
+        manifest: 保存済みのマニフェスト
+
+    Returns:
+        バージョン文字列
+    """
+    keys = ["embedding_model", "collection_name", "corpus_fingerprint", "built_at", "chunk_count"]
+    payload = json.dumps([manifest.get(key) for key in keys], ensure_ascii=False)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=8).hexdigest()
+
+def make_chunk_id(source, source_hash, offset):
+    """
+    チャンクの安定ID（データソース・内容・チャンクの位置が同じなら常に同じ値）を作成
+
+    Args:
+        source: データソース（ファイルパスまたはURL）
+        source_hash: データソースのハッシュ値
+        offset: データソース内でのチャンクの位置（chunking.get_chunk_offsetの戻り値）
+
+    Returns:
+        チャンクID
+    """
+    source_key = hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+    return f"{source_key}-{source_hash[:12]}-{offset}"
+
+def get_chroma_client(persist_directory):
+    """
+    永続化先フォルダに紐づくChromaクライアントを取得
+    chromadb 0.3系は終了時に各クライアントが自身の内容を書き出すため、
+    同じフォルダに複数のクライアントを作って古い内容で上書きされないよう、フォルダごとにプロセス内で1つだけ作成する
+    """
+    with _chroma_clients_lock:
+        client = _chroma_clients.get(persist_directory)
+        if client is None:
+            settings = Settings(chroma_db_impl="duckdb+parquet", persist_directory=persist_directory, anonymized_telemetry=False)
+            client = chromadb.Client(settings)
+            _chroma_clients[persist_directory] = client
+        return client
 
-            try:
-                docs = loader.load()
-                for doc in docs:
-                    doc.metadata["source"] = file_path
-                documents.extend(docs)
-                updated_metadata[file_path] = file_hash
-            except Exception as e:
-                print(f"Error loading {file_path}: {e}")
-
-    # 更新されたファイルのメタデータのみ保存
-    metadata.update(updated_metadata)
-    save_metadata(metadata)
-    return documents
-
-def create_vector_store(data_path: str):
-    documents = get_all_documents(data_path)
-    if not documents:
-        print("No documents to process.")
+def release_index_dir(index_dir):
+    """
+    インデックスの格納先フォルダに紐づくChromaクライアントを手放す（検索に使わなくなったバージョンに対して呼び出す）
+    終了時の書き出しも解除するため、手放したフォルダは削除してよい
+    （手放す前に取得した参照が残っている間は、メモリ上のコレクションでそのまま検索に応答する）
+
+    Args:
+        index_dir: インデックスの格納先フォルダ
+    """
+    with _chroma_clients_lock:
+        client = _chroma_clients.pop(os.path.join(index_dir, ct.VECTOR_STORE_SUBDIR), None)
+    if client is None:
         return
+    atexit.unregister(client._db.persist)
+    # chromadb 0.3系は検索用の索引（HNSW）をプロセス全体で共有するキャッシュに保持するため、そこからも外す
+    for collection in client.list_collections():
+        client._db.index_cache.pop(collection.id, None)
+
+def copy_vector_store(src_index_dir, dst_index_dir):
+    """
+    ベクターストアの内容を、別の格納先フォルダの新しいコレクションへコピー
+    chromadb 0.3系は検索用の索引をコレクションIDごとにプロセス全体で共有するため、
+    フォルダごとコピーして同じIDのコレクションを2つ開くと、一方への書き込みがもう一方の索引に反映されてしまう
+    （そのため、埋め込み済みのベクトルをAPI経由で、IDの異なるコレクションに追加し直す）
+
+    Args:
+        src_index_dir: コピー元のインデックスの格納先フォルダ
+        dst_index_dir: コピー先のインデックスの格納先フォルダ（ベクターストアは空であること）
+    """
+    src_directory = os.path.join(src_index_dir, ct.VECTOR_STORE_SUBDIR)
+    with _chroma_clients_lock:
+        src_opened = src_directory in _chroma_clients
+    src_client = get_chroma_client(src_directory)
+    try:
+        names = [collection.name for collection in src_client.list_collections()]
+        if ct.VECTOR_STORE_COLLECTION_NAME not in names:
+            return
+        src_collection = src_client.get_collection(ct.VECTOR_STORE_COLLECTION_NAME)
+        dst_client = get_chroma_client(os.path.join(dst_index_dir, ct.VECTOR_STORE_SUBDIR))
+        dst_collection = dst_client.create_collection(ct.VECTOR_STORE_COLLECTION_NAME, metadata=src_collection.metadata)
+        total = src_collection.count()
+        for offset in range(0, total, ct.VECTOR_STORE_COPY_BATCH_SIZE):
+            batch = src_collection.get(
+                limit=ct.VECTOR_STORE_COPY_BATCH_SIZE,
+                offset=offset,
+                include=["embeddings", "documents", "metadatas"],
+            )
+            dst_collection.add(
+                ids=batch["ids"],
+                embeddings=batch["embeddings"],
+                documents=batch["documents"],
+                metadatas=batch["metadatas"],
+            )
+        dst_client.persist()
+    finally:
+        # コピーのためだけに開いたクライアントは手放す（終了時にコピー元へ書き出さない）
+        if not src_opened:
+            release_index_dir(src_index_dir)
+
+def create_index_version(root, base_dir=None):
+    """
+    インデックスの新しいバージョンのフォルダを作成（差分更新の元がある場合は、その内容をコピーする）
 
-    embeddings = OpenAIEmbeddings()
-    text_splitter = RecursiveCharacterTextSplitter()
+    Args:
+        root: バージョンの格納先フォルダ
+        base_dir: 差分更新の元にするインデックスのフォルダ（Noneの場合は空のフォルダ）
+
+    Returns:
+        作成したフォルダのパス
+    """
+    version_dir = index_artifacts.create_version_dir(root, base_dir=base_dir, exclude=[ct.VECTOR_STORE_SUBDIR])
+    if base_dir is not None:
+        try:
+            copy_vector_store(base_dir, version_dir)
+        except Exception:
+            release_index_dir(version_dir)
+            index_artifacts.finish_version_dir(version_dir)
+            raise
+    return version_dir
+
+def open_vector_store(embeddings=None):
+    """
+    永続化済みのベクターストアを開く（存在しない場合は空のコレクションが作成される）
+
+    Args:
+        embeddings: 埋め込みモデル（省略時は設定に応じたキャッシュ付きの埋め込みモデル）
+
+    Returns:
+        Chromaのベクターストア
+    """
+    if embeddings is None:
+        embeddings = embedding.create_embeddings()
+    persist_directory = get_vector_store_dir()
+    return Chroma(
+        client=get_chroma_client(persist_directory),
+        collection_name=ct.VECTOR_STORE_COLLECTION_NAME,
+        embedding_function=embeddings,
+        persist_directory=persist_directory,
+    )
+
+def diff_sources(indexed_sources, source_hashes):
+    """
+    マニフェストに記録済みのデータソースと、現在のデータソースの差分を取得
+
+    Args:
+        indexed_sources: マニフェストの「sources」（{データソース: {"hash", "chunk_ids"}}）
+        source_hashes: {データソース: ハッシュ値} の辞書（build_source_hashesの戻り値）
+
+    Returns:
+        （削除された, 更新された, 追加された）データソースのリストのタプル
+    """
+    removed = [source for source in indexed_sources if source not in source_hashes]
+    modified = [
+        source for source in source_hashes
+        if source in indexed_sources and indexed_sources[source]["hash"] != source_hashes[source]
+    ]
+    added = [source for source in source_hashes if source not in indexed_sources]
+    return removed, modified, added
+
+def sync_vector_store(db, file_hashes, web_hashes, load_sources, sparse_index=None):
+    """
+    マニフェストと現在のデータソースを比較し、変更分のみをベクターストアへ反映
+    - 削除・更新されたデータソースのチャンクは、記録済みのチャンクIDで削除
+    - 追加・更新されたデータソースのみ読み込み・分割・埋め込みを行い追加
+    - 埋め込みモデルやチャンク分割条件が変わった場合は、全件を作り直す
+    - キーワード検索用インデックスにも同じ変更を反映する
+
+    Args:
+        db: open_vector_storeで開いたベクターストア
+        file_hashes: {ファイルパス: ハッシュ値} の辞書（scan_corpusの戻り値）
+        web_hashes: {WebページのURL: 本文のハッシュ値} の辞書（web_fetcher.scan_web_pagesの戻り値）
+        load_sources: データソース（ファイルパスまたはURL）のリストを受け取り、
+            [(データソース, ドキュメントのリスト, エラーメッセージ)] のリストを返す関数
+        sparse_index: キーワード検索用インデックス（省略時は保存済みのものを読み込む。同期後の内容に更新される）
+
+    Returns:
+        同期後のベクターストアと、差分のサマリー（辞書）
+    """
+    current_manifest = build_manifest(file_hashes, web_hashes)
+    saved_manifest = load_metadata()
+    indexed_sources = saved_manifest.get("sources", {})
+
+    # 設定が変わった場合や、マニフェストとコレクションの中身が食い違う場合は全件を作り直す
+    full_rebuild = (
+        not is_manifest_compatible(saved_manifest, current_manifest)
+        or (indexed_sources and db._collection.count() == 0)
+    )
+    if full_rebuild:
+        db.delete_collection()
+        db = open_vector_store(db.embeddings)
+        indexed_sources = {}
+
+    # キーワード検索用インデックスが無い・古い場合は、ベクターストアに保存済みの本文から作り直す（埋め込みは不要）
+    if sparse_index is None:
+        sparse_index = load_sparse_index(get_sparse_index_path())
+    sparse_rebuilt = len(sparse_index) != saved_manifest.get("chunk_count", 0) or full_rebuild
+    if sparse_rebuilt:
+        sparse_index.clear()
+        if not full_rebuild:
+            stored = db._collection.get(include=["documents"])
+            sparse_index.add(stored["ids"], stored["documents"])
+
+    source_hashes = build_source_hashes(file_hashes, web_hashes)
+    removed, modified, added = diff_sources(indexed_sources, source_hashes)
+
+    # 追加・更新されたデータソースのみ読み込み、チャンク分割して追加
+    synced_sources = {source: entry for source, entry in indexed_sources.items() if source in source_hashes}
+    new_chunks = []
+    new_chunk_ids = []
+    chunks_dropped = 0
+    failed = []
+    for source, docs, error in load_sources(added + modified):
+        if error is not None:
+            # 読み込みに失敗したデータソースは次回の同期で再試行する（失敗のログは読み込み側で出力済み）
+            synced_sources.pop(source, None)
+            failed.append(source)
+            continue
+
+        # 文書の構造に沿って、トークン数の上限以内のチャンクに分割（ほぼ空のチャンクは除く）
+        chunks, chunk_report = chunking.split_documents(docs)
+        chunks_dropped += chunk_report["dropped"]
+        chunk_ids = [make_chunk_id(source, source_hashes[source], chunking.get_chunk_offset(chunk)) for chunk in chunks]
+        new_chunks.extend(chunks)
+        new_chunk_ids.extend(chunk_ids)
+        synced_sources[source] = {"hash": source_hashes[source], "chunk_ids": chunk_ids}
+
+    # 埋め込みをまとめて実行できるよう、全データソースのチャンクを一度に追加
+    if new_chunks:
+        db.add_documents(new_chunks, ids=new_chunk_ids)
+        sparse_index.add(new_chunk_ids, [chunk.page_content for chunk in new_chunks])
+    chunks_added = len(new_chunks)
+
+    # 削除・更新されたデータソースの古いチャンクを削除
+    # （途中で失敗した場合も、該当データソースのチャンクが1つもない状態を残さないよう、新しいチャンクを追加してから削除）
+    stale_ids = [chunk_id for source in removed + modified for chunk_id in indexed_sources[source]["chunk_ids"]]
+    if stale_ids:
+        db.delete(ids=stale_ids)
+        sparse_index.remove(stale_ids)
+
+    summary = {
+        "full_rebuild": bool(full_rebuild),
+        "added": len([source for source in added if source not in failed]),
+        "modified": len([source for source in modified if source not in failed]),
+        "deleted": len(removed),
+        "unchanged": len(source_hashes) - len(added) - len(modified),
+        "failed": len(failed),
+        "chunks_added": chunks_added,
+        "chunks_deleted": len(stale_ids),
+        "chunks_dropped": chunks_dropped,
+    }
 
-    texts = []
-    metadatas = []
-    for doc in documents:
-        chunks = text_splitter.split_text(doc.page_content)
-        texts.extend(chunks)
-        metadatas.extend([doc.metadata] * len(chunks))
+    # 変更がなければ永続化・マニフェスト保存は不要
+    if sparse_rebuilt or removed or added or modified:
+        sparse_index.save(get_sparse_index_path())
+    if full_rebuild or removed or added or modified:
+        db.persist()
+        # マニフェストは最後に保存するため、途中で失敗した場合は次回の同期で同じ差分が再処理される
+        manifest = dict(
+            current_manifest,
+            built_at=datetime.now().isoformat(timespec="seconds"),
+            chunk_count=sum(len(entry["chunk_ids"]) for entry in synced_sources.values()),
+            sources=synced_sources,
+            file_stats=saved_manifest.get("file_stats", {}),
+        )
+        # 読み込みに失敗したデータソースが残っている場合は、次回も差分が検出されるようフィンガープリントを無効化
+        if failed:
+            manifest["corpus_fingerprint"] = None
+        save_metadata(manifest)
 
-    Chroma.from_texts(texts, embeddings, metadatas=metadatas)
+    return db, summary
 
-def search_query(query: str, k: int = 5):
-    embeddings = OpenAIEmbeddings()
-    vector_store = Chroma(persist_directory=".chroma", embedding_function=embeddings)
+def search_query(query: str, k: int = ct.RETRIEVER_SEARCH_K):
+    vector_store = open_vector_store()
     results = vector_store.similarity_search(query, k=k)
     return results
 
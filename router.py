@@ -0,0 +1,57 @@
+"""
+このファイルは、ユーザー入力の振り分け（社員情報を参照するかなど）に使うキーワード判定をまとめたファイルです。
+判定用のキーワードは「constants.py」でカテゴリごとに定義し、起動時に1つのオートマトンにまとめておくことで、
+カテゴリやキーワードが増えても入力テキストの走査は1回で済みます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import constants as ct
+from keyword_matcher import KeywordMatcher
+
+
+############################################################
+# 変数定義
+############################################################
+# 全カテゴリのキーワードをまとめたオートマトン（付加情報はカテゴリ名）
+_matcher = KeywordMatcher(
+    (keyword, category)
+    for category, keywords in ct.ROUTING_KEYWORDS.items()
+    for keyword in keywords
+)
+
+
+############################################################
+# 関数定義
+############################################################
+
+def route_message(text):
+    """
+    入力テキストを1回走査し、該当するカテゴリと一致箇所を取得
+
+    Args:
+        text: ユーザー入力値
+
+    Returns:
+        {カテゴリ名: [（開始位置, 終了位置, キーワード）]} の辞書（該当したカテゴリのみ）
+    """
+    routes = {}
+    for start, end, keyword, categories in _matcher.find_all(text or ""):
+        for category in categories:
+            routes.setdefault(category, []).append((start, end, keyword))
+    return routes
+
+
+def has_route(text, category):
+    """
+    入力テキストが指定したカテゴリに該当するかを判定
+
+    Args:
+        text: ユーザー入力値
+        category: カテゴリ名
+
+    Returns:
+        True: 該当する
+    """
+    return category in route_message(text)
@@ -0,0 +1,94 @@
+"""
+このファイルは、メタデータによる検索対象の絞り込み（フィルター）をまとめたファイルです。
+- {"項目": 値 または 値のリスト} 形式のフィルターを、Chromaの検索条件（where）に変換
+- 検索クエリに顧客名が1社分だけ含まれる場合など、絞り込み先が明らかな場合はフィルターを推定
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import unicodedata
+import constants as ct
+from keyword_matcher import KeywordMatcher
+import retriever
+
+
+############################################################
+# 関数定義
+############################################################
+
+def normalize_filter_text(text):
+    # 全角・半角や大文字・小文字の違いを吸収するため、照合用にテキストを正規化
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def build_where_filter(filters):
+    """
+    フィルターを、Chromaの検索条件（where）に変換
+    （chromadb 0.3系は「$in」に対応していないため、複数の値は「$or」で組み合わせる）
+
+    Args:
+        filters: {"項目": 値 または 値のリスト} の辞書（例: {"customer": "クリスタルワークス株式会社"}）
+
+    Returns:
+        Chromaの検索条件（フィルターが空の場合はNone）
+    """
+    conditions = []
+    for key, values in (filters or {}).items():
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        values = list(values)
+        if len(values) == 1:
+            conditions.append({key: values[0]})
+        elif values:
+            conditions.append({"$or": [{key: value} for value in values]})
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+
+def build_filter_matcher(sources):
+    """
+    インデックス済みのデータソースから、フィルターの推定に使うオートマトンを作成
+    顧客名は、法人格を省略した表記（例: 「クリスタルワークス」）も受け付ける
+
+    Args:
+        sources: データソース（ファイルパスまたはURL）のリスト
+
+    Returns:
+        KeywordMatcherのインスタンス（付加情報は（項目, 値）のタプル）
+    """
+    keywords = []
+    for source in sources:
+        customer = retriever.build_source_metadata(source).get("customer")
+        if not customer:
+            continue
+        keywords.append((normalize_filter_text(customer), ("customer", customer)))
+        for suffix in ct.CUSTOMER_NAME_SUFFIXES:
+            alias = customer.replace(suffix, "").strip()
+            if alias != customer and len(alias) >= 2:
+                keywords.append((normalize_filter_text(alias), ("customer", customer)))
+    return KeywordMatcher(keywords)
+
+
+def infer_filters(query, matcher):
+    """
+    検索クエリから、絞り込み先が明らかな場合のみフィルターを推定
+    （複数の顧客名が含まれるなど、どれに絞り込むべきか決められない項目は推定しない）
+
+    Args:
+        query: 検索クエリ
+        matcher: build_filter_matcherで作成したオートマトン
+
+    Returns:
+        フィルター（推定できない場合は空の辞書）
+    """
+    if matcher is None or not len(matcher):
+        return {}
+    candidates = {}
+    for _, _, _, payloads in matcher.find_longest(normalize_filter_text(query)):
+        for key, value in payloads:
+            candidates.setdefault(key, set()).add(value)
+    return {key: values.pop() for key, values in candidates.items() if len(values) == 1}
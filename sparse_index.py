@@ -0,0 +1,191 @@
+"""
+このファイルは、キーワード検索用の疎ベクトルインデックス（BM25）をまとめたファイルです。
+日本語は形態素解析を使わず文字2-gram、英数字は単語単位で分割するため、
+会社名や商品名のような固有名詞も、ベクトル検索より確実に完全一致で拾えます。
+インデックスはベクターストアの同期と同時に更新し、ベクターストアと同じ格納先フォルダに保存します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import heapq
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+import constants as ct
+
+
+############################################################
+# 変数定義
+############################################################
+# 英数字の連続、またはそれ以外の文字（記号・空白を除く）の連続を1つの塊として切り出す
+TOKEN_PATTERN = re.compile(r"[0-9a-z]+|[^\W0-9a-z_]+")
+# 分割方法を変えた場合は値を変え、保存済みのインデックスを作り直す
+TOKENIZER_VERSION = "char-bigram-v1"
+
+
+############################################################
+# 関数定義
+############################################################
+
+def tokenize(text):
+    """
+    テキストを検索用の語に分割
+    - 英数字: 単語単位（例: 「EcoTee Creator」→「ecotee」「creator」）
+    - 日本語など: 文字2-gram（例: 「株式会社」→「株式」「式会」「会社」）
+
+    Args:
+        text: 分割対象のテキスト
+
+    Returns:
+        語のリスト
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for chunk in TOKEN_PATTERN.findall(text):
+        if chunk.isascii() or len(chunk) == 1:
+            tokens.append(chunk)
+        else:
+            tokens.extend(chunk[i:i + 2] for i in range(len(chunk) - 1))
+    return tokens
+
+
+def load_sparse_index(path):
+    """
+    保存済みの疎ベクトルインデックスを読み込む
+    （存在しない場合や、分割方法が変わった場合は空のインデックスを返す）
+
+    Args:
+        path: 保存先のファイルパス
+
+    Returns:
+        SparseIndexのインスタンス
+    """
+    index = SparseIndex()
+    if not os.path.exists(path):
+        return index
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("tokenizer") != TOKENIZER_VERSION:
+        return index
+    for chunk_id, term_counts in data["documents"].items():
+        index._add_terms(chunk_id, term_counts)
+    return index
+
+
+############################################################
+# クラス定義
+############################################################
+
+class SparseIndex:
+    """
+    チャンクID単位のBM25インデックス
+    チャンクの本文は持たず（本文はベクターストアから取得）、語ごとの出現回数のみを保持する
+    """
+
+    def __init__(self):
+        # チャンクIDごとの {語: 出現回数}（削除・保存用）
+        self._documents = {}
+        # 語ごとの {チャンクID: 出現回数}（検索用の転置インデックス）
+        self._postings = {}
+        # チャンクIDごとの語数と、その合計
+        self._lengths = {}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self._documents
+
+    def _add_terms(self, chunk_id, term_counts):
+        # 語ごとの出現回数を登録
+        self._documents[chunk_id] = term_counts
+        self._lengths[chunk_id] = sum(term_counts.values())
+        self._total_length += self._lengths[chunk_id]
+        for term, count in term_counts.items():
+            self._postings.setdefault(term, {})[chunk_id] = count
+
+    def add(self, chunk_ids, texts):
+        """
+        チャンクを追加（同じIDのチャンクがある場合は置き換え）
+
+        Args:
+            chunk_ids: チャンクIDのリスト
+            texts: チャンク本文のリスト
+        """
+        for chunk_id, text in zip(chunk_ids, texts):
+            self.remove([chunk_id])
+            self._add_terms(chunk_id, dict(Counter(tokenize(text))))
+
+    def remove(self, chunk_ids):
+        """
+        チャンクを削除（存在しないIDは無視）
+
+        Args:
+            chunk_ids: チャンクIDのリスト
+        """
+        for chunk_id in chunk_ids:
+            term_counts = self._documents.pop(chunk_id, None)
+            if term_counts is None:
+                continue
+            self._total_length -= self._lengths.pop(chunk_id)
+            for term in term_counts:
+                postings = self._postings[term]
+                del postings[chunk_id]
+                if not postings:
+                    del self._postings[term]
+
+    def clear(self):
+        # 全チャンクを削除
+        self._documents.clear()
+        self._postings.clear()
+        self._lengths.clear()
+        self._total_length = 0
+
+    def search(self, query, k, allowed_ids=None):
+        """
+        BM25のスコアが高い順にチャンクを検索
+
+        Args:
+            query: 検索クエリ
+            k: 取得件数
+            allowed_ids: 検索対象とするチャンクIDの集合（Noneの場合は全チャンク）
+
+        Returns:
+            [(チャンクID, スコア)] のリスト（スコアの降順）
+        """
+        if not self._documents:
+            return []
+        document_count = len(self._documents)
+        average_length = self._total_length / document_count
+        k1, b = ct.BM25_K1, ct.BM25_B
+
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (document_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, count in postings.items():
+                if allowed_ids is not None and chunk_id not in allowed_ids:
+                    continue
+                norm = k1 * (1 - b + b * self._lengths[chunk_id] / average_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * count * (k1 + 1) / (count + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def save(self, path):
+        """
+        インデックスをファイルに保存（一時ファイルに書いてから置き換える）
+
+        Args:
+            path: 保存先のファイルパス
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"tokenizer": TOKENIZER_VERSION, "documents": self._documents}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
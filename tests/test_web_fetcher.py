@@ -0,0 +1,185 @@
+"""
+このファイルは、Webページの取得（web_fetcher.py）を、ローカルに立てたHTTPサーバーを相手に確認するテストです。
+- ETag・Last-Modifiedを使った条件付きリクエストによる再検証
+- 読み込みのタイムアウト
+- サーバーが停止している場合の、キャッシュへのフォールバック
+- 同時に取得するページ数の上限
+
+実行方法（リポジトリのルートで）:
+    python -m unittest discover tests
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import constants as ct
+import web_fetcher
+
+
+############################################################
+# クラス定義
+############################################################
+
+class StandInServer:
+    """
+    テスト用のWebサーバー
+    パスごとに応答を切り替え、受け取ったリクエストのヘッダーと、同時に処理したリクエスト数の最大値を記録する
+    - 「/etag」: ETagで再検証できるページ（本文はbodyで差し替え可能）
+    - 「/last-modified」: Last-Modifiedで再検証できるページ
+    - 「/slow...」: slow_seconds秒待ってから応答するページ
+    """
+
+    def __init__(self):
+        self.body = "<html lang='ja'><head><title>テスト</title></head><body>初版の内容です。</body></html>"
+        self.slow_seconds = 0.3
+        self.requests = []
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self._server.server_address[1]}{path}"
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with server._lock:
+                    server.active += 1
+                    server.peak = max(server.peak, server.active)
+                    server.requests.append((self.path, dict(self.headers)))
+                try:
+                    self._respond()
+                finally:
+                    with server._lock:
+                        server.active -= 1
+
+            def _respond(self):
+                body = server.body.encode("utf-8")
+                etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+                last_modified = "Wed, 01 Jan 2025 00:00:00 GMT"
+                if self.path.startswith("/slow"):
+                    time.sleep(server.slow_seconds)
+                if self.path == "/etag" and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                if self.path == "/last-modified" and self.headers.get("If-Modified-Since") == last_modified:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                if self.path == "/etag":
+                    self.send_header("ETag", etag)
+                if self.path == "/last-modified":
+                    self.send_header("Last-Modified", last_modified)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+class WebFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer()
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_revalidates_with_etag(self):
+        url = self.server.url("/etag")
+        first = web_fetcher.fetch_page(url, cache_dir=self.cache_dir)
+        second = web_fetcher.fetch_page(url, cache_dir=self.cache_dir)
+
+        self.assertEqual(first["status"], "fetched")
+        self.assertEqual(second["status"], "not_modified")
+        self.assertEqual(second["body"], first["body"])
+        self.assertIn("If-None-Match", self.server.requests[-1][1])
+
+        # 本文が変わった場合は取得し直し、キャッシュも更新する
+        self.server.body = self.server.body.replace("初版", "改訂版")
+        third = web_fetcher.fetch_page(url, cache_dir=self.cache_dir)
+        self.assertEqual(third["status"], "fetched")
+        self.assertIn("改訂版".encode("utf-8"), third["body"])
+        self.assertEqual(web_fetcher.load_cached_page(url, self.cache_dir)[0], third["body"])
+
+    def test_revalidates_with_last_modified(self):
+        url = self.server.url("/last-modified")
+        web_fetcher.fetch_page(url, cache_dir=self.cache_dir)
+        second = web_fetcher.fetch_page(url, cache_dir=self.cache_dir)
+
+        self.assertEqual(second["status"], "not_modified")
+        self.assertEqual(self.server.requests[-1][1].get("If-Modified-Since"), "Wed, 01 Jan 2025 00:00:00 GMT")
+
+    def test_scan_hash_changes_only_with_content(self):
+        url = self.server.url("/etag")
+        first = web_fetcher.scan_web_pages([url], cache_dir=self.cache_dir)
+        unchanged = web_fetcher.scan_web_pages([url], cache_dir=self.cache_dir)
+        self.server.body = self.server.body.replace("初版", "改訂版")
+        changed = web_fetcher.scan_web_pages([url], cache_dir=self.cache_dir)
+
+        self.assertEqual(first, unchanged)
+        self.assertNotEqual(first[url], changed[url])
+
+    def test_read_timeout(self):
+        self.server.slow_seconds = 2
+        url = self.server.url("/slow")
+        start = time.perf_counter()
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            web_fetcher.fetch_page(url, cache_dir=self.cache_dir, timeout=(1, 0.3))
+        self.assertLess(time.perf_counter() - start, 1.5)
+
+    def test_falls_back_to_cache_when_server_is_down(self):
+        url = self.server.url("/etag")
+        fetched = web_fetcher.fetch_page(url, cache_dir=self.cache_dir)
+        self.server.stop()
+
+        cached = web_fetcher.fetch_page(url, cache_dir=self.cache_dir, timeout=(1, 1))
+        self.assertEqual(cached["status"], "cached")
+        self.assertEqual(cached["body"], fetched["body"])
+
+        # キャッシュがない場合は、取得時の例外をそのまま返す
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            web_fetcher.fetch_page(self.server.url("/last-modified"), cache_dir=self.cache_dir, timeout=(1, 1))
+
+    def test_limits_concurrent_fetches(self):
+        urls = [self.server.url(f"/slow{i}") for i in range(ct.WEB_FETCH_MAX_CONCURRENCY * 3)]
+        with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+            pages = list(executor.map(lambda url: web_fetcher.fetch_page(url, cache_dir=self.cache_dir), urls))
+
+        self.assertTrue(all(page["status"] == "fetched" for page in pages))
+        self.assertLessEqual(self.server.peak, ct.WEB_FETCH_MAX_CONCURRENCY)
+        self.assertGreater(self.server.peak, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
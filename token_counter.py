@@ -0,0 +1,101 @@
+"""
+このファイルは、LLMに送るテキストのトークン数を数える処理をまとめたファイルです。
+モデルに対応したtiktokenのエンコーディングを使い、取得できない環境（オフラインなど）では文字数から概算します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import logging
+from functools import lru_cache
+import tiktoken
+import constants as ct
+
+
+############################################################
+# 関数定義
+############################################################
+
+@lru_cache(maxsize=None)
+def get_encoding(model=ct.MODEL):
+    """
+    モデルに対応したtiktokenのエンコーディングを取得（プロセス内で1回のみ読み込む）
+
+    Args:
+        model: モデル名
+
+    Returns:
+        エンコーディング。取得できない場合はNone（文字数から概算する）
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # tiktokenが対応していないモデル名の場合は、汎用のエンコーディングを使う
+        try:
+            return tiktoken.get_encoding(ct.DEFAULT_TOKEN_ENCODING)
+        except Exception as e:
+            error = e
+    except Exception as e:
+        error = e
+    logging.getLogger(ct.LOGGER_NAME).warning(f"トークナイザーを読み込めないため、トークン数は文字数から概算します。（{type(error).__name__}）")
+    return None
+
+
+def estimate_tokens(text):
+    # 日本語などは1文字≒1トークン、英数字・記号は4文字≒1トークンとして概算
+    ascii_count = sum(1 for char in text if char.isascii())
+    return (len(text) - ascii_count) + (ascii_count + 3) // 4
+
+
+def count_tokens(text, model=ct.MODEL):
+    """
+    テキストのトークン数を取得
+
+    Args:
+        text: 対象のテキスト
+        model: モデル名
+
+    Returns:
+        トークン数
+    """
+    if not text:
+        return 0
+    encoding = get_encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens, model=ct.MODEL, keep_end=False):
+    """
+    テキストを、指定したトークン数以内に切り詰める
+
+    Args:
+        text: 対象のテキスト
+        max_tokens: トークン数の上限
+        model: モデル名
+        keep_end: True: 末尾側を残す、False: 先頭側を残す
+
+    Returns:
+        切り詰めたテキスト（上限以内の場合はそのまま）
+    """
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    encoding = get_encoding(model)
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        tokens = tokens[-max_tokens:] if keep_end else tokens[:max_tokens]
+        return encoding.decode(tokens)
+
+    # 概算の場合は、1文字ずつ数えて上限に達するまでの範囲を残す
+    chars = reversed(text) if keep_end else text
+    used = 0.0
+    length = 0
+    for char in chars:
+        used += 0.25 if char.isascii() else 1.0
+        if used > max_tokens:
+            break
+        length += 1
+    return text[len(text) - length:] if keep_end else text[:length]
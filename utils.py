@@ -6,16 +6,23 @@
 # ライブラリの読み込み
 ############################################################
 import os
+import logging
+import httpx
 from dotenv import load_dotenv
 import streamlit as st
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.schema import HumanMessage
+from langchain_core.output_parsers import StrOutputParser
 from langchain_openai import ChatOpenAI
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
+from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.runnables import RunnableLambda
 import constants as ct
 import pandas as pd
 from retriever import normalize_column_names
+from query_condenser import create_condensing_retriever, is_standalone_query
+from answer_cache import get_answer_cache, normalize_query
+from router import has_route
+from context_packer import pack_context
 
 
 ############################################################
@@ -94,18 +101,72 @@ def add_employee_context(chat_message, employee_context):
     return chat_message
 
 
-def get_llm_response(chat_message, employee_context=""):
+@st.cache_resource(show_spinner=False)
+def get_http_client():
     """
-    LLMからの回答取得
+    LLMへのリクエストに使う、プロセス全体で共有するHTTPクライアントを取得
+    接続を使い回す（keep-alive）ことで、メッセージごとの接続確立のコストを省く
+
+    Returns:
+        httpxのクライアント
+    """
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=ct.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=ct.HTTP_MAX_KEEPALIVE_CONNECTIONS
+        ),
+        timeout=ct.HTTP_TIMEOUT
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_llm(model, temperature):
+    """
+    モデル・温度ごとに、共有のHTTPクライアントを使うLLMのオブジェクトを取得
 
     Args:
-        chat_message: ユーザー入力値
+        model: モデル名
+        temperature: 温度
 
     Returns:
-        LLMからの回答
+        LLMのオブジェクト
+    """
+    return ChatOpenAI(model_name=model, temperature=temperature, http_client=get_http_client())
+
+
+def get_rag_chain(mode, retriever):
+    """
+    モード・モデル・温度・Retrieverの組み合わせごとに作成済みのChainを取得
+    （同じ組み合わせでは、Chainを作り直さずに使い回す）
+
+    Args:
+        mode: 回答モード
+        retriever: ベクターストアを検索するRetriever
+
+    Returns:
+        会話履歴を考慮して検索・回答生成を行うChain
+    """
+    return create_rag_chain(mode, ct.MODEL, ct.TEMPERATURE, id(retriever), retriever)
+
+
+@st.cache_resource(show_spinner=False, max_entries=ct.CHAIN_REGISTRY_MAX_ENTRIES)
+def create_rag_chain(mode, model, temperature, retriever_id, _retriever):
+    """
+    「RAG x 会話履歴の記憶機能」を実現するためのChainを作成
+    引数の組み合わせごとに1回のみ実行され、結果はプロセス全体で共有される
+
+    Args:
+        mode: 回答モード
+        model: モデル名
+        temperature: 温度
+        retriever_id: Retrieverの識別子（キャッシュのキーとして使用）
+        _retriever: ベクターストアを検索するRetriever（キャッシュのキーには含めない）
+
+    Returns:
+        会話履歴を考慮して検索・回答生成を行うChain
     """
     # LLMのオブジェクトを用意
-    llm = ChatOpenAI(model_name=ct.MODEL, temperature=ct.TEMPERATURE)
+    llm = get_llm(model, temperature)
 
     # 会話履歴なしでもLLMに理解してもらえる、独立した入力テキストを取得するためのプロンプトテンプレートを作成
     question_generator_template = ct.SYSTEM_PROMPT_CREATE_INDEPENDENT_TEXT
@@ -118,7 +179,7 @@ def get_llm_response(chat_message, employee_context=""):
     )
 
     # モードによってLLMから回答を取得する用のプロンプトを変更
-    if st.session_state.mode == ct.ANSWER_MODE_1:
+    if mode == ct.ANSWER_MODE_1:
         # モードが「社内文書検索」の場合のプロンプト
         question_answer_template = ct.SYSTEM_PROMPT_DOC_SEARCH
     else:
@@ -135,26 +196,183 @@ def get_llm_response(chat_message, employee_context=""):
     )
 
     # 会話履歴なしでもLLMに理解してもらえる、独立した入力テキストを取得するためのRetrieverを作成
-    history_aware_retriever = create_history_aware_retriever(
-        llm, st.session_state.retriever, question_generator_prompt
-    )
+    # （初回の質問や単独で意味が通じる質問では、書き換えのLLM呼び出しを省略する）
+    # 取得した候補チャンクは、トークン数の予算内に収まるよう関連度順に選択・結合してからプロンプトに含める
+    history_aware_retriever = create_condensing_retriever(
+        llm, _retriever, question_generator_prompt
+    ) | RunnableLambda(pack_context)
 
     # LLMから回答を取得する用のChainを作成
-    question_answer_chain = create_stuff_documents_chain(llm, question_answer_prompt)
+    question_answer_chain = create_stuff_documents_chain(
+        llm, question_answer_prompt, document_separator=ct.CONTEXT_DOCUMENT_SEPARATOR
+    )
     # 「RAG x 会話履歴の記憶機能」を実現するためのChainを作成
-    chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
+    return create_retrieval_chain(history_aware_retriever, question_answer_chain)
+
+
+def summarize_conversation(summary, conversation, max_tokens):
+    """
+    これまでの会話の要約と、その後のやりとりから、新しい要約をLLMで作成
+
+    Args:
+        summary: これまでの会話の要約（ない場合は空文字）
+        conversation: 要約に含めるやりとりのテキスト
+        max_tokens: 要約のトークン数の上限
+
+    Returns:
+        新しい要約
+    """
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", ct.SYSTEM_PROMPT_SUMMARIZE_HISTORY),
+            ("human", "{conversation}")
+        ]
+    )
+    chain = prompt | get_llm(ct.MODEL, ct.MEMORY_SUMMARY_TEMPERATURE) | StrOutputParser()
+    return chain.invoke({"summary": summary or "（なし）", "conversation": conversation, "max_tokens": max_tokens})
+
+
+def add_to_memory(question, answer):
+    """
+    やりとりを会話履歴に追加（上限を超えた古いやりとりは要約にまとめる）
+
+    Args:
+        question: ユーザー入力値（社員情報を付加する前のもの）
+        answer: LLMからの回答
+    """
+    st.session_state.conversation_memory.add_turn(question, answer, summarize=summarize_conversation)
+
+
+def is_answer_cacheable(chat_message, employee_context=""):
+    """
+    回答キャッシュを利用できる質問かどうかを判定
+    社員情報を付加した質問や、会話履歴を前提にした質問は、ユーザー間で回答を共有できないため対象外
+
+    Args:
+        chat_message: ユーザー入力値
+        employee_context: 社員情報
+
+    Returns:
+        True: 回答キャッシュを利用できる
+    """
+    if not ct.ANSWER_CACHE_ENABLED or employee_context:
+        return False
+    return not len(st.session_state.conversation_memory) or is_standalone_query(chat_message)
+
+
+def embed_cache_query(chat_message):
+    # 回答キャッシュの検索用に、正規化した質問文を埋め込む（インデックスと同じ埋め込みモデルを使用）
+    embeddings = st.session_state.retriever.vectorstore.embeddings
+    return embeddings.embed_query(normalize_query(chat_message))
+
+
+def get_cached_llm_response(chat_message, employee_context=""):
+    """
+    回答キャッシュから、ほぼ同じ質問に対する回答を取得
+
+    Args:
+        chat_message: ユーザー入力値
+        employee_context: 社員情報
+
+    Returns:
+        LLMからの回答と同じ形式の辞書。キャッシュにない場合はNone
+    """
+    if not is_answer_cacheable(chat_message, employee_context):
+        return None
+
+    index_version = st.session_state.retriever.metadata["index_version"]
+    llm_response = get_answer_cache().lookup(st.session_state.mode, index_version, embed_cache_query(chat_message))
+    if llm_response is None:
+        return None
+
+    logging.getLogger(ct.LOGGER_NAME).info({"answer_cache": "hit", "message": chat_message})
+    # LLMから回答を取得した場合と同じく、会話履歴に追加
+    add_to_memory(chat_message, llm_response["answer"])
+    return llm_response
+
+
+def store_llm_response_in_cache(chat_message, llm_response):
+    """
+    LLMからの回答を回答キャッシュに保存
+
+    Args:
+        chat_message: ユーザー入力値（社員情報を付加する前のもの）
+        llm_response: LLMからの回答
+    """
+    index_version = st.session_state.retriever.metadata["index_version"]
+    get_answer_cache().store(st.session_state.mode, index_version, embed_cache_query(chat_message), llm_response)
+
+
+def get_llm_response(chat_message, employee_context=""):
+    """
+    LLMからの回答取得
+
+    Args:
+        chat_message: ユーザー入力値
+
+    Returns:
+        LLMからの回答
+    """
+    chain = get_rag_chain(st.session_state.mode, st.session_state.retriever)
+
+    # 回答キャッシュの対象かどうかは、会話履歴に今回の質問を追加する前に判定
+    cacheable = is_answer_cacheable(chat_message, employee_context)
 
     # プロンプトの前処理として、社員データがある場合にチャット入力に先行して付与
+    question = chat_message
     chat_message = add_employee_context(chat_message, employee_context)
 
     # LLMへのリクエストとレスポンス取得
-    llm_response = chain.invoke({"input": chat_message, "chat_history": st.session_state.chat_history})
-    # LLMレスポンスを会話履歴に追加
-    st.session_state.chat_history.extend([HumanMessage(content=chat_message), llm_response["answer"]])
+    # （「question」は、検索クエリの書き換え要否の判定に使う元の質問）
+    llm_response = chain.invoke({"input": chat_message, "chat_history": st.session_state.conversation_memory.messages(), "question": question})
+    # LLMレスポンスを会話履歴に追加（社員情報は質問ごとに付け直すため、元の質問を記録）
+    add_to_memory(question, llm_response["answer"])
+    # 同じ質問に再利用できるよう、回答キャッシュに保存
+    if cacheable:
+        store_llm_response_in_cache(question, llm_response)
 
     return llm_response
 
 
+def stream_llm_response(chat_message, employee_context=""):
+    """
+    LLMからの回答を、生成されたそばから順次取得（ストリーミング）
+
+    Args:
+        chat_message: ユーザー入力値
+        employee_context: 社員情報
+
+    Yields:
+        ("context", 検索で取得したドキュメントのリスト) を検索完了時に1回、
+        ("answer", 回答の断片) を回答の生成中に順次返す
+    """
+    chain = get_rag_chain(st.session_state.mode, st.session_state.retriever)
+
+    # 回答キャッシュの対象かどうかは、会話履歴に今回の質問を追加する前に判定
+    cacheable = is_answer_cacheable(chat_message, employee_context)
+
+    # プロンプトの前処理として、社員データがある場合にチャット入力に先行して付与
+    question = chat_message
+    chat_message = add_employee_context(chat_message, employee_context)
+
+    # 検索結果は取得が完了した時点で、回答は生成されたトークンから順に返す
+    answer = ""
+    context = []
+    for chunk in chain.stream({"input": chat_message, "chat_history": st.session_state.conversation_memory.messages(), "question": question}):
+        if "context" in chunk:
+            context = chunk["context"]
+            yield "context", context
+        if "answer" in chunk:
+            answer += chunk["answer"]
+            yield "answer", chunk["answer"]
+
+    # 回答の生成が完了してから、一括取得時と同じく元の質問で会話履歴に追加
+    add_to_memory(question, answer)
+    # 同じ質問に再利用できるよう、回答キャッシュに保存
+    if cacheable:
+        store_llm_response_in_cache(question, {"answer": answer, "context": context})
+
+
 def format_row(row):
     """
     従業員の情報をフォーマットして1人分の文字列を作成
@@ -223,8 +441,7 @@ def should_use_employee_data(user_input: str, mode: str) -> bool:
     if mode != ct.ANSWER_MODE_2:  # 社内問い合わせ でない場合は使わない
         return False
 
-    employee_keywords = ["人事", "従業員", "社員", "部署", "役職", "スキルセット"]
-    return any(kw in user_input for kw in employee_keywords)
+    return has_route(user_input, "employee")
 
 def debug_log(message):
     """
@@ -253,14 +470,5 @@ def is_employee_related_mode_and_input() -> bool:
     if st.session_state.get("mode") != ct.ANSWER_MODE_2:
         return False
 
-    guidance_keywords = [
-        "人事部に所属",
-        "部署に所属",
-        "従業員のスキルセット",
-        "従業員情報",
-        "社員情報",
-        "部署情報"
-    ]
-
     current_input = st.session_state.get("input_message", "")
-    return any(keyword in current_input for keyword in guidance_keywords)
+    return has_route(current_input, "employee_guidance")
@@ -0,0 +1,235 @@
+"""
+このファイルは、RAGの参照先となるWebページの取得をまとめたファイルです。
+- 取得したページはディスクにキャッシュし、次回以降はETag・Last-Modifiedを使った条件付きリクエストで確認する
+  （変更がなければ本文を再取得しない）
+- 1ページごとに接続・読み込みのタイムアウトを設け、同時に取得するページ数にも上限を設ける
+- 取得に失敗した場合（オフライン環境・サイトの障害など）は、キャッシュ済みの内容で読み込みを続ける
+- インデックスの差分同期では、条件付きリクエストで確認した本文のハッシュ値を、ページの変更の判定に使う
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import json
+import hashlib
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import requests
+from bs4 import BeautifulSoup
+from langchain_core.documents import Document
+import constants as ct
+
+
+############################################################
+# 変数定義
+############################################################
+# 同時に取得するWebページ数の上限（読み込みのスレッド数とは別に、サイトへの負荷を抑える）
+_semaphore = threading.BoundedSemaphore(ct.WEB_FETCH_MAX_CONCURRENCY)
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_cache_paths(url, cache_dir=ct.WEB_CACHE_DIR):
+    """
+    URLに対応するキャッシュファイルのパスを取得
+
+    Args:
+        url: WebページのURL
+        cache_dir: キャッシュの保存先フォルダ
+
+    Returns:
+        （本文のファイルパス, 応答ヘッダーなどを記録するファイルパス）のタプル
+    """
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+    return os.path.join(cache_dir, f"{key}.body"), os.path.join(cache_dir, f"{key}.json")
+
+
+def load_cached_page(url, cache_dir=ct.WEB_CACHE_DIR):
+    """
+    キャッシュ済みのWebページを読み込む
+
+    Args:
+        url: WebページのURL
+        cache_dir: キャッシュの保存先フォルダ
+
+    Returns:
+        （本文のバイト列, 記録した情報の辞書）のタプル。キャッシュがない場合はNone
+    """
+    body_path, meta_path = get_cache_paths(url, cache_dir)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(body_path, "rb") as f:
+            body = f.read()
+    except (OSError, ValueError):
+        return None
+    # 別のURLのキャッシュを誤って使わないよう確認
+    if meta.get("url") != url:
+        return None
+    return body, meta
+
+
+def save_cached_page(url, body, meta, cache_dir=ct.WEB_CACHE_DIR):
+    """
+    Webページをキャッシュに保存（一時ファイルに書いてから置き換える）
+
+    Args:
+        url: WebページのURL
+        body: 本文のバイト列
+        meta: 記録する情報（ETag・Last-Modified・文字コードなど）の辞書
+        cache_dir: キャッシュの保存先フォルダ
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    body_path, meta_path = get_cache_paths(url, cache_dir)
+    # 本文を先に置き換える（途中で中断した場合、古い情報のまま次回に本文を取り直す）
+    tmp_suffix = f".{threading.get_ident()}.tmp"
+    with open(body_path + tmp_suffix, "wb") as f:
+        f.write(body)
+    os.replace(body_path + tmp_suffix, body_path)
+    with open(meta_path + tmp_suffix, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(meta_path + tmp_suffix, meta_path)
+
+
+def fetch_page(url, cache_dir=ct.WEB_CACHE_DIR, timeout=None, session=None):
+    """
+    Webページを取得（キャッシュがあれば条件付きリクエストで確認し、取得に失敗した場合はキャッシュを使う）
+
+    Args:
+        url: WebページのURL
+        cache_dir: キャッシュの保存先フォルダ
+        timeout: （接続, 読み込み）のタイムアウト秒数（省略時は ct.WEB_FETCH_TIMEOUT）
+        session: requestsのセッション（省略時は1回限りの接続）
+
+    Returns:
+        {"url", "body"（本文のバイト列）, "encoding", "status"} の辞書
+        statusは「fetched」: 取得した、「not_modified」: 変更がなくキャッシュを使った、
+        「cached」: 取得に失敗したためキャッシュを使った
+
+    Raises:
+        取得に失敗し、キャッシュもない場合は取得時の例外
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+    if timeout is None:
+        timeout = ct.WEB_FETCH_TIMEOUT
+    cached = load_cached_page(url, cache_dir)
+
+    headers = {"User-Agent": os.environ.get("USER_AGENT", ct.WEB_FETCH_USER_AGENT)}
+    if cached is not None:
+        _, meta = cached
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        with _semaphore:
+            response = (session or requests).get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and cached is not None:
+            body, meta = cached
+            return {"url": url, "body": body, "encoding": meta.get("encoding"), "status": "not_modified"}
+        response.raise_for_status()
+    except Exception as e:
+        if cached is None:
+            raise
+        body, meta = cached
+        logger.warning(f"Webページを取得できなかったため、キャッシュ（{meta.get('fetched_at')}取得）を使います: {url}\n{type(e).__name__}: {e}")
+        return {"url": url, "body": body, "encoding": meta.get("encoding"), "status": "cached"}
+
+    # 文字コードは、応答ヘッダーで指定がなければ本文から推定する（WebBaseLoaderと同じ扱い）
+    encoding = response.apparent_encoding if "charset" not in response.headers.get("Content-Type", "") else response.encoding
+    meta = {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "encoding": encoding,
+        "fetched_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    try:
+        save_cached_page(url, response.content, meta, cache_dir)
+    except OSError as e:
+        logger.warning(f"Webページのキャッシュを保存できませんでした: {url}\n{e}")
+    return {"url": url, "body": response.content, "encoding": encoding, "status": "fetched"}
+
+
+def scan_web_pages(urls, cache_dir=ct.WEB_CACHE_DIR, timeout=None):
+    """
+    各Webページを条件付きリクエストで確認し、本文のハッシュ値を取得（インデックスの差分同期での変更の判定に使う）
+    変更がなければ（304）キャッシュ済みの本文、変更があれば（200）取得し直した本文のハッシュ値になる
+
+    Args:
+        urls: WebページのURL一覧
+        cache_dir: キャッシュの保存先フォルダ
+        timeout: （接続, 読み込み）のタイムアウト秒数（省略時は ct.WEB_FETCH_TIMEOUT）
+
+    Returns:
+        {URL: 本文のハッシュ値} の辞書（取得できず、キャッシュもないページは含まない）
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    def scan_page(url):
+        try:
+            page = fetch_page(url, cache_dir=cache_dir, timeout=timeout)
+        except Exception as e:
+            # 次回の同期で改めて確認する
+            logger.warning(f"Webページの変更を確認できませんでした: {url}\n{type(e).__name__}: {e}")
+            return url, None
+        return url, hashlib.sha256(page["body"]).hexdigest()
+
+    # 同時に取得するページ数は、fetch_pageのセマフォで上限を設けている
+    with ThreadPoolExecutor(max_workers=ct.WEB_FETCH_MAX_CONCURRENCY) as executor:
+        results = list(executor.map(scan_page, urls))
+    return {url: page_hash for url, page_hash in results if page_hash is not None}
+
+
+def parse_page(url, body, encoding=None):
+    """
+    Webページの本文（HTML）から、テキストとメタデータを取り出す
+
+    Args:
+        url: WebページのURL
+        body: 本文のバイト列
+        encoding: 文字コード（省略時はUTF-8）
+
+    Returns:
+        ドキュメントのリスト（1ページ1件）
+    """
+    soup = BeautifulSoup(body.decode(encoding or "utf-8", errors="replace"), "html.parser")
+    # WebBaseLoaderと同じメタデータ（タイトル・説明・言語）を付加
+    metadata = {"source": url}
+    if title := soup.find("title"):
+        metadata["title"] = title.get_text()
+    if description := soup.find("meta", attrs={"name": "description"}):
+        metadata["description"] = description.get("content", "No description found.")
+    if html := soup.find("html"):
+        metadata["language"] = html.get("lang", "No language found.")
+    return [Document(page_content=soup.get_text(), metadata=metadata)]
+
+
+def load_web_page(url, cache_dir=ct.WEB_CACHE_DIR, timeout=None):
+    """
+    Webページを取得し、ドキュメントとして読み込む
+
+    Args:
+        url: WebページのURL
+        cache_dir: キャッシュの保存先フォルダ
+        timeout: （接続, 読み込み）のタイムアウト秒数（省略時は ct.WEB_FETCH_TIMEOUT）
+
+    Returns:
+        ドキュメントのリスト
+    """
+    start = time.perf_counter()
+    page = fetch_page(url, cache_dir=cache_dir, timeout=timeout)
+    logging.getLogger(ct.LOGGER_NAME).info({"web_fetch": {
+        "url": url,
+        "status": page["status"],
+        "bytes": len(page["body"]),
+        "seconds": round(time.perf_counter() - start, 3),
+    }})
+    return parse_page(url, page["body"], page["encoding"])